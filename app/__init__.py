@@ -14,17 +14,72 @@ def create_app():
 
     app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-secret")
 
+    # request, query and template timings for /metrics
+    from app.metrics import init_metrics
+    init_metrics(app)
+
+    # versioned schema migrations (flask db upgrade, MIGRATE_ON_STARTUP=1)
+    from app.migrations import init_migrations
+    init_migrations(app)
+
+    # app-scoped database connection pool, shared by every blueprint
+    from app.db import init_pool
+    init_pool(app)
+
+    # read replicas for the read-only pages (REPLICA_DSNS)
+    from app.replicas import init_replicas
+    init_replicas(app)
+
+    # thread pool for the sliced aggregations (AGGREGATION_MODE=auto|single|parallel)
+    from app.aggregation import init_aggregation
+    init_aggregation(app)
+
+    # query-result cache (CACHE_BACKEND=memory|redis|none)
+    from app.cache import init_cache
+    init_cache(app)
+
+    # server-side sessions (SESSION_BACKEND=memory|redis|cookie)
+    from app.sessions import init_sessions
+    init_sessions(app)
+
+    # login attempt throttling (LOGIN_LIMIT_BACKEND=memory|redis|none)
+    from app.ratelimit import init_limiter
+    init_limiter(app)
+
+    # login and role checks for every route, before the view runs
+    from app.authz import init_authz
+    init_authz(app)
+
+    # fingerprinted, long-lived static file URLs
+    from app.httpcache import init_http_cache
+    init_http_cache(app)
+
     # import and register blueprints
     from app.auth import auth_bp
     from app.employees import employees_bp
     from app.projects import projects_bp
     from app.employeeManagement import employee_management_bp
     from app.managers import managers_bp  # ADD THIS LINE
+    from app.monitoring import monitoring_bp
+    from app.bulk import bulk_bp
+    from app.jobs import jobs_bp, init_jobs
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(employees_bp)
     app.register_blueprint(projects_bp)
     app.register_blueprint(employee_management_bp)
     app.register_blueprint(managers_bp)  # ADD THIS LINE
+    app.register_blueprint(monitoring_bp)
+    app.register_blueprint(bulk_bp)
+    app.register_blueprint(jobs_bp)
+
+    # background import/export jobs (JOB_WORKERS processes)
+    init_jobs(app)
+
+    # flask CLI commands
+    from app.stats import stats_cli
+    from app.partitioning import works_on_cli
+    app.cli.add_command(stats_cli)
+    app.cli.add_command(works_on_cli)
 
     return app
@@ -0,0 +1,145 @@
+import os
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, g
+from psycopg.pq import TransactionStatus
+from psycopg_pool import PoolTimeout, TooManyRequests
+from app.db import get_db_connection
+
+# Parallel aggregation for the large GROUP BYs over Works_On. Instead of one
+# query, the work is split into slices (key ranges holding about as many
+# rows each, or one slice per partition when Works_On is partitioned, see
+# app/partitioning.py) that run
+# at the same time on a thread pool, each on its own pooled connection. The
+# partial counts and sums are merged here. Each slice reads its own snapshot,
+# so a write landing mid-way can show up in some slices only; that is fine
+# for dashboard totals, and the result cache is invalidated by it anyway.
+#
+# Small tables are faster as the single query: with AGGREGATION_MODE=auto the
+# slices are only used above AGGREGATION_MIN_ROWS estimated Works_On rows.
+#
+# The slices share the pool the requests use. A slice only takes a connection
+# that is free within AGGREGATION_CHECKOUT_TIMEOUT. When none is, the request
+# runs the slice itself on the connection it already holds, so a busy pool
+# makes the page slower instead of leaving slices waiting the pool timeout.
+AGGREGATION_CONFIG = {
+    "mode": os.getenv("AGGREGATION_MODE", "auto"),  # auto, single or parallel
+    "workers": int(os.getenv("AGGREGATION_WORKERS", "4")),
+    "min_rows": int(os.getenv("AGGREGATION_MIN_ROWS", "500000")),
+    "slices": int(os.getenv("AGGREGATION_SLICES", "8")),  # key ranges when Works_On is not partitioned
+    "checkout_timeout": float(os.getenv("AGGREGATION_CHECKOUT_TIMEOUT", "0.05")),  # seconds
+}
+
+# Keys sampled to place the range bounds
+SAMPLE_SIZE = 10000
+
+# Planner estimate, summed over the partitions when there are any
+WORKS_ON_ROWS_SQL = """
+    SELECT COALESCE(
+        (SELECT SUM(GREATEST(c.reltuples, 0)) FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+         WHERE i.inhparent = 'works_on'::regclass),
+        (SELECT GREATEST(reltuples, 0) FROM pg_class WHERE oid = 'works_on'::regclass)
+    )
+"""
+
+
+def works_on_rows(conn):
+    cur = conn.cursor()
+    cur.execute(WORKS_ON_ROWS_SQL)
+    rows = int(cur.fetchone()[0])
+    cur.close()
+    return rows
+
+
+def use_parallel(conn):
+    # Estimated Works_On rows when the slices should be used, else None
+    mode = AGGREGATION_CONFIG["mode"]
+    if mode == "single" or current_app.extensions.get("aggregation_executor") is None:
+        return None
+    rows = works_on_rows(conn)
+    return rows if mode == "parallel" or rows >= AGGREGATION_CONFIG["min_rows"] else None
+
+
+def key_ranges(sample, count):
+    # [low, high) bounds splitting the keys into at most count ranges with
+    # about the same number of rows each, from a sorted sample of the key
+    # column. Ranges are open-ended at both ends so every key falls in one;
+    # a single key is never split, so a very large one gets a range alone.
+    bounds = sorted({sample[len(sample) * i // count] for i in range(1, count)}) if sample else []
+    edges = [-2 ** 31] + bounds + [2 ** 31]
+    return list(zip(edges, edges[1:]))
+
+
+def sample_keys(conn, sql, rows, size=SAMPLE_SIZE):
+    # Sorted sample of about size keys; sql takes the TABLESAMPLE percentage
+    cur = conn.cursor()
+    cur.execute(sql, (min(100.0, 100.0 * size / max(rows, 1)),))
+    keys = [row[0] for row in cur.fetchall()]
+    cur.close()
+    return keys
+
+
+def fetch_slice(conn, sql, params):
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+
+def run_slice(app, pool, pool_busy, sql, params):
+    # In a worker thread; the app context lets the metrics see the statement.
+    # None when no connection was free, the request runs the slice instead;
+    # after the first miss the other slices of the request do not try.
+    if pool_busy.is_set():
+        return None
+    try:
+        conn = pool.getconn(timeout=AGGREGATION_CONFIG["checkout_timeout"])
+    except (PoolTimeout, TooManyRequests):
+        pool_busy.set()
+        return None
+    try:
+        with app.app_context():
+            return fetch_slice(conn, sql, params)
+    finally:
+        if not conn.closed and conn.info.transaction_status != TransactionStatus.IDLE:
+            conn.rollback()
+        pool.putconn(conn)
+
+
+def parallel_totals(slices):
+    # Runs each (sql, params) slice on its own connection and merges the
+    # rows, (key, count or sum, ...), into {key: [totals, ...]}. Slices run
+    # against the server the request reads from (a replica for @read_only
+    # views).
+    app = current_app._get_current_object()
+    get_db_connection()  # the request's connection, which decides the server
+    replica = g.get("db_replica")
+    pool = replica.pool if replica is not None else app.extensions["db_pool"]
+    executor = app.extensions["aggregation_executor"]
+    pool_busy = threading.Event()
+    futures = [executor.submit(run_slice, app, pool, pool_busy, sql, params) for sql, params in slices]
+
+    totals = {}
+    for (sql, params), future in zip(slices, futures):
+        rows = future.result()
+        if rows is None:
+            rows = fetch_slice(get_db_connection(), sql, params)
+        for key, *values in rows:
+            if key in totals:
+                totals[key] = [total + value for total, value in zip(totals[key], values)]
+            else:
+                totals[key] = values
+    return totals
+
+
+def init_aggregation(app):
+    # Threads start on first use, so AGGREGATION_MODE=single costs nothing and
+    # the benchmarks can switch modes at run time
+    executor = None
+    if AGGREGATION_CONFIG["workers"] > 0:
+        executor = ThreadPoolExecutor(max_workers=AGGREGATION_CONFIG["workers"], thread_name_prefix="aggregation")
+        atexit.register(executor.shutdown, wait=False, cancel_futures=True)
+    app.extensions["aggregation_executor"] = executor
+    return executor
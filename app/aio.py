@@ -0,0 +1,334 @@
+import asyncio
+import functools
+import contextlib
+from psycopg.pq import TransactionStatus
+from psycopg_pool import AsyncConnectionPool
+from quart import Quart, Blueprint, current_app, render_template, request, session, redirect, url_for, flash
+from quart.sessions import SessionInterface
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import BuildError
+from app.cache import cache_lookup, cache_store
+from app.db import DATABASE_CONFIG, POOL_CONFIG
+from app.employees import DEPARTMENT_OPTIONS_SQL, overview_page
+from app.httpcache import (DATA_VERSIONS_SQL, build_id, cache_static, is_fresh, page_etag, page_versions,
+                           set_validators, static_url_defaults)
+from app.managers import MANAGERS_OVERVIEW_SQL, MANAGERS_OVERVIEW_TAGS
+from app.projects import PICKER_LIMIT_DEFAULT, PROJECT_DETAILS_SQL, PROJECT_LIST_TAGS, project_list_sql
+from app.replicas import Replica, ReplicaSet, check_replica_async, reading_own_writes, replica_settings
+from app.sessions import load_session, read_session_cookie, session_signer, store_session
+
+# Async variant of the read-only dashboards, served over ASGI (see asgi.py).
+# The blueprints reuse the names of the Flask ones so the shared templates'
+# url_for() calls resolve here; endpoints that only exist in the Flask app are
+# built from its url_map. Each query checks out its own pooled connection, so
+# independent queries in a request run concurrently with asyncio.gather.
+# Every view here only reads, so with REPLICA_DSNS set the queries go to the
+# replicas, under the same rules as the Flask app's @read_only views.
+
+employees_bp = Blueprint("employees", __name__)
+projects_bp = Blueprint("projects", __name__, url_prefix="/projects")
+managers_bp = Blueprint("managers", __name__, url_prefix="/managers")
+
+
+@contextlib.asynccontextmanager
+async def read_connection():
+    # A replica connection, or a primary one when no replica can serve or
+    # the session has just written something
+    replicas = current_app.extensions.get("db_replicas")
+    conn, replica = None, None
+    if replicas is not None and not reading_own_writes(session):
+        conn, replica = await replicas.getconn_async()
+    if conn is None:
+        async with current_app.extensions["db_pool"].connection() as conn:
+            yield conn
+        return
+    try:
+        yield conn
+    finally:
+        if not conn.closed and conn.info.transaction_status != TransactionStatus.IDLE:
+            await conn.rollback()
+        await replica.pool.putconn(conn)
+
+
+async def fetch(sql, params=None):
+    async with read_connection() as conn:
+        cur = await conn.execute(sql, params)
+        rows = await cur.fetchall()
+        return rows, cur.description
+
+
+async def cached_fetch(sql, params=None, tags=()):
+    # Same cache (and invalidations) as the Flask app in this process
+    with current_app.extensions["flask_app"].app_context():
+        key, rows = cache_lookup(sql, params, tags)
+    if rows is not None:
+        return rows
+
+    async with read_connection() as conn:
+        cur = await conn.execute(sql, params)
+        rows = await cur.fetchall()
+        stale = getattr(conn, "replica_lag", 0) > 0  # see app.db.reading_stale_replica
+    if not stale:
+        with current_app.extensions["flask_app"].app_context():
+            cache_store(key, rows)
+    return rows
+
+
+def conditional_page(*tables):
+    # Async counterpart of app.httpcache.conditional_page (same ETags, so a
+    # page cached from either app revalidates against both)
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            if "_flashes" in session:
+                return await view(*args, **kwargs)
+
+            rows, _ = await fetch(DATA_VERSIONS_SQL, (list(tables),))
+            versions, last_modified = page_versions(tables, rows[0])
+            if versions is None:
+                return await view(*args, **kwargs)
+            etag = page_etag(request.full_path, versions, session.get("username"), session.get("role"),
+                             build_id(current_app.extensions["flask_app"].root_path))
+            if is_fresh(request, etag, last_modified):
+                response = current_app.response_class("", status=304)
+                set_validators(response, etag, last_modified)
+                return response
+
+            response = await current_app.make_response(await view(*args, **kwargs))
+            if response.status_code == 200 and "_flashes" not in session:
+                set_validators(response, etag, last_modified)
+            return response
+        return wrapper
+    return decorator
+
+
+# A2 -- Employees Overview
+@employees_bp.route("/")
+@conditional_page("employee", "department", "works_on", "dependent")
+async def home():
+    employees, filters = overview_page(request.args)
+
+    # The employee page and the department dropdown are independent
+    (rows, description), departments = await asyncio.gather(
+        fetch(employees.sql, employees.query_params()),
+        cached_fetch(DEPARTMENT_OPTIONS_SQL, tags=("department",)),
+    )
+    employees.load(rows, description)
+
+    return await render_template(
+        "home_employees.html",
+        employees=employees,
+        departments=departments,
+        **filters,
+    )
+
+
+# A3 -- All Projects (sorting by POST is left to the Flask app)
+@projects_bp.route("/all", methods=["GET"])
+@conditional_page("project", "department", "works_on")
+async def sort_projects():
+    method = "project_number"
+    direction = "ASC"
+    project_list = await cached_fetch(project_list_sql(method, direction), tags=PROJECT_LIST_TAGS)
+    return await render_template("projects.html", projects=project_list,
+                                 selected_method=method, selected_direction=direction)
+
+
+# A4 -- Project Details (the upsert form POST is left to the Flask app)
+# int converter: /projects/employees and other static paths stay with Flask
+@projects_bp.route("/<int:pnumber>", methods=["GET"])
+async def project_detail(pnumber):
+    project_details = []
+    try:
+        project_details, _ = await fetch(PROJECT_DETAILS_SQL, (pnumber,))
+    except Exception as e:
+        await flash("An error occurred while fetching project details.", "error")
+        print(f"\033[1;91mError fetching project details: {str(e)}\033[0m")
+
+    return await render_template("project_detail.html",
+                                 details=project_details,
+                                 pnumber=pnumber,
+                                 picker_limit=PICKER_LIMIT_DEFAULT)
+
+
+# A6: Managers Overview
+@managers_bp.route("/overview")
+@conditional_page(*MANAGERS_OVERVIEW_TAGS)
+async def managers_overview():
+    try:
+        departments = await cached_fetch(MANAGERS_OVERVIEW_SQL, tags=MANAGERS_OVERVIEW_TAGS)
+        return await render_template("managers.html", departments=departments)
+    except Exception as e:
+        # A failed render is a 500, never a cacheable empty page
+        print(f"\033[1;91mError loading managers overview: {e}\033[0m")
+        await flash("An unexpected error occurred while loading the managers overview.", "error")
+        return await render_template("managers.html", departments=[]), 500
+
+
+async def require_login():
+    # Every async view is for logged-in users (see app/authz.py for the Flask app)
+    if request.endpoint != "static" and "user_id" not in session:
+        return redirect(url_for("auth.login"))
+    return None
+
+
+async def static_cache_headers(response):
+    return cache_static(request, response)
+
+
+def flask_url_builder(flask_app):
+    # url_build_error_handlers hook: endpoints this app does not serve are
+    # built from the Flask app's url_map
+    adapter = flask_app.url_map.bind("", url_scheme="http")
+
+    def build(error, endpoint, values):
+        values = {key: value for key, value in values.items() if not key.startswith("_")}
+        try:
+            return adapter.build(endpoint, values)
+        except BuildError:
+            return None
+
+    return build
+
+
+class AsyncServerSessionInterface(SessionInterface):
+    # The Flask app's server-side sessions (app/sessions.py), so a login on
+    # either app is valid on both. Store and role lookups run in a worker
+    # thread, inside a Flask app context for the pooled DB connection.
+
+    def __init__(self, flask_app, store):
+        self.flask_app = flask_app
+        self.store = store
+
+    def load(self, sid):
+        with self.flask_app.app_context():
+            return load_session(self.store, sid)
+
+    async def open_session(self, app, request):
+        sid = read_session_cookie(app.secret_key, request.cookies.get(self.get_cookie_name(app)))
+        return await asyncio.to_thread(self.load, sid)
+
+    async def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        had_sid = session.sid is not None
+        if await asyncio.to_thread(store_session, self.store, session):
+            cookie = session_signer(app.secret_key).sign(session.sid).decode()
+            response.set_cookie(name, cookie, expires=self.get_expiration_time(app, session),
+                                httponly=httponly, domain=domain, path=path,
+                                secure=secure, samesite=samesite)
+            response.vary.add("Cookie")
+        elif not session and had_sid:
+            response.delete_cookie(name, domain=domain, path=path,
+                                   secure=secure, samesite=samesite, httponly=httponly)
+            response.vary.add("Cookie")
+
+
+def create_async_app(flask_app):
+    app = Quart(
+        __name__,
+        template_folder="templates",
+        static_folder="static",
+    )
+    # Same key and cookie format as Flask, so a login on either app is valid on both
+    app.config["SECRET_KEY"] = flask_app.config["SECRET_KEY"]
+    app.extensions["flask_app"] = flask_app
+    app.url_build_error_handlers.append(flask_url_builder(flask_app))
+    if flask_app.extensions.get("session_store") is not None:
+        app.session_interface = AsyncServerSessionInterface(flask_app, flask_app.extensions["session_store"])
+
+    pool = AsyncConnectionPool(
+        kwargs=DATABASE_CONFIG,
+        check=AsyncConnectionPool.check_connection,
+        name="company_portal_async",
+        open=False,  # opened on the server's event loop at startup
+        **POOL_CONFIG,
+    )
+    app.extensions["db_pool"] = pool
+
+    replica_pools = [
+        (name, AsyncConnectionPool(
+            kwargs=settings,
+            check=check_replica_async,
+            name=f"company_portal_async_replica_{number}",
+            open=False,
+            **POOL_CONFIG,
+        ))
+        for number, (name, settings) in enumerate(replica_settings())
+    ]
+    app.extensions["db_replicas"] = (
+        ReplicaSet([Replica(name, replica_pool) for name, replica_pool in replica_pools]) if replica_pools else None
+    )
+
+    @app.before_serving
+    async def open_pool():
+        await pool.open()
+        for _, replica_pool in replica_pools:
+            await replica_pool.open()
+
+    @app.after_serving
+    async def close_pool():
+        await pool.close()
+        for _, replica_pool in replica_pools:
+            await replica_pool.close()
+
+    app.before_request(require_login)
+    app.url_defaults(static_url_defaults(app.static_folder))
+    app.after_request(static_cache_headers)
+    app.register_blueprint(employees_bp)
+    app.register_blueprint(projects_bp)
+    app.register_blueprint(managers_bp)
+    return app
+
+
+class AsyncDispatcher:
+    # ASGI entry point: requests the async app has a route for (path and
+    # method) go to it, everything else to the Flask app running in threads.
+
+    def __init__(self, async_app, wsgi_app):
+        self.async_app = async_app
+        self.wsgi_app = wsgi_app
+        self.adapter = async_app.url_map.bind("")
+
+    def handles(self, scope):
+        try:
+            self.adapter.match(scope["path"], method=scope["method"])
+        except HTTPException:  # NotFound, MethodNotAllowed, RequestRedirect
+            return False
+        return True
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan" or (scope["type"] == "http" and self.handles(scope)):
+            await self.async_app(scope, receive, send)
+        else:
+            await self.wsgi_app(scope, receive, send)
+
+
+class NonEmptyBody:
+    # WSGI wrapper for the Flask app under Hypercorn, whose WSGI adapter only
+    # starts a response when the first body chunk arrives: bodiless responses
+    # (304 Not Modified, HEAD) get one empty chunk so they are sent at all.
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        body = self.wsgi_app(environ, start_response)
+        try:
+            empty = True
+            for chunk in body:
+                empty = False
+                yield chunk
+            if empty:
+                yield b""
+        finally:
+            if hasattr(body, "close"):
+                body.close()
@@ -1,11 +1,42 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from werkzeug.security import check_password_hash
-from app.db import get_db_connection
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, session, flash, jsonify
+import math
+from app import statements
+from app.db import get_db_connection, release_db_connection
+from app.authz import admin_required, public
+from app.metrics import observe_login
+from app.passwords import HashPoolBusy, hash_password, needs_rehash, verify_password
+from app.ratelimit import login_succeeded, throttle_login
+from app.sessions import regenerate_session, revoke_user_sessions
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 
+USER_BY_USERNAME_SQL = statements.register("auth.user_by_username", """
+    SELECT id, username, password_hash, role
+    FROM app_user
+    WHERE username = %s
+""")
+
+UPDATE_PASSWORD_HASH_SQL = """
+    UPDATE app_user SET password_hash = %s WHERE id = %s AND password_hash = %s
+"""
+
+
+def rehash_password(user_id, old_hash, password):
+    # Stored with an older hash method or cost: replace it now that we have
+    # the password. Best effort, the login goes ahead either way.
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(UPDATE_PASSWORD_HASH_SQL, (hash_password(password), user_id, old_hash))
+        conn.commit()
+        cur.close()
+    except Exception as e:  # includes HashPoolBusy
+        conn.rollback()
+        print(f"\033[1;91mError rehashing password for user {user_id}: {str(e)}\033[0m")
+
 
 @auth_bp.route("/login", methods=["GET", "POST"])
+@public
 def login():
     # already logged in? send to home
     if "user_id" in session:
@@ -16,43 +47,84 @@ def login():
         password = request.form.get("password", "")
 
         error = None
+        status = 200
+        headers = {}
 
         if not username or not password:
             error = "Username and password are required."
+        elif (wait := throttle_login(username, request.remote_addr)) > 0:
+            # refused before any database or hashing work
+            error = "Too many login attempts. Please try again later."
+            status = 429
+            headers["Retry-After"] = str(math.ceil(wait))
+            observe_login("throttled")
         else:
             conn = get_db_connection()
             cur = conn.cursor()
-            cur.execute(
-                """
-                SELECT id, username, password_hash, role
-                FROM app_user
-                WHERE username = %s
-                """,
-                (username,),
-            )
+            statements.execute(cur, USER_BY_USERNAME_SQL, (username,))
             row = cur.fetchone()
             cur.close()
-            conn.close()
+            # the connection is not needed while the password is hashed
+            release_db_connection(read_only=True)
 
             if row is None:
                 error = "Invalid username or password."
+                observe_login("failed")
             else:
                 user_id, uname, password_hash, role = row
-                if not check_password_hash(password_hash, password):
+                try:
+                    valid = verify_password(password_hash, password)
+                except HashPoolBusy:
+                    valid = None
+
+                if valid is None:
+                    error = "The server is busy, please try again in a moment."
+                    status = 503
+                    headers["Retry-After"] = "1"
+                    observe_login("busy")
+                elif not valid:
                     error = "Invalid username or password."
+                    observe_login("failed")
                 else:
+                    if needs_rehash(password_hash):
+                        rehash_password(user_id, password_hash, password)
+                    login_succeeded(uname)
+                    observe_login("success")
                     session.clear()
                     session["user_id"] = user_id
                     session["username"] = uname
                     session["role"] = role
+                    regenerate_session(session)
                     return redirect(url_for("employees.home"))
 
         flash(error)
+        return render_template("login.html"), status, headers
 
     return render_template("login.html")
 
 
 @auth_bp.route("/logout")
+@public
 def logout():
     session.clear()
     return redirect(url_for("auth.login"))
+
+
+# Log a user out of every session (admin only, JSON), e.g. after changing
+# their role or password
+@auth_bp.route("/sessions/revoke/<username>", methods=["POST"])
+@admin_required("You do not have permission to revoke sessions.", api=True)
+def revoke_sessions(username):
+    store = current_app.extensions.get("session_store")
+    if store is None:
+        return jsonify({"error": "Sessions are cookie based (SESSION_BACKEND=cookie) and cannot be revoked."}), 409
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM app_user WHERE username = %s", (username,))
+    row = cur.fetchone()
+    cur.close()
+    if row is None:
+        return jsonify({"error": "User not found."}), 404
+
+    return jsonify({"username": username, "revoked": revoke_user_sessions(store, row[0])})
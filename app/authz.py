@@ -0,0 +1,98 @@
+from flask import current_app, flash, jsonify, redirect, request, session, url_for
+from app.metrics import observe_authz
+
+# Access rules for every route, checked in one before_request hook before the
+# view runs, so a rejected request never checks out a connection or runs a
+# query. Routes need a logged-in user unless marked @public; @admin_required
+# also needs the admin role, optionally only for some methods. Rejected API
+# routes (api=True) get a JSON 401/403; pages are redirected to the login
+# page, or back to `fallback` with the message flashed.
+
+
+class Rule:
+    def __init__(self, public=False, admin=False, methods=None, message=None, fallback=None, api=False):
+        self.public = public
+        self.admin = admin
+        self.methods = set(methods) if methods else None  # None: the rule covers every method
+        self.message = message
+        self.fallback = fallback
+        self.api = api
+
+    def needs_admin(self, method):
+        return self.admin and (self.methods is None or method in self.methods)
+
+
+DEFAULT_RULE = Rule()
+PUBLIC_RULE = Rule(public=True)
+
+
+def public(view):
+    view.authz_rule = PUBLIC_RULE
+    return view
+
+
+def login_required(api=False):
+    def decorator(view):
+        view.authz_rule = Rule(api=api)
+        return view
+    return decorator
+
+
+def admin_required(message, fallback="employees.home", methods=None, api=False):
+    def decorator(view):
+        view.authz_rule = Rule(admin=True, methods=methods, message=message, fallback=fallback, api=api)
+        return view
+    return decorator
+
+
+def endpoint_rule(app, endpoint):
+    # Rules never change after startup, so each endpoint's is looked up once
+    rules = app.extensions["authz_rules"]
+    rule = rules.get(endpoint)
+    if rule is None:
+        if endpoint == "static":
+            rule = PUBLIC_RULE
+        else:
+            rule = getattr(app.view_functions.get(endpoint), "authz_rule", DEFAULT_RULE)
+        rules[endpoint] = rule
+    return rule
+
+
+def fallback_url(endpoint):
+    # Only pass on the URL values the fallback route takes (e.g. pnumber)
+    arguments = set()
+    for url_rule in current_app.url_map.iter_rules(endpoint):
+        arguments |= url_rule.arguments
+    values = {key: value for key, value in (request.view_args or {}).items() if key in arguments}
+    return url_for(endpoint, **values)
+
+
+def check_access():
+    endpoint = request.endpoint
+    if endpoint is None:
+        return None  # no matching route, let the 404/405 through
+
+    rule = endpoint_rule(current_app, endpoint)
+    if rule.public:
+        return None
+
+    if "user_id" not in session:
+        observe_authz(endpoint, "unauthenticated")
+        if rule.api:
+            return jsonify({"error": "login required"}), 401
+        return redirect(url_for("auth.login"))
+
+    if rule.needs_admin(request.method) and session.get("role") != "admin":
+        observe_authz(endpoint, "forbidden")
+        if rule.api:
+            return jsonify({"error": rule.message}), 403
+        flash(rule.message, "error")
+        return redirect(fallback_url(rule.fallback))
+
+    observe_authz(endpoint, "allowed")
+    return None
+
+
+def init_authz(app):
+    app.extensions["authz_rules"] = {}
+    app.before_request(check_access)
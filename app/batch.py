@@ -0,0 +1,67 @@
+import os
+import psycopg
+from app.cache import cache_lookup, cache_store
+from app.db import get_db_connection
+from app.statements import execute
+
+# Page data in one round trip: a route declares every query it needs up front
+# and fetch_batch() sends them together over the request's pooled connection
+# in pipeline mode, then reads all the results. Without pipelining (libpq
+# older than 14, or DB_PIPELINE=0) the queries run one after another instead.
+PIPELINE_ENABLED = os.getenv("DB_PIPELINE", "1") == "1"
+
+
+class Rows(list):
+    # Result rows plus the cursor description (None for cached results)
+    def __init__(self, rows, description=None):
+        super().__init__(rows)
+        self.description = description
+
+
+class Query:
+    def __init__(self, sql, params=None, tags=None, one=False):
+        self.sql = sql
+        self.params = params
+        self.tags = tags  # cache tags, None for queries that are not cached
+        self.one = one  # return the first row (or None) instead of a list
+
+
+def pipeline_supported():
+    return PIPELINE_ENABLED and psycopg.Pipeline.is_supported()
+
+
+def fetch_batch(**queries):
+    # Returns {name: rows} for the Query objects passed by name
+    results = {}
+    pending = {}
+    cache_keys = {}
+    for name, query in queries.items():
+        if query.tags is not None:
+            key, rows = cache_lookup(query.sql, query.params, query.tags)
+            if rows is not None:
+                results[name] = Rows(rows)
+                continue
+            cache_keys[name] = key
+        pending[name] = query
+
+    if pending:
+        conn = get_db_connection()
+        cursors = {name: conn.cursor() for name in pending}
+        if pipeline_supported():
+            with conn.pipeline():
+                for name, query in pending.items():
+                    execute(cursors[name], query.sql, query.params)
+        else:
+            for name, query in pending.items():
+                execute(cursors[name], query.sql, query.params)
+
+        for name, cur in cursors.items():
+            results[name] = Rows(cur.fetchall(), cur.description)
+            cur.close()
+            if name in cache_keys:
+                cache_store(cache_keys[name], list(results[name]))
+
+    for name, query in queries.items():
+        if query.one:
+            results[name] = results[name][0] if results[name] else None
+    return results
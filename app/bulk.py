@@ -0,0 +1,518 @@
+import csv
+import io
+import json
+import tempfile
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+import openpyxl
+from flask import Blueprint, request, jsonify
+from psycopg import errors
+from app.authz import admin_required
+from app.cache import invalidate
+from app.db import get_db_connection
+from app.exports import streaming_response
+from app.replicas import mark_write, read_only
+
+bulk_bp = Blueprint("bulk", __name__, url_prefix="/bulk")
+
+# Rows are validated, staged and merged this many at a time, so memory use
+# does not grow with the size of the uploaded file
+BATCH_SIZE = 5000
+
+
+# --- Entity definitions ---
+# Each column is (name, kind, label, options). Columns are listed in the order
+# used for positional files (no recognised header row) and for exports.
+ENTITIES = {
+    "department": {
+        "table": "Department",
+        "key": ["Dnumber"],
+        "columns": [
+            ("Dnumber", "int", "Department number", {"required": True}),
+            ("Dname", "text", "Department name", {"required": True, "max_length": 30}),
+            ("Mgr_ssn", "ssn", "Manager SSN", {"references": "employee"}),
+        ],
+    },
+    "employee": {
+        "table": "Employee",
+        "key": ["Ssn"],
+        "columns": [
+            ("Ssn", "ssn", "SSN", {"required": True}),
+            ("Fname", "text", "First name", {"required": True, "max_length": 20}),
+            ("Minit", "text", "Middle initial", {"required": True, "max_length": 1}),
+            ("Lname", "text", "Last name", {"required": True, "max_length": 30}),
+            ("Address", "text", "Address", {"required": True, "max_length": 50}),
+            ("Sex", "choice", "Sex", {"required": True, "choices": ("M", "F")}),
+            ("Salary", "int", "Salary", {"required": True, "minimum": 1}),
+            ("Super_ssn", "ssn", "Supervisor SSN", {"references": "employee"}),
+            ("Dno", "int", "Department number", {"required": True, "references": "department"}),
+            ("BDate", "date", "Birth date", {}),
+            ("EmpDate", "date", "Employment date", {}),
+        ],
+    },
+    "project": {
+        "table": "Project",
+        "key": ["Pnumber"],
+        "columns": [
+            ("Pnumber", "int", "Project number", {"required": True}),
+            ("Pname", "text", "Project name", {"required": True, "max_length": 30}),
+            ("Plocation", "text", "Project location", {"required": True, "max_length": 30}),
+            ("Dnum", "int", "Department number", {"required": True, "references": "department"}),
+        ],
+    },
+    "works_on": {
+        "table": "Works_On",
+        "key": ["Essn", "Pno"],
+        "columns": [
+            ("Essn", "ssn", "Employee SSN", {"required": True, "references": "employee"}),
+            ("Pno", "int", "Project number", {"required": True, "references": "project"}),
+            ("Hours", "hours", "Hours", {"required": True}),
+        ],
+    },
+    "dependent": {
+        "table": "Dependent",
+        "key": ["Essn", "Dependent_name"],
+        "columns": [
+            ("Essn", "ssn", "Employee SSN", {"required": True, "references": "employee"}),
+            ("Dependent_name", "text", "Dependent name", {"required": True, "max_length": 30}),
+            ("Sex", "choice", "Sex", {"required": True, "choices": ("M", "F")}),
+            ("Bdate", "date", "Birth date", {"required": True}),
+            ("Relationship", "text", "Relationship", {"required": True, "max_length": 20}),
+        ],
+    },
+}
+
+# Referenced entity -> wording used in "not found in ..." errors
+REFERENCE_LABELS = {
+    "department": "departments",
+    "employee": "employees",
+    "project": "projects",
+}
+
+# Postgres types used to decode COPY TO STDOUT rows for each column kind
+COPY_TYPES = {
+    "int": "int4",
+    "text": "text",
+    "ssn": "text",
+    "choice": "text",
+    "date": "date",
+    "hours": "numeric",
+}
+
+
+# --- Value parsing ---
+
+def normalize_ssn(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        # Excel stores an all-digit SSN as a number and drops leading zeros
+        return str(int(value)).zfill(9)
+    return str(value).strip() or None
+
+
+def parse_value(kind, label, value, options):
+    # Returns the cleaned value, raises ValueError with a user-facing message
+    if isinstance(value, str):
+        value = value.strip()
+    if value is None or value == "":
+        if options.get("required"):
+            raise ValueError(f"Missing required field {label}")
+        return None
+
+    if kind == "int":
+        try:
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            number = int(value)
+        except (ValueError, TypeError):
+            raise ValueError(f"{label} must be a number")
+        if number < options.get("minimum", number):
+            raise ValueError(f"{label} must be at least {options['minimum']}")
+        return number
+
+    if kind == "ssn":
+        ssn = normalize_ssn(value)
+        if len(ssn) != 9 or not ssn.isdigit():
+            raise ValueError(f"{label} {ssn} must be 9 digits")
+        return ssn
+
+    if kind == "hours":
+        try:
+            hours = Decimal(str(value))
+        except InvalidOperation:
+            raise ValueError(f"{label} must be a number")
+        # Works_On.Hours is DECIMAL(4,1) with CHECK (Hours >= 0)
+        if hours < 0 or hours != hours.quantize(Decimal("0.1")) or hours > Decimal("999.9"):
+            raise ValueError(f"{label} must be between 0 and 999.9 with one decimal place")
+        return hours
+
+    if kind == "date":
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, date):
+            return value
+        try:
+            return date.fromisoformat(str(value))
+        except ValueError:
+            raise ValueError(f"{label} must be a date (YYYY-MM-DD)")
+
+    text = str(value)
+    if kind == "choice":
+        if text.upper() not in options["choices"]:
+            raise ValueError(f"{label} must be one of {', '.join(options['choices'])}")
+        return text.upper()
+    if len(text) > options.get("max_length", len(text)):
+        raise ValueError(f"{label} must be at most {options['max_length']} characters")
+    return text
+
+
+# --- File formats ---
+# Readers yield (row_num, values) with values in the entity's column order.
+
+def column_order(spec, header):
+    # Map a header row to column positions. Files whose header does not name
+    # the entity's columns are read positionally, like the department sheet.
+    names = [str(h).strip().lower() if h is not None else "" for h in header]
+    wanted = [name.lower() for name, _, _, _ in spec["columns"]]
+    if set(wanted) <= set(names):
+        return [names.index(name) for name in wanted]
+    return list(range(len(wanted)))
+
+
+def pick(values, order):
+    return tuple(values[i] if i < len(values) else None for i in order)
+
+
+def read_xlsx_rows(file, spec):
+    # read_only mode streams the sheet instead of building every cell in memory
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        order = column_order(spec, next(rows, ()))
+        # Skip header row (row 1), start from row 2
+        for row_num, values in enumerate(rows, start=2):
+            yield row_num, pick(values, order)
+    finally:
+        workbook.close()
+
+
+def read_csv_rows(file, spec):
+    reader = csv.reader(io.TextIOWrapper(file, encoding="utf-8-sig", newline=""))
+    order = column_order(spec, next(reader, []))
+    for row_num, values in enumerate(reader, start=2):
+        yield row_num, pick(values, order)
+
+
+def read_ndjson_rows(file, spec):
+    names = [name.lower() for name, _, _, _ in spec["columns"]]
+    for row_num, line in enumerate(io.TextIOWrapper(file, encoding="utf-8-sig"), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = {key.lower(): value for key, value in json.loads(line).items()}
+        except (ValueError, AttributeError):
+            yield row_num, ValueError("Line is not a JSON object")
+            continue
+        yield row_num, tuple(record.get(name) for name in names)
+
+
+READERS = {
+    "xlsx": read_xlsx_rows,
+    "csv": read_csv_rows,
+    "ndjson": read_ndjson_rows,
+}
+
+FORMAT_EXTENSIONS = {
+    ".xlsx": "xlsx",
+    ".csv": "csv",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+}
+
+
+def detect_format(filename, requested=""):
+    if requested in READERS:
+        return requested
+    for extension, fmt in FORMAT_EXTENSIONS.items():
+        if filename.lower().endswith(extension):
+            return fmt
+    return None
+
+
+def batched(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# --- Import ---
+
+def load_keys(cur, entity):
+    spec = ENTITIES[entity]
+    cur.execute(f"SELECT {', '.join(spec['key'])} FROM {spec['table']}")
+    if len(spec["key"]) == 1:
+        return {row[0] for row in cur}
+    return set(cur.fetchall())
+
+
+def describe_key(spec, key):
+    labels = [label for name, _, label, _ in spec["columns"] if name in spec["key"]]
+    values = key if isinstance(key, tuple) else (key,)
+    return ", ".join(f"{label} {value}" for label, value in zip(labels, values))
+
+
+def validate_batch(spec, entity, batch, seen, key_sets):
+    # Parse every row of the batch and check foreign keys against the in-memory
+    # key sets, so rejected rows never reach the database
+    columns = spec["columns"]
+    key_positions = [i for i, (name, _, _, _) in enumerate(columns) if name in spec["key"]]
+    valid = []
+    rejected = []
+
+    for row_num, values in batch:
+        if isinstance(values, Exception):
+            rejected.append((row_num, str(values)))
+            continue
+        values = tuple(values or ())
+        # Skip empty rows
+        if all(value is None or value == "" for value in values):
+            continue
+        values = values + (None,) * (len(columns) - len(values))
+
+        try:
+            row = [parse_value(kind, label, values[i], options)
+                   for i, (_, kind, label, options) in enumerate(columns)]
+        except ValueError as e:
+            rejected.append((row_num, str(e)))
+            continue
+
+        key = tuple(row[i] for i in key_positions)
+        key = key[0] if len(key) == 1 else key
+        if key in seen:
+            rejected.append((row_num, f"{describe_key(spec, key)} appears more than once in the file"))
+            continue
+
+        missing = None
+        for i, (_, _, label, options) in enumerate(columns):
+            target = options.get("references")
+            if target and row[i] is not None and row[i] not in key_sets[target]:
+                missing = f"{label} {row[i]} not found in {REFERENCE_LABELS[target]}"
+                break
+        if missing:
+            rejected.append((row_num, missing))
+            continue
+
+        seen.add(key)
+        # Later rows in the same file may reference this one (e.g. supervisors)
+        if entity in key_sets:
+            key_sets[entity].add(key)
+        valid.append((row_num, *row))
+
+    return valid, rejected
+
+
+def merge_sql(spec, staging, mode):
+    names = [name for name, _, _, _ in spec["columns"]]
+    column_list = ", ".join(names)
+    key_list = ", ".join(spec["key"])
+    key_match = " AND ".join(f"m.{key} = s.{key}" for key in spec["key"])
+
+    if mode == "upsert":
+        updates = ", ".join(f"{name} = EXCLUDED.{name}" for name in names if name not in spec["key"])
+        conflict = f"DO UPDATE SET {updates}"
+    else:
+        conflict = "DO NOTHING"
+
+    # Returns the staged rows that were not written, i.e. keys that already exist.
+    # Rows are written in key order, so concurrent imports lock them (and their
+    # rollup rows) in the same order.
+    return f"""
+        WITH merged AS (
+            INSERT INTO {spec['table']} ({column_list})
+            SELECT {column_list} FROM {staging} ORDER BY {key_list}
+            ON CONFLICT ({key_list}) {conflict}
+            RETURNING {key_list}
+        )
+        SELECT s.row_num, {', '.join('s.' + key for key in spec['key'])}
+        FROM {staging} s
+        WHERE NOT EXISTS (SELECT 1 FROM merged m WHERE {key_match})
+    """
+
+
+def import_rows(conn, entity, rows, mode="insert", dry_run=False):
+    # Validates rows in batches, COPYs each batch into a staging table and merges
+    # it into the target table with one set-based INSERT. Every rejected row is
+    # reported; valid rows are committed together (or rolled back for a dry run).
+    spec = ENTITIES[entity]
+    names = [name for name, _, _, _ in spec["columns"]]
+    staging = f"{entity}_import"
+
+    cur = conn.cursor()
+    cur.execute(f"""
+        CREATE TEMP TABLE {staging} ON COMMIT DROP AS
+        SELECT 0 AS row_num, {', '.join(names)} FROM {spec['table']} WITH NO DATA
+    """)
+
+    key_sets = {}
+    for _, _, _, options in spec["columns"]:
+        target = options.get("references")
+        if target and target not in key_sets:
+            key_sets[target] = load_keys(cur, target)
+
+    summary = {"entity": entity, "mode": mode, "dry_run": dry_run, "rows_read": 0, "imported": 0}
+    error_rows = []
+    seen = set()
+
+    for batch in batched(rows):
+        summary["rows_read"] += len(batch)
+        valid, rejected = validate_batch(spec, entity, batch, seen, key_sets)
+        error_rows.extend(rejected)
+        if not valid:
+            continue
+
+        try:
+            with conn.transaction():  # savepoint: a failed batch leaves earlier ones intact
+                cur.execute(f"TRUNCATE {staging}")
+                with cur.copy(f"COPY {staging} (row_num, {', '.join(names)}) FROM STDIN") as copy:
+                    for row in valid:
+                        copy.write_row(row)
+                cur.execute(merge_sql(spec, staging, mode))
+                conflicts = cur.fetchall()
+        except errors.Error as e:
+            message = e.diag.message_primary or str(e)
+            error_rows.extend((row[0], f"Batch rejected by the database: {message}") for row in valid)
+            continue
+
+        for row_num, *key in conflicts:
+            key = tuple(key) if len(key) > 1 else key[0]
+            error_rows.append((row_num, f"{describe_key(spec, key)} already exists"))
+        summary["imported"] += len(valid) - len(conflicts)
+
+    try:
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+            mark_write()
+            if summary["imported"]:
+                invalidate(spec["table"].lower())
+    except (errors.ForeignKeyViolation, errors.UniqueViolation) as e:
+        # Deferred constraints failed at commit (e.g. a manager was deleted
+        # during the import); nothing was saved
+        conn.rollback()
+        summary["imported"] = 0
+        error_rows = [(0, f"Import rolled back: {e.diag.message_primary}")]
+    finally:
+        cur.close()
+
+    error_rows.sort()
+    summary["errors"] = error_rows
+    return summary
+
+
+# --- Export ---
+
+def select_sql(spec):
+    columns = ", ".join(f'{name} AS "{name}"' for name, _, _, _ in spec["columns"])
+    return f"SELECT {columns} FROM {spec['table']} ORDER BY {', '.join(spec['key'])}"
+
+
+def export_csv(cur, spec):
+    with cur.copy(f"COPY ({select_sql(spec)}) TO STDOUT WITH (FORMAT csv, HEADER)") as copy:
+        for chunk in copy:
+            yield bytes(chunk)
+
+
+def export_ndjson(cur, spec):
+    with cur.copy(f"COPY (SELECT row_to_json(t)::text FROM ({select_sql(spec)}) AS t) TO STDOUT") as copy:
+        copy.set_types(["text"])
+        for (line,) in copy.rows():
+            yield (line + "\n").encode()
+
+
+def export_xlsx(cur, spec):
+    # xlsx cannot be written incrementally to the client, so rows go into a
+    # write-only workbook spooled to disk and the finished file is streamed
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(spec["table"])
+    sheet.append([name for name, _, _, _ in spec["columns"]])
+    with cur.copy(f"COPY ({select_sql(spec)}) TO STDOUT") as copy:
+        copy.set_types([COPY_TYPES[kind] for _, kind, _, _ in spec["columns"]])
+        for row in copy.rows():
+            sheet.append(row)
+
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as out:
+        workbook.save(out)
+        out.seek(0)
+        while chunk := out.read(64 * 1024):
+            yield chunk
+
+
+EXPORTERS = {
+    "csv": (export_csv, "text/csv"),
+    "ndjson": (export_ndjson, "application/x-ndjson"),
+    "xlsx": (export_xlsx, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+
+def export_rows(entity, fmt):
+    # The connection is checked out inside the generator: teardown returns the
+    # view's connection to the pool before a streamed body is consumed
+    exporter, _ = EXPORTERS[fmt]
+    cur = get_db_connection().cursor()
+    try:
+        yield from exporter(cur, ENTITIES[entity])
+    finally:
+        cur.close()
+
+
+# --- Routes (admin only, JSON) ---
+
+BULK_DENIED = "You do not have permission to use bulk data transfer."
+
+
+@bulk_bp.route("/import/<entity>", methods=["POST"])
+@admin_required(BULK_DENIED, api=True)
+def bulk_import(entity):
+    if entity not in ENTITIES:
+        return jsonify({"error": f"Unknown entity {entity}"}), 404
+
+    file = request.files.get("file")
+    if file is None or file.filename == "":
+        return jsonify({"error": "No file selected"}), 400
+
+    fmt = detect_format(file.filename, request.form.get("format", ""))
+    if fmt is None:
+        return jsonify({"error": "Only .xlsx, .csv and .ndjson files are supported"}), 400
+
+    mode = request.form.get("mode", "insert")
+    if mode not in ("insert", "upsert"):
+        return jsonify({"error": "mode must be insert or upsert"}), 400
+    dry_run = request.form.get("dry_run", "").lower() in ("1", "true", "yes", "on")
+
+    try:
+        rows = READERS[fmt](file.stream, ENTITIES[entity])
+        summary = import_rows(get_db_connection(), entity, rows, mode=mode, dry_run=dry_run)
+    except Exception as e:
+        return jsonify({"error": f"Error processing file: {str(e)}"}), 400
+
+    summary["format"] = fmt
+    summary["errors"] = [{"row": row_num, "message": message} for row_num, message in summary["errors"]]
+    return jsonify(summary)
+
+
+@bulk_bp.route("/export/<entity>.<fmt>")
+@read_only
+@admin_required(BULK_DENIED, api=True)
+def bulk_export(entity, fmt):
+    if entity not in ENTITIES or fmt not in EXPORTERS:
+        return jsonify({"error": f"Unknown export {entity}.{fmt}"}), 404
+
+    _, mimetype = EXPORTERS[fmt]
+    return streaming_response(export_rows(entity, fmt), mimetype, f"{entity}.{fmt}")
@@ -0,0 +1,197 @@
+import os
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import current_app
+from app.db import get_db_connection, reading_stale_replica
+from app.statements import execute
+
+try:
+    import redis
+except ImportError:  # only needed for CACHE_BACKEND=redis
+    redis = None
+
+# Query results are cached under a key built from the SQL, its parameters and
+# the current version of every table (tag) the query reads. A write bumps the
+# versions of the tables it changed, so entries built from the old data are
+# never looked up again and simply age out of the cache.
+CACHE_CONFIG = {
+    "backend": os.getenv("CACHE_BACKEND", "memory"),  # memory, redis or none
+    "url": os.getenv("CACHE_URL", "redis://localhost:6379/0"),
+    "ttl": float(os.getenv("CACHE_TTL", "60")),
+    "max_entries": int(os.getenv("CACHE_MAX_ENTRIES", "1024")),
+    "prefix": os.getenv("CACHE_PREFIX", "company_portal:"),
+}
+
+
+class MemoryCache:
+    # In-process LRU with a TTL per entry. Every worker process has its own
+    # copy, so invalidations only reach the process that made the write.
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def tag_versions(self, tags):
+        with self.lock:
+            return [self.versions.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self.lock:
+            for tag in tags:
+                self.versions[tag] = self.versions.get(tag, 0) + 1
+
+    def size(self):
+        return len(self.entries)
+
+
+class RedisCache:
+    # Shared by every worker process. Eviction is left to Redis (configure
+    # maxmemory-policy allkeys-lru); tag versions are plain counters.
+    # Redis errors are treated as cache misses so the app keeps working.
+
+    def __init__(self, url, ttl, prefix):
+        if redis is None:
+            raise RuntimeError("CACHE_BACKEND=redis requires the redis package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        try:
+            data = self.client.get(self.prefix + key)
+        except redis.RedisError as e:
+            print(f"\033[1;91mCache get failed: {e}\033[0m")
+            return None
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, key, value, ttl=None):
+        try:
+            self.client.set(self.prefix + key, pickle.dumps(value), ex=max(1, int(ttl or self.ttl)))
+        except redis.RedisError as e:
+            print(f"\033[1;91mCache set failed: {e}\033[0m")
+
+    def tag_versions(self, tags):
+        try:
+            values = self.client.mget([f"{self.prefix}tag:{tag}" for tag in tags])
+        except redis.RedisError as e:
+            print(f"\033[1;91mCache get failed: {e}\033[0m")
+            return None
+        return [int(value or 0) for value in values]
+
+    def bump(self, tags):
+        try:
+            with self.client.pipeline() as pipe:
+                for tag in tags:
+                    pipe.incr(f"{self.prefix}tag:{tag}")
+                pipe.execute()
+        except redis.RedisError as e:
+            print(f"\033[1;91mCache invalidation failed: {e}\033[0m")
+
+    def size(self):
+        return None
+
+
+def init_cache(app):
+    backend = CACHE_CONFIG["backend"]
+    if backend == "redis":
+        cache = RedisCache(CACHE_CONFIG["url"], CACHE_CONFIG["ttl"], CACHE_CONFIG["prefix"])
+    elif backend == "memory":
+        cache = MemoryCache(CACHE_CONFIG["max_entries"], CACHE_CONFIG["ttl"])
+    else:
+        cache = None  # caching disabled, every query goes to Postgres
+
+    app.extensions["result_cache"] = cache
+    app.extensions["result_cache_stats"] = {"hits": 0, "misses": 0, "invalidations": 0}
+    return cache
+
+
+def cache_key(sql, params, versions):
+    raw = repr((" ".join(sql.split()), tuple(params or ()), tuple(versions)))
+    return "query:" + hashlib.sha1(raw.encode()).hexdigest()
+
+
+def cache_lookup(sql, params, tags):
+    # Returns (key, rows); rows is None on a miss, key is None when the
+    # cache is disabled or unavailable
+    cache = current_app.extensions.get("result_cache")
+    if cache is None:
+        return None, None
+    versions = cache.tag_versions(sorted(tags))
+    if versions is None:
+        return None, None
+
+    key = cache_key(sql, params, versions)
+    rows = cache.get(key)
+    if rows is not None:
+        current_app.extensions["result_cache_stats"]["hits"] += 1
+    return key, rows
+
+
+def cache_store(key, rows, ttl=None):
+    if key is None:
+        return
+    current_app.extensions["result_cache_stats"]["misses"] += 1
+    if not reading_stale_replica():
+        current_app.extensions["result_cache"].set(key, rows, ttl)
+
+
+def cached_query(sql, params=None, tags=(), ttl=None, compute=None):
+    # Runs sql and returns all rows, served from the cache while none of the
+    # tagged tables have been written since the rows were stored. compute()
+    # may produce the same rows another way; when it returns None, sql runs.
+    key, rows = cache_lookup(sql, params, tags)
+    if rows is not None:
+        return rows
+
+    if compute is not None:
+        rows = compute()
+    if rows is None:
+        cur = get_db_connection().cursor()
+        execute(cur, sql, params)  # prepared if sql is a registered statement
+        rows = cur.fetchall()
+        cur.close()
+
+    cache_store(key, rows, ttl)
+    return rows
+
+
+def invalidate(*tags):
+    # Call after a write has been committed, with the tables it changed
+    cache = current_app.extensions.get("result_cache")
+    if cache is None or not tags:
+        return
+    cache.bump(tags)
+    current_app.extensions["result_cache_stats"]["invalidations"] += 1
+
+
+def cache_stats():
+    cache = current_app.extensions.get("result_cache")
+    stats = dict(current_app.extensions.get("result_cache_stats", {}))
+    stats["backend"] = CACHE_CONFIG["backend"] if cache is not None else "none"
+    stats["entries"] = cache.size() if cache is not None else 0
+    return stats
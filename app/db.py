@@ -1,6 +1,13 @@
 import os
+import time
+import atexit
 import psycopg
 from dotenv import load_dotenv
+from flask import current_app, g, has_request_context, request
+from psycopg.pq import TransactionStatus
+from psycopg_pool import ConnectionPool
+from app.metrics import InstrumentedCursor, observe_connection_acquire
+from app.statements import configure_connection
 
 load_dotenv()
 
@@ -12,5 +19,110 @@ DATABASE_CONFIG = {
     "port": os.getenv("DB_PORT"),
 }
 
+# Pool sizing is per process: the total number of Postgres connections used by
+# the app is (number of workers) * DB_POOL_MAX_SIZE, keep it below max_connections.
+POOL_CONFIG = {
+    "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+    "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+    "timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    "max_idle": float(os.getenv("DB_POOL_MAX_IDLE", "300")),
+    "max_lifetime": float(os.getenv("DB_POOL_MAX_LIFETIME", "3600")),
+    "max_waiting": int(os.getenv("DB_POOL_MAX_WAITING", "0")),
+}
+
+
+def init_pool(app):
+    pool = ConnectionPool(
+        kwargs={**DATABASE_CONFIG, "cursor_factory": InstrumentedCursor},  # per-statement metrics
+        check=ConnectionPool.check_connection,  # health check before every checkout
+        configure=configure_connection,  # room for the prepared statements
+        name="company_portal",
+        open=True,
+        **POOL_CONFIG,
+    )
+    atexit.register(pool.close)
+
+    app.extensions["db_pool"] = pool
+    app.teardown_appcontext(release_db_connection)
+    return pool
+
+
 def get_db_connection():
-    return psycopg.connect(**DATABASE_CONFIG)
+    # One pooled connection per request, checked out on first use and returned
+    # to the pool by release_db_connection() when the request ends. Streamed
+    # responses must call this from inside their generator, since the view's
+    # teardown has already returned its connection by the time the body streams.
+    # Views marked @read_only get a replica connection when replicas are
+    # configured (app/replicas.py).
+    if "db_conn" not in g:
+        start = time.perf_counter()
+        conn, replica = None, None
+        replicas = current_app.extensions.get("db_replicas")
+        if replicas is not None:
+            conn, replica = replicas.request_connection()
+        if conn is None:
+            conn = current_app.extensions["db_pool"].getconn()
+        g.db_conn, g.db_replica = conn, replica
+        g.db_read_only = read_only_view()  # the request is gone by teardown
+        observe_connection_acquire(time.perf_counter() - start)
+    return g.db_conn
+
+
+def read_only_view():
+    # True when the current request is routed to a view marked @read_only
+    if not has_request_context() or request.endpoint is None:
+        return False
+    return getattr(current_app.view_functions.get(request.endpoint), "db_read_only", False)
+
+
+def release_db_connection(exception=None, read_only=False):
+    # read_only: the caller knows the connection was only used for reads
+    conn = g.pop("db_conn", None)
+    replica = g.pop("db_replica", None)
+    read_only = g.pop("db_read_only", False) or read_only
+    if conn is None:
+        return
+
+    # Read-only routes never commit, so end their transaction before the
+    # connection goes back to the pool. A clean read is ended with COMMIT:
+    # it undoes nothing either way, and psycopg deallocates every prepared
+    # statement on the connection after a ROLLBACK (app/statements.py).
+    # Anything else is rolled back, never committed on the view's behalf.
+    status = conn.info.transaction_status if not conn.closed else None
+    if status is not None and status != TransactionStatus.IDLE:
+        try:
+            if status == TransactionStatus.INTRANS and exception is None and read_only:
+                conn.commit()
+            else:
+                conn.rollback()
+        except psycopg.Error:
+            pass
+    if replica is not None:
+        replica.pool.putconn(conn)
+    else:
+        current_app.extensions["db_pool"].putconn(conn)
+
+
+def reading_stale_replica():
+    # True when this request reads from a replica that had not caught up with
+    # the primary when the connection was checked out; its rows must not be
+    # cached under the tables' current versions
+    return g.get("db_replica") is not None and getattr(g.db_conn, "replica_lag", 0) > 0
+
+
+def pool_stats():
+    stats = current_app.extensions["db_pool"].get_stats()
+    return {
+        "pool_min": stats.get("pool_min", 0),
+        "pool_max": stats.get("pool_max", 0),
+        "pool_size": stats.get("pool_size", 0),
+        "pool_available": stats.get("pool_available", 0),
+        "checkouts": stats.get("requests_num", 0),
+        "wait_ms": stats.get("requests_wait_ms", 0),
+        # requests that found every connection busy and had to queue for one
+        "overflow": stats.get("requests_queued", 0),
+        "waiting": stats.get("requests_waiting", 0),
+        "timeouts": stats.get("requests_errors", 0),
+        "connections_opened": stats.get("connections_num", 0),
+        "connections_lost": stats.get("connections_lost", 0),
+    }
@@ -1,15 +1,20 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, session
+from flask import Blueprint, render_template, request, flash, redirect, url_for
+from app.authz import admin_required
+from app.cache import invalidate
 from app.db import get_db_connection
+from app.httpcache import conditional_page
+from app.replicas import mark_write, read_only
+from app.batch import Query, fetch_batch
+from app.employees import DEPARTMENT_OPTIONS_SQL, department_options
 from psycopg import errors
 
 employee_management_bp = Blueprint("employee_management", __name__, url_prefix="/employees")
 
 # A5: Employee List (viewable by any logged-in user)
 @employee_management_bp.route("/manage")
+@read_only
+@conditional_page("employee")
 def manage_employees():
-    if "user_id" not in session:
-        return redirect(url_for("auth.login"))
-    
     try:
         conn = get_db_connection()
         cur = conn.cursor()
@@ -24,7 +29,6 @@ def manage_employees():
         employees = cur.fetchall()
         
         cur.close()
-        conn.close()
         
         return render_template("employee_list.html", employees=employees)
     
@@ -35,23 +39,11 @@ def manage_employees():
 
 # A5: Add Employee Form (admin only)
 @employee_management_bp.route("/add", methods=["GET"])
+@admin_required("You do not have permission to add employees.", fallback="employee_management.manage_employees")
 def add_employee_form():
-    if "user_id" not in session:
-        return redirect(url_for("auth.login"))
-    if session.get("role") != "admin":
-        flash("You do not have permission to add employees.", "error")
-        return redirect(url_for("employee_management.manage_employees"))
-    
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
         # Get departments for dropdown
-        cur.execute("SELECT dnumber, dname FROM department ORDER BY dname")
-        departments = cur.fetchall()
-        
-        cur.close()
-        conn.close()
+        departments = department_options()
         
         return render_template("add_employee.html", departments=departments)
     
@@ -62,13 +54,8 @@ def add_employee_form():
 
 # A5: Add Employee Submission (admin only)
 @employee_management_bp.route("/add", methods=["POST"])
+@admin_required("You do not have permission to add employees.", fallback="employee_management.manage_employees")
 def add_employee():
-    if "user_id" not in session:
-        return redirect(url_for("auth.login"))
-    if session.get("role") != "admin":
-        flash("You do not have permission to add employees.", "error")
-        return redirect(url_for("employee_management.manage_employees"))
-    
     ssn = request.form.get("ssn", "").strip()
     fname = request.form.get("fname", "").strip()
     minit = request.form.get("minit", "").strip()
@@ -108,6 +95,8 @@ def add_employee():
         """, (ssn, fname, minit, lname, address, salary, dno, sex, super_ssn, birthdate, empdate))
         
         conn.commit()
+        mark_write()
+        invalidate("employee")
         
         flash("Employee added successfully.", "success")
         return redirect(url_for("employee_management.manage_employees"))
@@ -131,42 +120,27 @@ def add_employee():
     finally:
         if cur:
             cur.close()
-        if conn:
-            conn.close()
 
 # A5: Edit Employee Form (admin only)
 @employee_management_bp.route("/edit/<ssn>", methods=["GET"])
+@admin_required("You do not have permission to edit employees.", fallback="employee_management.manage_employees")
 def edit_employee_form(ssn):
-    if "user_id" not in session:
-        return redirect(url_for("auth.login"))
-    if session.get("role") != "admin":
-        flash("You do not have permission to edit employees.", "error")
-        return redirect(url_for("employee_management.manage_employees"))
-    
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Get employee data
-        cur.execute("""
-            SELECT ssn, fname, minit, lname, address, salary, dno
-            FROM employee WHERE ssn = %s
-        """, (ssn,))
-        employee = cur.fetchone()
+        # Employee data and the departments for the dropdown in one round trip
+        data = fetch_batch(
+            employee=Query("""
+                SELECT ssn, fname, minit, lname, address, salary, dno
+                FROM employee WHERE ssn = %s
+            """, (ssn,), one=True),
+            departments=Query(DEPARTMENT_OPTIONS_SQL, tags=("department",)),
+        )
+        employee = data["employee"]
+        departments = data["departments"]
         
         if not employee:
             flash("Employee not found.", "error")
-            cur.close()
-            conn.close()
             return redirect(url_for("employee_management.manage_employees"))
         
-        # Get departments for dropdown
-        cur.execute("SELECT dnumber, dname FROM department ORDER BY dname")
-        departments = cur.fetchall()
-        
-        cur.close()
-        conn.close()
-        
         return render_template("edit_employee.html", 
                              employee=employee, departments=departments)
     
@@ -177,13 +151,8 @@ def edit_employee_form(ssn):
 
 # A5: Edit Employee Submission (admin only)
 @employee_management_bp.route("/edit/<ssn>", methods=["POST"])
+@admin_required("You do not have permission to edit employees.", fallback="employee_management.manage_employees")
 def edit_employee(ssn):
-    if "user_id" not in session:
-        return redirect(url_for("auth.login"))
-    if session.get("role") != "admin":
-        flash("You do not have permission to edit employees.", "error")
-        return redirect(url_for("employee_management.manage_employees"))
-    
     address = request.form.get("address", "").strip()
     salary = request.form.get("salary", "").strip()
     dno = request.form.get("dno", "").strip()
@@ -216,6 +185,8 @@ def edit_employee(ssn):
         """, (address, salary, dno, ssn))
         
         conn.commit()
+        mark_write()
+        invalidate("employee")
         
         flash("Employee updated successfully.", "success")
         return redirect(url_for("employee_management.manage_employees"))
@@ -234,18 +205,11 @@ def edit_employee(ssn):
     finally:
         if cur:
             cur.close()
-        if conn:
-            conn.close()
 
 # A5: Delete Employee (admin only)
 @employee_management_bp.route("/delete/<ssn>", methods=["POST"])
+@admin_required("You do not have permission to delete employees.", fallback="employee_management.manage_employees")
 def delete_employee(ssn):
-    if "user_id" not in session:
-        return redirect(url_for("auth.login"))
-    if session.get("role") != "admin":
-        flash("You do not have permission to delete employees.", "error")
-        return redirect(url_for("employee_management.manage_employees"))
-    
     conn = None
     cur = None
     try:
@@ -255,6 +219,8 @@ def delete_employee(ssn):
         # Try to delete employee
         cur.execute("DELETE FROM employee WHERE ssn = %s", (ssn,))
         conn.commit()
+        mark_write()
+        invalidate("employee", "works_on", "dependent")
         
         flash("Employee deleted successfully.", "success")
     
@@ -277,7 +243,5 @@ def delete_employee(ssn):
     finally:
         if cur:
             cur.close()
-        if conn:
-            conn.close()
     
     return redirect(url_for("employee_management.manage_employees"))
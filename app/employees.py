@@ -1,98 +1,311 @@
-from flask import Blueprint, render_template, request, session, redirect, url_for
+import base64
+import json
+from flask import Blueprint, request, stream_template, jsonify
+from app import statements
+from app.authz import admin_required, login_required
+from app.batch import Query, fetch_batch
+from app.cache import cached_query
 from app.db import get_db_connection
+from app.exports import csv_response
+from app.httpcache import conditional_page
+from app.replicas import read_only
 
 employees_bp = Blueprint("employees", __name__)
 
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 500
 
-@employees_bp.route("/")
-def home():
-   
-    if "user_id" not in session:
-        return redirect(url_for("auth.login"))
-
-    
-    dept = request.args.get("department", "").strip()
-    name = request.args.get("name", "").strip()
-    sort = request.args.get("sort", "name_asc")
-
-    
-    sort_options = {
-        "name_asc": "full_name ASC",
-        "name_desc": "full_name DESC",
-        "hours_asc": "total_hours ASC",
-        "hours_desc": "total_hours DESC",
-    }
-    order_by = sort_options.get(sort, "full_name ASC")
+SEARCH_LIMIT_DEFAULT = 10
+SEARCH_LIMIT_MAX = 50
+
+
+def encode_cursor(sort_value, ssn):
+    raw = json.dumps([str(sort_value), ssn]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        sort_value, ssn = json.loads(raw)
+        return str(sort_value), str(ssn)
+    except (ValueError, TypeError):
+        return None
+
+
+def escape_like(text):
+    # User input as literal text inside a LIKE/ILIKE pattern (with ESCAPE '\'):
+    # "%" and "_" typed by the user match themselves, not any characters
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class KeysetPage:
+    # One page of a keyset (seek) paginated query. The caller runs sql with
+    # query_params() (together with its other page queries) and hands the
+    # rows to load(), which works out the previous/next page cursors.
+
+    def __init__(self, sql, params, sort_column, per_page, backwards, has_cursor):
+        self.sql = sql
+        self.params = params
+        self.sort_column = sort_column
+        self.per_page = per_page
+        self.backwards = backwards
+        self.has_cursor = has_cursor
+        self.next_cursor = None
+        self.prev_cursor = None
+        self.rows = None
+
+    def _key(self, row, description):
+        columns = [col.name for col in description]
+        return encode_cursor(row[columns.index(self.sort_column)], row[0])
+
+    def query_params(self):
+        return self.params + [self.per_page + 1]
+
+    def __iter__(self):
+        return iter(self.rows or [])
+
+    def load(self, rows, description):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if self.backwards:
+            # rows were fetched in reverse order to seek backwards
+            rows.reverse()
+            if rows:
+                self.next_cursor = self._key(rows[-1], description)
+                if has_more:
+                    self.prev_cursor = self._key(rows[0], description)
+        elif rows:
+            if has_more:
+                self.next_cursor = self._key(rows[-1], description)
+            if self.has_cursor:
+                self.prev_cursor = self._key(rows[0], description)
+
+        self.rows = rows
+
+
+SORT_OPTIONS = {
+    "name_asc": ("full_name", "ASC"),
+    "name_desc": ("full_name", "DESC"),
+    "hours_asc": ("total_hours", "ASC"),
+    "hours_desc": ("total_hours", "DESC"),
+    "relevance": ("rank", "DESC"),
+}
 
-   
+
+def read_filters(args):
+    dept = args.get("department", "").strip()
+    name = args.get("name", "").strip()
+    sort = args.get("sort", "name_asc")
+    if sort == "relevance" and not name:
+        sort = "name_asc"  # nothing to rank against without a name filter
+    return dept, name, sort
+
+
+# Employee overview rows matching the filters, shared by the page and its CSV download
+def overview_sql(dept, name):
     conditions = []
     params = []
 
+    # Trigram similarity to the name filter, only used by the "relevance" sort
+    rank_column = "0::real"
+    if name:
+        rank_column = "similarity(e.search_name, %s)"
+        params.append(name)
+
     if dept:
         # Filter by department number (Dnumber)
         conditions.append("d.Dnumber = %s")
         params.append(dept)
 
     if name:
-        # Case-insensitive match on full name
-        conditions.append(
-            "(e.Fname || ' ' || e.Minit || ' ' || e.Lname) ILIKE %s"
-        )
-        params.append(f"%{name}%")
+        # Case-insensitive match on full name, served by the trigram index on
+        # the generated search_name column (sql/employee_search.sql)
+        conditions.append("e.search_name ILIKE %s ESCAPE '\\'")
+        params.append(f"%{escape_like(name)}%")
 
     where_clause = ""
     if conditions:
         where_clause = "WHERE " + " AND ".join(conditions)
 
+    sql = f"""
+            SELECT
+                e.Ssn,
+                e.Fname || ' ' || e.Minit || '. ' || e.Lname AS full_name,
+                d.Dname AS department_name,
+                COALESCE(es.dependent_count, 0) AS num_dependents,
+                COALESCE(es.project_count, 0)   AS num_projects,
+                COALESCE(es.total_hours, 0)     AS total_hours,
+                {rank_column} AS rank
+            FROM Employee e
+            LEFT JOIN Department d ON e.Dno = d.Dnumber
+            -- per-employee counts maintained by triggers (sql/employee_stats.sql)
+            LEFT JOIN employee_stats es ON es.Ssn = e.Ssn
+            {where_clause}
+    """
+    return sql, params
+
+
+# Department dropdown used by the overview filter and the employee forms
+DEPARTMENT_OPTIONS_SQL = "SELECT Dnumber, Dname FROM Department ORDER BY Dname"
+
+
+def department_options():
+    return cached_query(DEPARTMENT_OPTIONS_SQL, tags=("department",))
+
+
+# The overview page requested by args: its KeysetPage and the template
+# variables describing the filters. Shared with the async app (app/aio.py).
+def overview_page(args):
+    dept, name, sort = read_filters(args)
+
+    try:
+        per_page = int(args.get("per_page", PAGE_SIZE_DEFAULT))
+    except ValueError:
+        per_page = PAGE_SIZE_DEFAULT
+    per_page = max(1, min(per_page, PAGE_SIZE_MAX))
+
+    # Keyset cursors: "after" moves to the next page, "before" to the previous one
+    after = decode_cursor(args.get("after", ""))
+    before = decode_cursor(args.get("before", ""))
+
+    sort_column, direction = SORT_OPTIONS.get(sort, ("full_name", "ASC"))
+    base_sql, params = overview_sql(dept, name)
+
+    # Seek past the cursor on (sort key, Ssn); Ssn breaks ties between equal sort keys.
+    # Seeking backwards flips both the comparison and the ordering.
+    backwards = before is not None and after is None
+    cursor = before if backwards else after
+    if backwards:
+        direction = "DESC" if direction == "ASC" else "ASC"
+
+    seek_clause = ""
+    if cursor:
+        comparison = ">" if direction == "ASC" else "<"
+        seek_clause = f"WHERE ({sort_column}, Ssn) {comparison} (%s, %s)"
+        params.extend(cursor)
+
     # --- Main employee overview query ---
     sql = f"""
-        WITH dep_counts AS (
-            SELECT Essn, COUNT(*) AS dependent_count
-            FROM Dependent
-            GROUP BY Essn
-        ),
-        proj_stats AS (
-            SELECT Essn,
-                   COUNT(DISTINCT Pno) AS project_count,
-                   SUM(Hours) AS total_hours
-            FROM Works_On
-            GROUP BY Essn
-        )
-        SELECT
-            e.Ssn,
-            e.Fname || ' ' || e.Minit || '. ' || e.Lname AS full_name,
-            d.Dname AS department_name,
-            COALESCE(dc.dependent_count, 0) AS num_dependents,
-            COALESCE(ps.project_count, 0)    AS num_projects,
-            COALESCE(ps.total_hours, 0)      AS total_hours
-        FROM Employee e
-        LEFT JOIN Department d ON e.Dno = d.Dnumber
-        LEFT JOIN dep_counts dc ON dc.Essn = e.Ssn
-        LEFT JOIN proj_stats ps ON ps.Essn = e.Ssn
-        {where_clause}
-        ORDER BY {order_by}
+        SELECT * FROM (
+            {base_sql}
+        ) AS overview
+        {seek_clause}
+        ORDER BY {sort_column} {direction}, Ssn {direction}
+        LIMIT %s
     """
+    # Prepared per variant; every part of the SQL that varies comes from a
+    # whitelist, so there are at most a few dozen variants
+    variant = ":".join([
+        "dept" if dept else "all",
+        "name" if name else "any",
+        sort_column,
+        direction,
+        "seek" if cursor else "first",
+    ])
+    statements.register(f"employees.overview:{variant}", sql)
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(sql, params)
-    employees = cur.fetchall()
-    cur.close()
-    conn.close()
+    page = KeysetPage(sql, params, sort_column, per_page, backwards, cursor is not None)
+    filters = {
+        "current_dept": dept,
+        "current_name": name,
+        "current_sort": sort,
+        "per_page": per_page,
+    }
+    return page, filters
 
-    # --- Load departments for dropdown ---
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT Dnumber, Dname FROM Department ORDER BY Dname;")
-    departments = cur.fetchall()
-    cur.close()
-    conn.close()
 
-    return render_template(
+@employees_bp.route("/")
+@read_only
+@conditional_page("employee", "department", "works_on", "dependent")
+def home():
+    employees, filters = overview_page(request.args)
+
+    # The employee page and the department dropdown in one round trip
+    data = fetch_batch(
+        employees=Query(employees.sql, employees.query_params()),
+        departments=Query(DEPARTMENT_OPTIONS_SQL, tags=("department",)),
+    )
+    employees.load(data["employees"], data["employees"].description)
+    departments = data["departments"]
+
+    # Both result sets are read in full first (the employees are one keyset
+    # page, at most per_page rows); stream_template then sends the HTML in
+    # chunks as the template renders instead of building the whole string
+    return stream_template(
         "home_employees.html",
         employees=employees,
         departments=departments,
-        current_dept=dept,
-        current_name=name,
-        current_sort=sort,
+        **filters,
+    )
+
+
+# Employees Overview CSV download (admin only), all rows matching the current filters
+@employees_bp.route("/export")
+@read_only
+@admin_required("You do not have permission to download employee data.")
+def export_employees():
+    dept, name, sort = read_filters(request.args)
+    sort_column, direction = SORT_OPTIONS.get(sort, ("full_name", "ASC"))
+    base_sql, params = overview_sql(dept, name)
+
+    return csv_response(
+        f"""
+        SELECT full_name, department_name, num_dependents, num_projects, total_hours
+        FROM ({base_sql}) AS overview
+        ORDER BY {sort_column} {direction}, Ssn {direction}
+        """,
+        params,
+        ["Full_Name", "Department", "Dependents", "Projects", "Total_Hours"],
+        "employees.csv",
     )
+
+
+# Typeahead search: JSON list of employees whose name matches q, best match first
+@employees_bp.route("/search")
+@login_required(api=True)
+def search_employees():
+    q = request.args.get("q", "").strip()
+    try:
+        limit = int(request.args.get("limit", SEARCH_LIMIT_DEFAULT))
+    except ValueError:
+        limit = SEARCH_LIMIT_DEFAULT
+    limit = max(1, min(limit, SEARCH_LIMIT_MAX))
+
+    if not q:
+        return jsonify([])
+
+    # Fewer than three characters produce no usable trigrams for a substring or
+    # similarity match, so short queries become an anchored prefix match instead
+    if len(q) < 3:
+        match = "e.search_name ILIKE %(prefix)s ESCAPE '\\'"
+    else:
+        match = "(e.search_name %% %(q)s OR e.search_name ILIKE %(contains)s ESCAPE '\\')"
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        f"""
+        SELECT
+            e.Ssn,
+            e.Fname || ' ' || e.Minit || '. ' || e.Lname AS full_name,
+            d.Dname AS department_name,
+            similarity(e.search_name, %(q)s) AS score
+        FROM Employee e
+        LEFT JOIN Department d ON e.Dno = d.Dnumber
+        WHERE {match}
+        ORDER BY score DESC, e.Ssn
+        LIMIT %(limit)s
+        """,
+        {"q": q, "prefix": f"{escape_like(q)}%", "contains": f"%{escape_like(q)}%", "limit": limit},
+    )
+    results = [
+        {"ssn": ssn, "name": full_name, "department": department, "score": round(score, 3)}
+        for ssn, full_name, department, score in cur.fetchall()
+    ]
+    cur.close()
+
+    return jsonify(results)
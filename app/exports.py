@@ -0,0 +1,70 @@
+import csv
+import io
+import zlib
+from flask import Response, request, stream_with_context
+from app.db import get_db_connection
+
+# Rows from COPY arrive one per chunk; they are grouped into blocks of about
+# this size before being written to the client
+CHUNK_SIZE = 64 * 1024
+
+
+def csv_line(values):
+    out = io.StringIO()
+    csv.writer(out, lineterminator="\n").writerow(values)  # match COPY line endings
+    return out.getvalue().encode()
+
+
+def copy_csv(sql, params=None, header=None):
+    # Streams the result of sql as CSV straight from Postgres with
+    # COPY ... TO STDOUT, so memory use does not depend on the result size.
+    # The connection is checked out here, inside the generator, because the
+    # view's teardown has already run by the time a streamed body is consumed.
+    if header:
+        yield csv_line(header)
+
+    cur = get_db_connection().cursor()
+    try:
+        with cur.copy(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv)", params) as copy:
+            for chunk in copy:
+                yield bytes(chunk)
+    finally:
+        cur.close()
+
+
+def buffered(chunks, size=CHUNK_SIZE):
+    block = bytearray()
+    for chunk in chunks:
+        block += chunk
+        if len(block) >= size:
+            yield bytes(block)
+            block.clear()
+    if block:
+        yield bytes(block)
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def streaming_response(chunks, mimetype, filename):
+    headers = {
+        "Content-Disposition": f"attachment;filename={filename}",
+        "Vary": "Accept-Encoding",
+    }
+    chunks = buffered(chunks)
+    # Compress on the fly for clients that accept it
+    if request.accept_encodings["gzip"]:
+        chunks = gzipped(chunks)
+        headers["Content-Encoding"] = "gzip"
+
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+
+def csv_response(sql, params, header, filename):
+    return streaming_response(copy_csv(sql, params, header), "text/csv", filename)
@@ -0,0 +1,160 @@
+import os
+import hashlib
+import functools
+from flask import current_app, request, session
+from flask.globals import request_ctx
+from app import statements
+from app.db import get_db_connection
+
+# Conditional GET for the list and overview pages. A page's ETag is built from
+# the change counters of the tables it reads (data_version and data_change,
+# kept by triggers in sql/data_versions.sql), the viewer, the URL and the app build.
+# When the browser already has that version the page is answered with
+# 304 Not Modified after one small lookup, without running the page's queries
+# or rendering its template. Static files get a content fingerprint in their
+# URL (?v=...) and are cached for a year.
+
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+DATA_VERSIONS_SQL = statements.register("httpcache.data_versions", """
+    SELECT string_agg(v.table_name || ':' || (v.version + c.changes), ',' ORDER BY v.table_name),
+           MAX(GREATEST(v.changed_at, c.changed_at)),
+           COUNT(*)
+    FROM data_version v
+    -- committed changes not yet folded into data_version
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*) AS changes, MAX(changed_at) AS changed_at
+        FROM data_change
+        WHERE table_name = v.table_name
+    ) c
+    WHERE v.table_name = ANY(%s)
+""")
+
+build_ids = {}
+static_fingerprints = {}  # path -> (mtime, fingerprint)
+
+
+def build_id(root):
+    # Changes whenever a template or static file changes, so a deploy never
+    # answers 304 for a page rendered by the old templates
+    if root not in build_ids:
+        digest = hashlib.sha1()
+        for folder in ("templates", "static"):
+            for dirpath, _, filenames in sorted(os.walk(os.path.join(root, folder))):
+                for filename in sorted(filenames):
+                    with open(os.path.join(dirpath, filename), "rb") as f:
+                        digest.update(filename.encode() + f.read())
+        build_ids[root] = digest.hexdigest()[:12]
+    return build_ids[root]
+
+
+def page_etag(full_path, versions, username, role, build):
+    # The pages show the viewer's name and admin-only controls, so they are
+    # part of the ETag too
+    raw = "|".join([full_path, versions or "", str(username), str(role), build])
+    return hashlib.sha1(raw.encode()).hexdigest()[:24]
+
+
+def is_fresh(req, etag, last_modified):
+    if req.if_none_match:
+        return req.if_none_match.contains_weak(etag)
+    if req.if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0) <= req.if_modified_since
+    return False
+
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # the browser keeps the page but asks (with the ETag) before reusing it
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+
+def page_versions(tables, row):
+    # (versions, last modified) from a DATA_VERSIONS_SQL row, or (None, None)
+    # when a table has no counter (sql/data_versions.sql not applied): its
+    # changes would never reach the ETag, so the page gets no validators
+    versions, last_modified, counted = row
+    if counted < len(set(tables)):
+        return None, None
+    return versions, last_modified
+
+
+def data_versions(tables):
+    cur = get_db_connection().cursor()
+    statements.execute(cur, DATA_VERSIONS_SQL, (list(tables),))
+    row = cur.fetchone()
+    cur.close()
+    return page_versions(tables, row)
+
+
+def conditional_page(*tables):
+    # Decorator for GET pages that only depend on tables
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # Flashed messages are shown once, never from a cached copy
+            if request.method != "GET" or "_flashes" in session:
+                return view(*args, **kwargs)
+
+            versions, last_modified = data_versions(tables)
+            if versions is None:
+                return view(*args, **kwargs)
+            etag = page_etag(request.full_path, versions, session.get("username"), session.get("role"),
+                             build_id(current_app.root_path))
+            if is_fresh(request, etag, last_modified):
+                response = current_app.response_class(status=304)
+                set_validators(response, etag, last_modified)
+                return response
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and "_flashes" not in session and not request_ctx.flashes:
+                set_validators(response, etag, last_modified)
+            return response
+        return wrapper
+    return decorator
+
+
+def static_fingerprint(static_folder, filename):
+    path = os.path.join(static_folder, filename)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = static_fingerprints.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, "rb") as f:
+            cached = (mtime, hashlib.sha1(f.read()).hexdigest()[:10])
+        static_fingerprints[path] = cached
+    return cached[1]
+
+
+def static_url_defaults(static_folder):
+    # url_defaults hook: url_for("static", filename=...) gets ?v=<content hash>
+    def add_version(endpoint, values):
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            fingerprint = static_fingerprint(static_folder, values["filename"])
+            if fingerprint:
+                values["v"] = fingerprint
+    return add_version
+
+
+def cache_static(req, response):
+    # A fingerprinted URL never changes content, so it can be cached for good
+    if req.endpoint == "static" and req.args.get("v") and response.status_code == 200:
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+def static_cache_headers(response):
+    return cache_static(request, response)
+
+
+def init_http_cache(app):
+    app.url_defaults(static_url_defaults(app.static_folder))
+    app.after_request(static_cache_headers)
@@ -0,0 +1,425 @@
+import os
+import time
+import uuid
+import atexit
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import openpyxl
+from flask import Blueprint, current_app, jsonify, redirect, render_template, request, send_file, session, url_for
+from psycopg.types.json import Jsonb
+from app import create_app
+from app.authz import admin_required
+from app.bulk import ENTITIES, import_rows, read_xlsx_rows
+from app.cache import invalidate
+from app.db import get_db_connection
+from app.exports import copy_csv, csv_line
+
+jobs_bp = Blueprint("jobs", __name__, url_prefix="/jobs")
+
+# Background jobs for imports and exports that are too slow for a request.
+# The view records the job in the jobs table (sql/jobs.sql) and answers at
+# once with its id; a worker process runs it and writes its progress, counts
+# and per-row errors back to the row, which the status page polls. Finished
+# export files are kept in JOB_DIR and downloaded by job id.
+#
+# A running job holds two connections from its worker's pool for as long as
+# it runs: one for the job's own queries and one that commits its progress.
+# Each worker runs one job at a time, so the workers need JOB_WORKERS * 2
+# connections on top of the web pool (DB_POOL_MAX_SIZE must be at least 2).
+JOB_CONFIG = {
+    "workers": int(os.getenv("JOB_WORKERS", "2")),  # 0 runs jobs inside the request
+    "dir": os.getenv("JOB_DIR", os.path.join(tempfile.gettempdir(), "company_portal_jobs")),
+    "retention": float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600))),
+    "progress_interval": float(os.getenv("JOB_PROGRESS_INTERVAL", "1")),
+    "max_errors": int(os.getenv("JOB_MAX_ERRORS", "1000")),  # per-row errors kept in the result
+    # a running job with no progress for this long was lost with its worker
+    "stale": float(os.getenv("JOB_STALE_SECONDS", "300")),
+}
+
+FINISHED = ("succeeded", "failed")
+
+CREATE_JOB_SQL = """
+    INSERT INTO jobs (id, kind, params, created_by) VALUES (%s, %s, %s, %s)
+"""
+
+START_JOB_SQL = """
+    UPDATE jobs SET status = 'running', started_at = now(), updated_at = now()
+    WHERE id = %s AND status = 'queued'
+    RETURNING kind, params
+"""
+
+PROGRESS_SQL = """
+    UPDATE jobs SET rows_done = %s, rows_total = COALESCE(%s, rows_total), updated_at = now()
+    WHERE id = %s
+"""
+
+FINISH_JOB_SQL = """
+    UPDATE jobs
+    SET status = %s, rows_done = %s, result = %s, error = %s, file_path = %s, file_name = %s,
+        finished_at = now(), updated_at = now()
+    WHERE id = %s AND status IN ('queued', 'running')
+"""
+
+JOB_SQL = """
+    SELECT id, kind, status, rows_done, rows_total, result, error, file_path, file_name,
+           created_by, created_at, started_at, updated_at, finished_at
+    FROM jobs
+    WHERE id = %s
+"""
+
+# Jobs left behind by a worker pool that died or was restarted: running jobs
+# that stopped reporting progress go back to the queue
+REQUEUE_STALE_JOBS_SQL = """
+    UPDATE jobs SET status = 'queued', started_at = NULL, rows_done = 0, rows_total = NULL, updated_at = now()
+    WHERE status = 'running' AND updated_at < now() - make_interval(secs => %s)
+"""
+
+QUEUED_JOBS_SQL = """
+    SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at
+"""
+
+PURGE_JOBS_SQL = """
+    DELETE FROM jobs
+    WHERE created_at < now() - make_interval(secs => %s) AND status IN ('succeeded', 'failed')
+    RETURNING file_path, params->>'upload'
+"""
+
+
+def job_file(job_id, extension):
+    os.makedirs(JOB_CONFIG["dir"], exist_ok=True)
+    return os.path.join(JOB_CONFIG["dir"], f"{job_id}{extension}")
+
+
+def remove_file(path):
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class JobProgress:
+    # Counts the rows a job has processed and writes the count to its row at
+    # most every JOB_PROGRESS_INTERVAL seconds, on a connection of its own so
+    # the update is visible while the job's transaction is still open
+
+    def __init__(self, conn, job_id):
+        self.conn = conn
+        self.job_id = job_id
+        self.done = 0
+        self.reported_at = 0.0
+
+    def report(self, total=None, force=False):
+        now = time.monotonic()
+        if not force and now - self.reported_at < JOB_CONFIG["progress_interval"]:
+            return
+        self.reported_at = now
+        self.conn.execute(PROGRESS_SQL, (self.done, total, self.job_id))
+        self.conn.commit()
+
+    def counted(self, items):
+        for item in items:
+            self.done += 1
+            self.report()
+            yield item
+
+
+# --- Job kinds ---
+# Each runs in an app context (a worker's, or the request's with JOB_WORKERS=0)
+# and returns (result, (file path, download name) or None). Jobs store their
+# parameters, never SQL: the job kind builds its queries from them.
+
+# kind -> (function, tables whose cached results it makes stale)
+JOB_KINDS = {}
+
+
+def register_job_kind(kind, run, tables=()):
+    # Blueprints register their job kinds at import, which create_app() does
+    # in the web process and in every worker
+    JOB_KINDS[kind] = (run, tuple(tables))
+
+
+def xlsx_data_rows(path):
+    # Row count from the sheet's dimensions, without reading the rows
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        max_row = workbook.active.max_row
+    finally:
+        workbook.close()
+    return max(max_row - 1, 0) if max_row else None
+
+
+def department_import_job(job_id, params, progress):
+    upload = params["upload"]
+    try:
+        progress.report(total=xlsx_data_rows(upload), force=True)
+        with open(upload, "rb") as f:
+            rows = progress.counted(read_xlsx_rows(f, ENTITIES["department"]))
+            summary = import_rows(get_db_connection(), "department", rows)
+    finally:
+        remove_file(upload)
+
+    errors = summary.pop("errors")
+    summary["filename"] = params.get("filename")
+    summary["error_count"] = len(errors)
+    summary["errors"] = errors[:JOB_CONFIG["max_errors"]]
+    return summary, None
+
+
+register_job_kind("department_import", department_import_job, ("department",))
+
+
+def export_csv(job_id, progress, sql, params, header, filename):
+    # Writes the query's rows to the job's file, for export job kinds
+    path = job_file(job_id, ".csv")
+    try:
+        with open(path, "wb") as f:
+            f.write(csv_line(header))
+            # COPY sends one row per chunk
+            for chunk in progress.counted(copy_csv(sql, params)):
+                f.write(chunk)
+    except Exception:
+        remove_file(path)  # no half-written files
+        raise
+    return {"rows": progress.done}, (path, filename)
+
+
+def execute_job(app, job_id):
+    # Runs a queued job and records the outcome; returns the tables to invalidate
+    with app.app_context():
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(START_JOB_SQL, (job_id,))
+        row = cur.fetchone()
+        conn.commit()
+        if row is None:
+            cur.close()
+            return ()  # already taken, finished or purged
+        kind, params = row
+        if kind not in JOB_KINDS:
+            cur.execute(FINISH_JOB_SQL, ("failed", 0, None, f"Unknown job kind {kind}", None, None, job_id))
+            conn.commit()
+            cur.close()
+            return ()
+        run, tables = JOB_KINDS[kind]
+
+        # A second connection, so progress is committed apart from the job's
+        # transaction; held until the job ends (see JOB_CONFIG)
+        with app.extensions["db_pool"].connection() as progress_conn:
+            progress = JobProgress(progress_conn, job_id)
+            try:
+                result, output = run(job_id, params, progress)
+            except Exception as e:
+                conn.rollback()
+                print(f"\033[1;91mJob {job_id} ({kind}) failed: {str(e)}\033[0m")
+                cur.execute(FINISH_JOB_SQL, ("failed", progress.done, None, str(e), None, None, job_id))
+                conn.commit()
+                cur.close()
+                return ()
+
+        file_path, file_name = output or (None, None)
+        cur.execute(FINISH_JOB_SQL, ("succeeded", progress.done, Jsonb(result), None, file_path, file_name, job_id))
+        conn.commit()
+        cur.close()
+        return tables
+
+
+# --- Worker processes ---
+# Workers are spawned (not forked, the web process has pool threads running)
+# and each builds its own app, with its own connection pool.
+
+worker_app = None
+
+
+def init_worker():
+    global worker_app
+    worker_app = create_app()
+
+
+def run_job(job_id):
+    return execute_job(worker_app, job_id)
+
+
+def fail_job(job_id, message):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(FINISH_JOB_SQL, ("failed", 0, None, message, None, None, job_id))
+    conn.commit()
+    cur.close()
+
+
+class JobRunner:
+    def __init__(self, app, workers):
+        self.app = app
+        self.workers = workers
+        self.executor = None
+        self.recovered = False
+        self.lock = threading.Lock()
+
+    def recover(self):
+        # before_request hook: the first request this web process serves
+        # picks up the jobs a previous process left queued or running (CLI
+        # commands and job workers never serve requests, so never run this)
+        with self.lock:
+            if self.recovered:
+                return
+            self.recovered = True
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(REQUEUE_STALE_JOBS_SQL, (JOB_CONFIG["stale"],))
+            cur.execute(QUEUED_JOBS_SQL)
+            job_ids = [str(row[0]) for row in cur.fetchall()]
+            if self.workers == 0:
+                # no background workers to hand them to
+                for job_id in job_ids:
+                    cur.execute(FINISH_JOB_SQL, ("failed", 0, None, "Interrupted by a restart", None, None, job_id))
+                job_ids = []
+            conn.commit()
+        except Exception as e:
+            # Not worth failing the request over; the jobs wait for the next start
+            conn.rollback()
+            print(f"\033[1;91mJob recovery failed: {str(e)}\033[0m")
+            return
+        finally:
+            cur.close()
+        # A job still queued in another live process is only started once
+        # (START_JOB_SQL), whichever pool gets to it first
+        for job_id in job_ids:
+            self.submit(job_id)
+
+    def get_executor(self):
+        # Started on the first job, so CLI commands and idle workers never spawn processes
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=init_worker,
+                )
+                atexit.register(self.executor.shutdown, wait=False, cancel_futures=True)
+            return self.executor
+
+    def submit(self, job_id):
+        if self.workers == 0:
+            invalidate(*execute_job(self.app, job_id))
+            return
+        future = self.get_executor().submit(run_job, job_id)
+        future.add_done_callback(lambda done: self.finished(job_id, done))
+
+    def finished(self, job_id, future):
+        # Runs in the web process: cached results live here, and a worker that
+        # died could not record its own failure
+        with self.app.app_context():
+            error = future.exception()
+            if error is None:
+                invalidate(*future.result())
+                return
+            print(f"\033[1;91mJob {job_id} worker failed: {str(error)}\033[0m")
+            if isinstance(error, BrokenProcessPool):
+                with self.lock:
+                    self.executor = None  # start a fresh pool for the next job
+            fail_job(job_id, f"The job's worker process failed: {error}")
+
+
+def new_job_id():
+    return str(uuid.uuid4())
+
+
+def purge_old_jobs(cur):
+    cur.execute(PURGE_JOBS_SQL, (JOB_CONFIG["retention"],))
+    for file_path, upload in cur.fetchall():
+        remove_file(file_path)
+        remove_file(upload)
+
+
+def create_job(job_id, kind, params):
+    # Records the job, hands it to the runner and returns at once
+    conn = get_db_connection()
+    cur = conn.cursor()
+    purge_old_jobs(cur)
+    cur.execute(CREATE_JOB_SQL, (job_id, kind, Jsonb(params), session.get("username")))
+    conn.commit()
+    cur.close()
+    current_app.extensions["job_runner"].submit(job_id)
+    return job_id
+
+
+def job_accepted(job_id):
+    # API clients get 202 with the status URL, browsers the status page
+    if request.accept_mimetypes.best == "application/json":
+        status_url = url_for("jobs.job_status", job_id=job_id)
+        return jsonify({"job": job_id, "status": status_url}), 202, {"Location": status_url}
+    return redirect(url_for("jobs.job_page", job_id=job_id))
+
+
+def load_job(job_id):
+    cur = get_db_connection().cursor()
+    cur.execute(JOB_SQL, (str(job_id),))
+    row = cur.fetchone()
+    names = [column.name for column in cur.description]
+    cur.close()
+    return dict(zip(names, row)) if row else None
+
+
+def job_json(job):
+    data = {
+        "id": str(job["id"]),
+        "kind": job["kind"],
+        "status": job["status"],
+        "finished": job["status"] in FINISHED,
+        "rows_done": job["rows_done"],
+        "rows_total": job["rows_total"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_by": job["created_by"],
+        "download": None,
+    }
+    for name in ("created_at", "started_at", "updated_at", "finished_at"):
+        data[name] = job[name].isoformat() if job[name] else None
+    if job["status"] == "succeeded" and job["file_path"]:
+        data["download"] = url_for("jobs.download_job", job_id=job["id"])
+    return data
+
+
+# Job status page, polls the JSON below until the job finishes (admin only)
+@jobs_bp.route("/<uuid:job_id>")
+@admin_required("You do not have permission to view jobs.")
+def job_page(job_id):
+    job = load_job(job_id)
+    if job is None:
+        return render_template("job_status.html", job=None), 404
+    return render_template("job_status.html", job=job_json(job))
+
+
+@jobs_bp.route("/<uuid:job_id>/status")
+@admin_required("You do not have permission to view jobs.", api=True)
+def job_status(job_id):
+    job = load_job(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job_json(job))
+
+
+# A finished export's file
+@jobs_bp.route("/<uuid:job_id>/download")
+@admin_required("You do not have permission to download job files.", api=True)
+def download_job(job_id):
+    job = load_job(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    if job["status"] != "succeeded" or not job["file_path"]:
+        return jsonify({"error": "job has no file to download", "status": job["status"]}), 409
+    if not os.path.exists(job["file_path"]):
+        return jsonify({"error": "job file has been removed"}), 410
+    return send_file(job["file_path"], mimetype="text/csv", as_attachment=True, download_name=job["file_name"])
+
+
+def init_jobs(app):
+    runner = JobRunner(app, JOB_CONFIG["workers"])
+    app.extensions["job_runner"] = runner
+    app.before_request(runner.recover)
+    return runner
@@ -1,64 +1,75 @@
-from flask import Blueprint, render_template, session, redirect, url_for, request, flash
-from app.db import get_db_connection
-from psycopg import errors
-import openpyxl
+from flask import Blueprint, render_template, redirect, request, flash, jsonify
+from app.authz import admin_required, login_required
+from app.cache import cached_query
+from app.httpcache import conditional_page
+from app.jobs import create_job, job_accepted, job_file, new_job_id
+from app.replicas import read_only
 
 managers_bp = Blueprint("managers", __name__, url_prefix="/managers")
 
+# Department overview with manager info and stats, shared with the async app (app/aio.py)
+MANAGERS_OVERVIEW_SQL = """
+    SELECT 
+        d.dname AS department_name,
+        d.dnumber AS department_number,
+        COALESCE(e.fname || ' ' || e.minit || '. ' || e.lname, 'N/A') AS manager_name,
+        COALESCE(ds.employee_count, 0) AS employee_count,
+        COALESCE(ds.total_hours, 0) AS total_hours
+    FROM department d
+    LEFT JOIN employee e ON d.mgr_ssn = e.ssn
+    -- per-department rollup maintained by triggers (sql/department_stats.sql)
+    LEFT JOIN department_stats ds ON ds.dnumber = d.dnumber
+    ORDER BY d.dname
+"""
+MANAGERS_OVERVIEW_TAGS = ("department", "employee", "works_on")
+
 # A6: Managers Overview (read-only for any logged-in user)
 @managers_bp.route("/overview")
+@read_only
+@conditional_page(*MANAGERS_OVERVIEW_TAGS)
 def managers_overview():
-    if "user_id" not in session:
-        return redirect(url_for("auth.login"))
-    
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Query for department overview with manager info and stats
-        cur.execute("""
-            SELECT 
-                d.dname AS department_name,
-                d.dnumber AS department_number,
-                COALESCE(e.fname || ' ' || e.minit || '. ' || e.lname, 'N/A') AS manager_name,
-                COUNT(DISTINCT emp.ssn) AS employee_count,
-                COALESCE(SUM(w.hours), 0) AS total_hours
-            FROM department d
-            LEFT JOIN employee e ON d.mgr_ssn = e.ssn
-            LEFT JOIN employee emp ON d.dnumber = emp.dno
-            LEFT JOIN works_on w ON emp.ssn = w.essn
-            GROUP BY d.dnumber, d.dname, e.fname, e.minit, e.lname
-            ORDER BY d.dname
-        """)
-        departments = cur.fetchall()
-        
-        cur.close()
-        conn.close()
+        # Same for every viewer, cached until one of the tables changes
+        departments = cached_query(MANAGERS_OVERVIEW_SQL, tags=MANAGERS_OVERVIEW_TAGS)
         
         return render_template("managers.html", departments=departments)
     
-    except Exception:
-        return render_template("managers.html", departments=[])
+    except Exception as e:
+        # A failed render is a 500, never a cacheable empty page
+        print(f"\033[1;91mError loading managers overview: {e}\033[0m")
+        flash("An unexpected error occurred while loading the managers overview.", "error")
+        return render_template("managers.html", departments=[]), 500
+
+# A6: Department drill-down, hours per project worked by the department's
+# employees (JSON, any logged-in user)
+@managers_bp.route("/<int:dnumber>/projects")
+@login_required(api=True)
+def department_projects(dnumber):
+    rows = cached_query("""
+        SELECT dph.pno, p.pname, dph.assignment_count, dph.total_hours
+        FROM department_project_hours dph
+        JOIN project p ON p.pnumber = dph.pno
+        WHERE dph.dnumber = %s
+        ORDER BY dph.total_hours DESC, dph.pno
+    """, (dnumber,), tags=("department", "employee", "project", "works_on"))
+
+    return jsonify({
+        "department": dnumber,
+        "projects": [
+            {"project_number": pno, "project_name": pname, "employees": count, "total_hours": float(hours)}
+            for pno, pname, count, hours in rows
+        ],
+    })
 
 # Excel Import Bonus Feature (admin only)
 @managers_bp.route("/import", methods=["GET"])
+@admin_required("You do not have permission to import departments.", fallback="managers.managers_overview")
 def import_departments_form():
-    if "user_id" not in session:
-        return redirect(url_for("auth.login"))
-    if session.get("role") != "admin":
-        flash("You do not have permission to import departments.", "error")
-        return redirect(url_for("managers.managers_overview"))
-    
     return render_template("import_departments.html")
 
 @managers_bp.route("/import", methods=["POST"])
+@admin_required("You do not have permission to import departments.", fallback="managers.managers_overview")
 def import_departments():
-    if "user_id" not in session:
-        return redirect(url_for("auth.login"))
-    if session.get("role") != "admin":
-        flash("You do not have permission to import departments.", "error")
-        return redirect(url_for("managers.managers_overview"))
-    
     if 'file' not in request.files:
         flash('No file selected', 'error')
         return redirect(request.url)
@@ -73,74 +84,10 @@ def import_departments():
         flash('Only .xlsx files are allowed', 'error')
         return redirect(request.url)
     
-    try:
-        workbook = openpyxl.load_workbook(file)
-        sheet = workbook.active
-        
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        success_count = 0
-        error_rows = []
-        
-        # Skip header row (row 1), start from row 2
-        for row_num in range(2, sheet.max_row + 1):
-            dnumber = sheet.cell(row=row_num, column=1).value
-            dname = sheet.cell(row=row_num, column=2).value
-            mgr_ssn = sheet.cell(row=row_num, column=3).value
-            
-            # Skip empty rows
-            if dnumber is None and dname is None:
-                continue
-                
-            try:
-                # Validate required fields
-                if dnumber is None or dname is None:
-                    error_rows.append(f"Row {row_num}: Missing required fields")
-                    continue
-                
-                # Validate data types
-                try:
-                    dnumber = int(dnumber)
-                except (ValueError, TypeError):
-                    error_rows.append(f"Row {row_num}: Department number must be a number")
-                    continue
-                
-                # Insert into department table
-                cur.execute("""
-                    INSERT INTO department (dnumber, dname, mgr_ssn)
-                    VALUES (%s, %s, %s)
-                """, (dnumber, dname, mgr_ssn))
-                
-                success_count += 1
-                
-            except errors.UniqueViolation:
-                error_rows.append(f"Row {row_num}: Department number {dnumber} already exists")
-                conn.rollback()
-                continue
-            except errors.ForeignKeyViolation:
-                error_rows.append(f"Row {row_num}: Manager SSN {mgr_ssn} not found in employees")
-                conn.rollback()
-                continue
-            except Exception as e:
-                error_rows.append(f"Row {row_num}: {str(e)}")
-                conn.rollback()
-                continue
-        
-        if success_count > 0:
-            conn.commit()
-            flash(f'Successfully imported {success_count} departments', 'success')
-        
-        if error_rows:
-            error_message = " | ".join(error_rows[:5])
-            if len(error_rows) > 5:
-                error_message += f" ... and {len(error_rows) - 5} more errors"
-            flash(f'Import errors: {error_message}', 'error')
-        
-        cur.close()
-        conn.close()
-        
-    except Exception as e:
-        flash(f'Error processing file: {str(e)}', 'error')
-    
-    return redirect(url_for('managers.import_departments_form'))
+    # The import runs as a background job (app/jobs.py); the browser is sent
+    # to its status page, which shows the imported count and rejected rows
+    job_id = new_job_id()
+    upload = job_file(job_id, ".xlsx")
+    file.save(upload)
+    create_job(job_id, "department_import", {"upload": upload, "filename": file.filename})
+    return job_accepted(job_id)
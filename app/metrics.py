@@ -0,0 +1,406 @@
+import os
+import time
+import re
+import hashlib
+import logging
+import threading
+from collections import deque
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+import psycopg
+from psycopg import Cursor
+from psycopg.pq import PipelineStatus, TransactionStatus
+
+# Latency buckets in seconds, shared by every histogram
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS_CONFIG = {
+    # statements slower than this are logged, queries with their plan; 0 disables
+    "slow_query_ms": float(os.getenv("SLOW_QUERY_MS", "500")),
+    "slow_query_explain": os.getenv("SLOW_QUERY_EXPLAIN", "1") == "1",
+    # a query shape is explained at most once per this many seconds; 0 explains every time
+    "slow_query_explain_every": float(os.getenv("SLOW_QUERY_EXPLAIN_EVERY", "600")),
+    # EXPLAIN ANALYZE runs the SELECT a second time inside the request; off by default
+    "slow_query_analyze": os.getenv("SLOW_QUERY_ANALYZE", "0") == "1",
+    "slow_query_log": os.getenv("SLOW_QUERY_LOG", ""),  # file path, empty logs to stderr only
+    "slow_query_keep": int(os.getenv("SLOW_QUERY_KEEP", "50")),
+    # explained plans that sequentially scan more rows than this get a warning; 0 disables
+    "seq_scan_rows": int(os.getenv("SEQ_SCAN_WARN_ROWS", "10000")),
+    "metrics_token": os.getenv("METRICS_TOKEN", ""),  # lets a scraper read /metrics without a login
+}
+
+slow_query_logger = logging.getLogger("company_portal.slow_query")
+
+SEQ_SCAN_NODE = re.compile(r"Seq Scan on (\S+).*\(actual time=\S+ rows=(\d+) loops=(\d+)\)")
+SEQ_SCAN_ESTIMATE = re.compile(r"Seq Scan on (\S+).*\(cost=\S+ rows=(\d+) width=\d+\)$")
+ROWS_REMOVED = re.compile(r"^\s*Rows Removed by Filter: (\d+)")
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                series["buckets"][i] += 1
+        series["sum"] += value
+        series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            label_text = format_labels(self.label_names, labels)
+            sep = "," if label_text else ""
+            for bound, count in zip(BUCKETS, series["buckets"]):
+                lines.append(f'{self.name}_bucket{{{label_text}{sep}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label_text}{sep}le="+Inf"}} {series["count"]}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {series['sum']:.6f}")
+            lines.append(f"{self.name}_count{{{label_text}}} {series['count']}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.series = {}
+
+    def inc(self, labels, value=1):
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{{{format_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", " ").replace('"', '\\"')
+
+
+def format_labels(names, values):
+    return ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values))
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_seconds = Histogram(
+            "http_request_duration_seconds", "Time spent in the view until the response is returned.",
+            ("endpoint", "method", "status"))
+        self.query_seconds = Histogram(
+            "db_query_duration_seconds", "Statement execution time.", ("endpoint", "query"))
+        self.query_rows = Counter(
+            "db_query_rows_total", "Rows returned or affected by statements.", ("endpoint", "query"))
+        self.acquire_seconds = Histogram(
+            "db_connection_acquire_seconds", "Time waiting for a pooled connection.", ("endpoint",))
+        self.render_seconds = Histogram(
+            "template_render_seconds", "Template render time.", ("template",))
+        self.slow_queries = Counter(
+            "db_slow_queries_total", "Statements slower than SLOW_QUERY_MS.", ("endpoint", "query"))
+        self.seq_scans = Counter(
+            "db_seq_scans_total", "Explained plans scanning more than SEQ_SCAN_WARN_ROWS rows of a table.",
+            ("endpoint", "table"))
+        self.login_attempts = Counter(
+            "login_attempts_total", "Login attempts by outcome.", ("outcome",))
+        self.authz_decisions = Counter(
+            "authz_decisions_total", "Access checks by route and outcome.", ("endpoint", "outcome"))
+        self.statements = {}  # query fingerprint -> SQL text
+        self.slow_log = deque(maxlen=METRICS_CONFIG["slow_query_keep"])
+        self.explained = {}  # query fingerprint -> time.monotonic() of its last EXPLAIN
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for metric in (self.request_seconds, self.query_seconds, self.query_rows,
+                           self.acquire_seconds, self.render_seconds, self.slow_queries, self.seq_scans,
+                           self.login_attempts, self.authz_decisions):
+                lines.extend(metric.render())
+            # info series mapping each query fingerprint to its SQL text
+            lines.append("# HELP db_query_info SQL text of each query fingerprint.")
+            lines.append("# TYPE db_query_info gauge")
+            for fingerprint, text in sorted(self.statements.items()):
+                lines.append(f'db_query_info{{query="{fingerprint}",sql="{escape_label(text[:200])}"}} 1')
+        return "\n".join(lines) + "\n"
+
+
+def seq_scans(plan, threshold):
+    # [(table, rows read)] for the sequential scans in an EXPLAIN ANALYZE plan
+    # that read more than threshold rows, counting those the filter removed.
+    # In an estimated plan (no ANALYZE) the planner's row estimate is used.
+    scans = []
+    current = None
+    for line in (plan or "").splitlines():
+        node = SEQ_SCAN_NODE.search(line)
+        if node:
+            loops = int(node.group(3))
+            current = [node.group(1), int(node.group(2)) * loops, loops]
+            scans.append(current)
+            continue
+        estimate = SEQ_SCAN_ESTIMATE.search(line)
+        if estimate:
+            current = [estimate.group(1), int(estimate.group(2)), 1]
+            scans.append(current)
+            continue
+        removed = ROWS_REMOVED.match(line)
+        if removed and current is not None:
+            current[1] += int(removed.group(1)) * current[2]
+        elif "->" in line:
+            current = None
+    return [(table, rows) for table, rows, _ in scans if rows > threshold]
+
+
+def explain_due(registry, key):
+    # True at most once per slow_query_explain_every for a query fingerprint
+    now = time.monotonic()
+    interval = METRICS_CONFIG["slow_query_explain_every"]
+    with registry.lock:
+        last = registry.explained.get(key)
+        if interval > 0 and last is not None and now - last < interval:
+            return False
+        registry.explained[key] = now
+    return True
+
+
+def current_registry():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get("metrics")
+
+
+def current_endpoint():
+    if has_request_context():
+        return request.endpoint or "unmatched"
+    return "cli"
+
+
+def query_text(query, conn):
+    if not isinstance(query, (str, bytes)):
+        query = query.as_string(conn)  # psycopg.sql.Composed
+    if isinstance(query, bytes):
+        query = query.decode()
+    return query
+
+
+def normalize_sql(query, conn):
+    return " ".join(query_text(query, conn).split())
+
+
+def fingerprint(text):
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+
+class InstrumentedCursor(Cursor):
+    # Cursor class for every pooled connection (see init_pool): times each
+    # statement and records it against the current route. Statements run
+    # outside an app context (e.g. pool health checks) are not recorded.
+    #
+    # In pipeline mode (app/batch.py) execute() only queues the statement, so
+    # it is recorded when its results are read instead: the time from sending
+    # it to having its rows, and the real row count.
+
+    pending = None  # (query, params, start) of a pipelined statement
+
+    def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        if self.connection.pgconn.pipeline_status != PipelineStatus.OFF:
+            result = super().execute(query, params, **kwargs)
+            self.pending = (query, params, start)
+            return result
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            self._record(query, params, time.perf_counter() - start)
+
+    def fetchone(self):
+        row = super().fetchone()
+        self._record_pending()
+        return row
+
+    def fetchmany(self, size=0):
+        rows = super().fetchmany(size)
+        self._record_pending()
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._record_pending()
+        return rows
+
+    def close(self):
+        if not self.connection.closed:
+            self._record_pending()  # results never read
+        super().close()
+
+    def _record_pending(self):
+        if self.pending is not None:
+            query, params, start = self.pending
+            self.pending = None
+            self._record(query, params, time.perf_counter() - start)
+
+    def executemany(self, query, params_seq, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, params_seq, **kwargs)
+        finally:
+            self._record(query, None, time.perf_counter() - start)
+
+    def _record(self, query, params, seconds):
+        registry = current_registry()
+        if registry is None or getattr(self.connection, "_explaining", False):
+            return
+
+        text = normalize_sql(query, self.connection)
+        if not text:
+            return  # the pool's health check runs an empty statement
+        key = fingerprint(text)
+        endpoint = current_endpoint()
+        rows = max(self.rowcount, 0)
+        with registry.lock:
+            registry.statements.setdefault(key, text)
+            registry.query_seconds.observe((endpoint, key), seconds)
+            registry.query_rows.inc((endpoint, key), rows)
+
+        threshold = METRICS_CONFIG["slow_query_ms"]
+        if threshold > 0 and seconds * 1000 >= threshold:
+            self._log_slow(registry, endpoint, key, text, query, params, seconds)
+
+    def _log_slow(self, registry, endpoint, key, text, query, params, seconds):
+        plan = None
+        # Only queries are explained, and each shape only once per
+        # slow_query_explain_every: a slow query is usually slow on every
+        # request, and explaining it each time would add to the load that
+        # made it slow. The plan is estimated unless SLOW_QUERY_ANALYZE is on,
+        # since EXPLAIN ANALYZE runs the statement again. ANALYZE is kept to
+        # plain SELECTs: a WITH can hold an INSERT or UPDATE (bulk imports'
+        # merge_sql) and only gets the estimated plan.
+        if (METRICS_CONFIG["slow_query_explain"] and text.upper().startswith(("SELECT", "WITH"))
+                and self.connection.info.transaction_status != TransactionStatus.INERROR
+                and explain_due(registry, key)):
+            analyze = METRICS_CONFIG["slow_query_analyze"] and text.upper().startswith("SELECT")
+            plan = self._explain(query, params, analyze=analyze)
+
+        entry = {
+            "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "endpoint": endpoint,
+            "query": key,
+            "ms": round(seconds * 1000, 1),
+            "sql": text,
+            "plan": plan,
+            "seq_scans": [],
+        }
+        if METRICS_CONFIG["seq_scan_rows"] > 0:
+            entry["seq_scans"] = seq_scans(plan, METRICS_CONFIG["seq_scan_rows"])
+        with registry.lock:
+            registry.slow_queries.inc((endpoint, key))
+            for table, _ in entry["seq_scans"]:
+                registry.seq_scans.inc((endpoint, table))
+            registry.slow_log.append(entry)
+        slow_query_logger.warning(
+            "slow query %.1f ms on %s [%s]: %s%s", entry["ms"], endpoint, key, text,
+            "\n" + plan if plan else "")
+        for table, rows in entry["seq_scans"]:
+            # usually a missing index for this query shape
+            slow_query_logger.warning(
+                "sequential scan of %s reading %d rows on %s [%s]", table, rows, endpoint, key)
+
+    def _explain(self, query, params, analyze=True):
+        conn = self.connection
+        conn._explaining = True
+        options = "ANALYZE, BUFFERS" if analyze else "COSTS"
+        plan = None
+        try:
+            # Savepoint: a failed EXPLAIN must not abort the request's
+            # transaction, and it is always rolled back so nothing the
+            # analyzed statement did (volatile functions, triggers) is kept
+            with conn.transaction():
+                cur = conn.cursor()
+                cur.execute(f"EXPLAIN ({options}) {query_text(query, conn)}", params)
+                plan = "\n".join(row[0] for row in cur.fetchall())
+                cur.close()
+                raise psycopg.Rollback()
+            return plan
+        except Exception as e:
+            return f"EXPLAIN failed: {e}"
+        finally:
+            conn._explaining = False
+
+
+def observe_connection_acquire(seconds):
+    registry = current_registry()
+    if registry is None:
+        return
+    with registry.lock:
+        registry.acquire_seconds.observe((current_endpoint(),), seconds)
+
+
+def observe_login(outcome):
+    # success, failed, throttled or busy
+    registry = current_registry()
+    if registry is None:
+        return
+    with registry.lock:
+        registry.login_attempts.inc((outcome,))
+
+
+def observe_authz(endpoint, outcome):
+    # allowed, unauthenticated or forbidden
+    registry = current_registry()
+    if registry is None:
+        return
+    with registry.lock:
+        registry.authz_decisions.inc((endpoint, outcome))
+
+
+def start_request_timer():
+    g.metrics_start = time.perf_counter()
+
+
+def record_request(response):
+    start = g.pop("metrics_start", None)
+    registry = current_registry()
+    if start is not None and registry is not None:
+        labels = (current_endpoint(), request.method, str(response.status_code))
+        with registry.lock:
+            registry.request_seconds.observe(labels, time.perf_counter() - start)
+    return response
+
+
+def start_render_timer(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault("metrics_render_start", {})[template.name] = time.perf_counter()
+
+
+def record_render(sender, template, context, **extra):
+    if not has_request_context():
+        return
+    start = g.get("metrics_render_start", {}).pop(template.name, None)
+    registry = current_registry()
+    if start is not None and registry is not None:
+        with registry.lock:
+            registry.render_seconds.observe((template.name,), time.perf_counter() - start)
+
+
+def init_metrics(app):
+    registry = MetricsRegistry()
+    app.extensions["metrics"] = registry
+
+    if METRICS_CONFIG["slow_query_log"]:
+        handler = logging.FileHandler(METRICS_CONFIG["slow_query_log"])
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        slow_query_logger.addHandler(handler)
+
+    app.before_request(start_request_timer)
+    app.after_request(record_request)
+    before_render_template.connect(start_render_timer, app)
+    template_rendered.connect(record_render, app)
+    return registry
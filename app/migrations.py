@@ -0,0 +1,199 @@
+import os
+import re
+import time
+import hashlib
+import click
+import psycopg
+from flask.cli import AppGroup
+from app.db import DATABASE_CONFIG
+
+db_cli = AppGroup("db", help="Apply and inspect schema migrations.")
+
+# Versioned schema migrations: migrations/NNNN_name.sql, applied in version
+# order and recorded in schema_migrations, so each runs once per database.
+# A session advisory lock lets any number of app processes start at once
+# (MIGRATE_ON_STARTUP=1) while exactly one applies what is pending. The
+# others poll for it rather than block in pg_advisory_lock: a waiting
+# statement holds a snapshot, which CREATE INDEX CONCURRENTLY would wait on.
+#
+# A migration runs in one transaction unless its first line is
+#   -- migrate: no-transaction
+# which is needed for CREATE INDEX CONCURRENTLY. Those run statement by
+# statement (each ending with ";" at the end of a line) and must be safe to
+# run again after a failure part way through.
+MIGRATION_CONFIG = {
+    "dir": os.getenv("MIGRATIONS_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "migrations")),
+    "on_startup": os.getenv("MIGRATE_ON_STARTUP", "0") == "1",
+}
+
+# advisory lock key shared by every process migrating this database
+MIGRATION_LOCK_ID = 353000023
+MIGRATION_LOCK_POLL = 0.5  # seconds
+
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+NO_TRANSACTION = "-- migrate: no-transaction"
+
+SCHEMA_MIGRATIONS_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT PRIMARY KEY,
+        name TEXT NOT NULL,
+        checksum TEXT NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        duration_ms INT NOT NULL
+    )
+"""
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        with open(path, encoding="utf-8") as f:
+            self.sql = f.read()
+        self.checksum = hashlib.sha256(self.sql.encode()).hexdigest()[:16]
+        self.transactional = not self.sql.lstrip().startswith(NO_TRANSACTION)
+
+    def statements(self):
+        # One statement per ";"-terminated line group, comment lines dropped
+        statements, lines = [], []
+        for line in self.sql.splitlines():
+            if line.strip().startswith("--"):
+                continue
+            lines.append(line)
+            if line.rstrip().endswith(";"):
+                statements.append("\n".join(lines).strip())
+                lines = []
+        if "\n".join(lines).strip():
+            statements.append("\n".join(lines).strip())
+        return statements
+
+
+def discover(directory):
+    migrations = []
+    for filename in os.listdir(directory) if os.path.isdir(directory) else ():
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    migrations.sort(key=lambda migration: migration.version)
+    versions = [migration.version for migration in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+def connect():
+    # Autocommit, so the advisory lock and no-transaction migrations work
+    return psycopg.connect(**DATABASE_CONFIG, autocommit=True)
+
+
+def acquire_lock(cur, echo):
+    waiting = False
+    while True:
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        if cur.fetchone()[0]:
+            return
+        if not waiting:
+            echo("Waiting for another process to finish migrating")
+            waiting = True
+        time.sleep(MIGRATION_LOCK_POLL)
+
+
+def applied_migrations(cur):
+    cur.execute(SCHEMA_MIGRATIONS_SQL)
+    cur.execute("SELECT version, name, checksum, applied_at FROM schema_migrations ORDER BY version")
+    return {version: (name, checksum, applied_at) for version, name, checksum, applied_at in cur.fetchall()}
+
+
+def apply_migration(conn, migration):
+    start = time.perf_counter()
+    cur = conn.cursor()
+    if migration.transactional:
+        with conn.transaction():
+            cur.execute(migration.sql)
+            record_migration(cur, migration, start)
+    else:
+        for statement in migration.statements():
+            cur.execute(statement)
+        record_migration(cur, migration, start)
+    cur.close()
+
+
+def record_migration(cur, migration, start):
+    cur.execute(
+        "INSERT INTO schema_migrations (version, name, checksum, duration_ms) VALUES (%s, %s, %s, %s)",
+        (migration.version, migration.name, migration.checksum, int((time.perf_counter() - start) * 1000)),
+    )
+
+
+def migrate(directory=None, target=None, echo=print):
+    # Applies the pending migrations up to target (all by default); returns
+    # the versions applied
+    migrations = discover(directory or MIGRATION_CONFIG["dir"])
+    done = []
+    with connect() as conn:
+        cur = conn.cursor()
+        acquire_lock(cur, echo)
+        try:
+            applied = applied_migrations(cur)
+            for migration in migrations:
+                if target is not None and migration.version > target:
+                    break
+                if migration.version in applied:
+                    if applied[migration.version][1] != migration.checksum:
+                        echo(f"\033[1;91mMigration {migration.version:04d}_{migration.name} changed after "
+                             f"it was applied; add a new migration instead\033[0m")
+                    continue
+                echo(f"Applying {migration.version:04d}_{migration.name}")
+                apply_migration(conn, migration)
+                done.append(migration.version)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+            cur.close()
+    return done
+
+
+def migration_status(directory=None):
+    # [(version, name, applied_at or None, changed since applied)]
+    migrations = discover(directory or MIGRATION_CONFIG["dir"])
+    with connect() as conn:
+        cur = conn.cursor()
+        applied = applied_migrations(cur)
+        cur.close()
+    status = []
+    for migration in migrations:
+        name, checksum, applied_at = applied.get(migration.version, (None, None, None))
+        status.append((migration.version, migration.name, applied_at,
+                       applied_at is not None and checksum != migration.checksum))
+    return status
+
+
+@db_cli.command("upgrade")
+@click.option("--target", type=int, help="stop after this version")
+def upgrade_command(target):
+    done = migrate(target=target, echo=click.echo)
+    click.echo(f"{len(done)} migration(s) applied" if done else "Database is up to date")
+
+
+@db_cli.command("status")
+def status_command():
+    pending = 0
+    for version, name, applied_at, changed in migration_status():
+        if applied_at is None:
+            pending += 1
+            state = "pending"
+        else:
+            state = f"applied {applied_at:%Y-%m-%d %H:%M}" + (" (file changed since)" if changed else "")
+        click.echo(f"{version:04d}_{name:40} {state}")
+    click.echo(f"{pending} pending")
+
+
+def init_migrations(app):
+    app.cli.add_command(db_cli)
+    if MIGRATION_CONFIG["on_startup"]:
+        try:
+            migrate()
+        except Exception as e:
+            # Do not serve requests against a half-migrated schema
+            print(f"\033[1;91mMigrations failed: {str(e)}\033[0m")
+            raise
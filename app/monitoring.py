@@ -0,0 +1,52 @@
+from flask import Blueprint, Response, current_app, jsonify, request, session
+from app.authz import admin_required, public
+from app.cache import cache_stats
+from app.db import get_db_connection, pool_stats, release_db_connection
+from app.metrics import METRICS_CONFIG
+from app.replicas import replica_stats
+from app.statements import statement_stats
+
+monitoring_bp = Blueprint("monitoring", __name__)
+
+# Connection pool statistics, with the replicas' health (any logged-in user)
+@monitoring_bp.route("/pool/stats")
+def database_pool_stats():
+    return jsonify({**pool_stats(), "replicas": replica_stats()})
+
+
+# Prepared statements: executions per statement, and plan reuse on this
+# request's pooled connection (any logged-in user)
+@monitoring_bp.route("/pool/statements")
+def prepared_statement_stats():
+    stats = statement_stats(get_db_connection())
+    release_db_connection(read_only=True)  # keeps the statements it just listed
+    return jsonify(stats)
+
+
+# Query-result cache hit/miss counters (any logged-in user)
+@monitoring_bp.route("/cache/stats")
+def result_cache_stats():
+    return jsonify(cache_stats())
+
+
+# Prometheus metrics: request, statement, connection wait and template render
+# timings. Readable when logged in or with "Authorization: Bearer <METRICS_TOKEN>".
+@monitoring_bp.route("/metrics")
+@public  # checks the session or bearer token itself
+def prometheus_metrics():
+    token = METRICS_CONFIG["metrics_token"]
+    if "user_id" not in session and not (token and request.headers.get("Authorization") == f"Bearer {token}"):
+        return Response("login required\n", status=401, mimetype="text/plain")
+
+    registry = current_app.extensions["metrics"]
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+# Most recent slow statements with their plans (admin only)
+@monitoring_bp.route("/metrics/slow")
+@admin_required("You do not have permission to view query plans.", api=True)
+def slow_queries():
+    registry = current_app.extensions["metrics"]
+    with registry.lock:
+        entries = list(registry.slow_log)
+    return jsonify(list(reversed(entries)))
@@ -0,0 +1,185 @@
+import time
+import click
+from flask.cli import AppGroup
+from psycopg import sql
+from app.migrations import connect
+
+works_on_cli = AppGroup("works-on", help="Partition Works_On by Pno, or turn it back into a plain table.")
+
+# Optional schema mode for very large assignment tables: Works_On
+# hash-partitioned by Pno. Every project's rows sit in one partition, so
+# per-project aggregates (the All Projects totals) can be computed partition
+# by partition (enable_partitionwise_aggregate) with small hash tables, and
+# vacuum works on one partition at a time. Lookups by Pno only touch one
+# partition; lookups by Essn (employee totals) check every partition's index.
+#
+# The table is rebuilt in place, in one transaction that blocks Works_On for
+# the duration of the copy: columns, constraints, indexes, triggers and the
+# views that read it are carried over, so migrations and the setup scripts'
+# triggers keep working. The same rebuild turns it back into a plain table.
+
+PARTITION_DEFAULT = 16
+
+PARTITIONS_SQL = """
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'works_on'::regclass
+    ORDER BY c.relname
+"""
+
+CONSTRAINTS_SQL = """
+    SELECT conname, contype, pg_get_constraintdef(oid)
+    FROM pg_constraint
+    WHERE conrelid = 'works_on'::regclass AND contype IN ('c', 'p', 'u', 'f')
+    ORDER BY conname
+"""
+
+# Indexes that do not back a constraint
+INDEXES_SQL = """
+    SELECT pg_get_indexdef(i.indexrelid)
+    FROM pg_index i
+    WHERE i.indrelid = 'works_on'::regclass
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid AND c.conrelid = i.indrelid)
+"""
+
+TRIGGERS_SQL = """
+    SELECT pg_get_triggerdef(oid)
+    FROM pg_trigger
+    WHERE tgrelid = 'works_on'::regclass AND NOT tgisinternal AND tgparentid = 0
+    ORDER BY tgname
+"""
+
+# Views reading Works_On, directly or through other views, in creation order
+VIEWS_SQL = """
+    WITH RECURSIVE dependents AS (
+        SELECT DISTINCT r.ev_class AS oid
+        FROM pg_depend d
+        JOIN pg_rewrite r ON r.oid = d.objid
+        WHERE d.refobjid = 'works_on'::regclass AND r.ev_class <> 'works_on'::regclass
+        UNION
+        SELECT r.ev_class
+        FROM dependents v
+        JOIN pg_depend d ON d.refobjid = v.oid
+        JOIN pg_rewrite r ON r.oid = d.objid
+        WHERE r.ev_class <> v.oid
+    )
+    SELECT DISTINCT c.oid, n.nspname, c.relname, c.relkind, pg_get_viewdef(c.oid)
+    FROM dependents v
+    JOIN pg_class c ON c.oid = v.oid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    ORDER BY c.oid
+"""
+
+# The old table, its partitions and every index on them, renamed out of the way
+OLD_RELATIONS_SQL = """
+    SELECT c.relname, c.relkind
+    FROM pg_class c
+    WHERE c.oid = 'works_on'::regclass
+       OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'works_on'::regclass)
+       OR c.oid IN (SELECT indexrelid FROM pg_index WHERE indrelid = 'works_on'::regclass
+                    OR indrelid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'works_on'::regclass))
+"""
+
+
+def works_on_partitions(conn):
+    # Partition names, or [] when Works_On is a plain table
+    cur = conn.cursor()
+    cur.execute(PARTITIONS_SQL)
+    partitions = [row[0] for row in cur.fetchall()]
+    cur.close()
+    return partitions
+
+
+def rebuild_works_on(conn, partitions, echo=print):
+    # Recreates Works_On with `partitions` hash partitions on Pno, or as a
+    # plain table when partitions is 0, keeping its rows and everything that
+    # depends on it. conn must not be in autocommit mode.
+    cur = conn.cursor()
+    cur.execute("LOCK TABLE works_on IN ACCESS EXCLUSIVE MODE")
+    cur.execute(CONSTRAINTS_SQL)
+    constraints = cur.fetchall()
+    cur.execute(INDEXES_SQL)
+    indexes = [row[0] for row in cur.fetchall()]
+    cur.execute(TRIGGERS_SQL)
+    triggers = [row[0] for row in cur.fetchall()]
+    cur.execute(VIEWS_SQL)
+    views = cur.fetchall()
+
+    for _, schema, name, kind, _ in reversed(views):
+        drop = "DROP MATERIALIZED VIEW {}" if kind == "m" else "DROP VIEW {}"
+        cur.execute(sql.SQL(drop).format(sql.Identifier(schema, name)))
+
+    cur.execute(OLD_RELATIONS_SQL)
+    for name, kind in cur.fetchall():
+        rename = "ALTER TABLE {} RENAME TO {}" if kind in ("r", "p") else "ALTER INDEX {} RENAME TO {}"
+        cur.execute(sql.SQL(rename).format(sql.Identifier(name), sql.Identifier(f"{name}_old")))
+
+    if partitions:
+        cur.execute("CREATE TABLE works_on (LIKE works_on_old INCLUDING DEFAULTS) PARTITION BY HASH (pno)")
+        for remainder in range(partitions):
+            cur.execute(sql.SQL("CREATE TABLE {} PARTITION OF works_on FOR VALUES WITH (MODULUS {}, REMAINDER {})").format(
+                sql.Identifier(f"works_on_p{remainder}"), sql.Literal(partitions), sql.Literal(remainder)))
+    else:
+        cur.execute("CREATE TABLE works_on (LIKE works_on_old INCLUDING DEFAULTS)")
+
+    start = time.perf_counter()
+    # No triggers yet: the rows, and so the summary tables, are unchanged
+    cur.execute("INSERT INTO works_on SELECT * FROM works_on_old")
+    echo(f"Copied {cur.rowcount:,} rows in {time.perf_counter() - start:.1f}s")
+
+    # Foreign keys last, after the indexes their checks use
+    for name, _, definition in sorted(constraints, key=lambda constraint: constraint[1] == "f"):
+        cur.execute(sql.SQL("ALTER TABLE works_on ADD CONSTRAINT {} {}").format(
+            sql.Identifier(name), sql.SQL(definition)))
+    for definition in indexes + triggers:
+        cur.execute(definition)
+    for _, schema, name, kind, definition in views:
+        create = "CREATE MATERIALIZED VIEW {} AS {}" if kind == "m" else "CREATE VIEW {} AS {}"
+        cur.execute(sql.SQL(create).format(sql.Identifier(schema, name), sql.SQL(definition)))
+
+    cur.execute("DROP TABLE works_on_old")
+
+    # Lets the planner aggregate per partition; off by default in Postgres
+    cur.execute("SELECT current_database()")
+    database = sql.Identifier(cur.fetchone()[0])
+    if partitions:
+        cur.execute(sql.SQL("ALTER DATABASE {} SET enable_partitionwise_aggregate = on").format(database))
+    else:
+        cur.execute(sql.SQL("ALTER DATABASE {} RESET enable_partitionwise_aggregate").format(database))
+    cur.close()
+
+
+def run_rebuild(partitions):
+    with connect() as conn:
+        conn.autocommit = False
+        with conn.transaction():
+            rebuild_works_on(conn, partitions, echo=click.echo)
+        conn.autocommit = True
+        conn.execute("ANALYZE works_on")
+
+
+@works_on_cli.command("partition")
+@click.option("--partitions", type=click.IntRange(2, 1024), default=PARTITION_DEFAULT, show_default=True)
+def partition_command(partitions):
+    run_rebuild(partitions)
+    click.echo(f"Works_On is hash-partitioned by Pno into {partitions} partitions")
+
+
+@works_on_cli.command("unpartition")
+def unpartition_command():
+    with connect() as conn:
+        partitioned = bool(works_on_partitions(conn))
+    if not partitioned:
+        click.echo("Works_On is not partitioned")
+        return
+    run_rebuild(0)
+    click.echo("Works_On is a plain table again")
+
+
+@works_on_cli.command("status")
+def status_command():
+    with connect() as conn:
+        partitions = works_on_partitions(conn)
+    click.echo(f"Works_On has {len(partitions)} hash partitions on Pno" if partitions
+               else "Works_On is not partitioned")
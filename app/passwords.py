@@ -0,0 +1,126 @@
+import os
+import hmac
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Password hashing for the login route. Hashes are computed on a small worker
+# pool with a bounded backlog: hashlib's scrypt/pbkdf2 release the GIL, so the
+# workers use real CPU cores, and when the backlog is full a login fails fast
+# instead of tying up a request thread (and its DB connection) for seconds.
+PASSWORD_CONFIG = {
+    # any werkzeug method, e.g. scrypt:32768:8:1 or pbkdf2:sha256:600000
+    "method": os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1"),
+    "workers": int(os.getenv("PASSWORD_HASH_WORKERS", "4")),
+    "queue": int(os.getenv("PASSWORD_HASH_QUEUE", "16")),  # waiting hashes beyond the workers
+    "timeout": float(os.getenv("PASSWORD_HASH_TIMEOUT", "5")),
+    # successful verifications are remembered this long, 0 turns it off
+    "verify_cache_ttl": float(os.getenv("PASSWORD_VERIFY_CACHE_TTL", "300")),
+    "verify_cache_size": int(os.getenv("PASSWORD_VERIFY_CACHE_SIZE", "1024")),
+}
+
+
+class HashPoolBusy(Exception):
+    pass
+
+
+class HashPool:
+    def __init__(self, workers, queue, timeout):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.slots = threading.BoundedSemaphore(workers + queue)
+        self.timeout = timeout
+
+    def run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HashPoolBusy()
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashPoolBusy()
+
+
+class VerifyCache:
+    # Remembers (stored hash, password) pairs that verified recently, so a
+    # user logging in again skips the hash. Entries are HMACs under a random
+    # per-process key: neither passwords nor anything that can be checked
+    # against a guess offline are kept in memory. A new stored hash (password
+    # change or rehash) never matches an old entry.
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.key = os.urandom(32)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def digest(self, password_hash, password):
+        message = password_hash.encode() + b"\0" + password.encode()
+        return hmac.new(self.key, message, hashlib.sha256).digest()
+
+    def hit(self, digest):
+        with self.lock:
+            expires_at = self.entries.get(digest)
+            if expires_at is None:
+                return False
+            if expires_at < time.monotonic():
+                del self.entries[digest]
+                return False
+            self.entries.move_to_end(digest)
+            return True
+
+    def add(self, digest):
+        with self.lock:
+            self.entries[digest] = time.monotonic() + self.ttl
+            self.entries.move_to_end(digest)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+hash_pool = HashPool(PASSWORD_CONFIG["workers"], PASSWORD_CONFIG["queue"], PASSWORD_CONFIG["timeout"])
+verify_cache = None
+if PASSWORD_CONFIG["verify_cache_ttl"] > 0:
+    verify_cache = VerifyCache(PASSWORD_CONFIG["verify_cache_ttl"], PASSWORD_CONFIG["verify_cache_size"])
+
+configured_method = None
+
+
+def hash_method(password_hash):
+    # "scrypt:32768:8:1$salt$hash" -> "scrypt:32768:8:1"
+    return password_hash.split("$", 1)[0]
+
+
+def verify_password(password_hash, password):
+    # Raises HashPoolBusy when the hash workers are saturated
+    digest = None
+    if verify_cache is not None:
+        digest = verify_cache.digest(password_hash, password)
+        if verify_cache.hit(digest):
+            return True
+
+    valid = hash_pool.run(check_password_hash, password_hash, password)
+    if valid and digest is not None:
+        verify_cache.add(digest)
+    return valid
+
+
+def hash_password(password):
+    return hash_pool.run(generate_password_hash, password, PASSWORD_CONFIG["method"])
+
+
+def needs_rehash(password_hash):
+    # True when the hash was made with a different method or cost than the
+    # configured one. werkzeug fills in default parameters ("scrypt" becomes
+    # "scrypt:32768:8:1"), so compare against a hash it actually produced.
+    global configured_method
+    if configured_method is None:
+        configured_method = hash_method(generate_password_hash("", PASSWORD_CONFIG["method"]))
+    return hash_method(password_hash) != configured_method
@@ -1,23 +1,153 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, Response
+from decimal import Decimal
+from operator import itemgetter
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from app.aggregation import AGGREGATION_CONFIG, key_ranges, parallel_totals, sample_keys, use_parallel
+from app.authz import admin_required, login_required
+from app.bulk import parse_value
+from app.cache import cached_query, invalidate
 from app.db import get_db_connection
-from psycopg import errors
-import csv
-from io import StringIO
+from app.employees import encode_cursor, decode_cursor, escape_like
+from app.exports import csv_response
+from app.httpcache import conditional_page
+from app.jobs import create_job, export_csv, job_accepted, new_job_id, register_job_kind
+from app.partitioning import works_on_partitions
+from app.replicas import mark_write, read_only
+from app import statements
+from psycopg import errors, sql
 
 projects_bp = Blueprint("projects", __name__, url_prefix="/projects")
 
+whitelisted_methods = ["headcount", "total_hours", "project_number"]
+whitelisted_directions = ["ASC", "DESC"]
+
+PICKER_LIMIT_DEFAULT = 20
+PICKER_LIMIT_MAX = 100
+
+
+# Adds hours to an employee's assignment, creating the assignment if needed
+UPSERT_HOURS_SQL = statements.register("projects.upsert_hours", """
+    INSERT INTO works_on (essn, pno, hours)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (essn, pno)
+    DO UPDATE SET hours = works_on.hours + EXCLUDED.hours;
+""")
+
+# The same for a batch of employees in one statement, so the rollup triggers
+# apply it once per department. Rows go in Ssn order: two batches lock the
+# assignments they share in the same order.
+UPSERT_HOURS_BATCH_SQL = statements.register("projects.upsert_hours_batch", """
+    INSERT INTO works_on (essn, pno, hours)
+    SELECT b.essn, %s, b.hours
+    FROM unnest(%s::char(9)[], %s::numeric[]) AS b(essn, hours)
+    ORDER BY b.essn
+    ON CONFLICT (essn, pno)
+    DO UPDATE SET hours = works_on.hours + EXCLUDED.hours;
+""")
+
+
+# Employees on a project and their hours, shared with the async app (app/aio.py)
+PROJECT_DETAILS_SQL = """
+    SELECT 
+        e.fname as first_name, 
+        e.minit as middle_initial,
+        e.lname as last_name, 
+        w.hours as hours
+    FROM employee e
+    JOIN works_on w ON e.ssn = w.essn
+    WHERE w.pno = %s
+    ORDER BY e.fname;
+"""
+
+PROJECT_LIST_TAGS = ("project", "department", "works_on")
+
+
+# Shared by the All Projects page and its CSV download; method and direction
+# must already be validated against the whitelists above.
+# Works_On is totalled per Pno before the join. Each project's rows are in one
+# partition when Works_On is partitioned (app/partitioning.py), so Postgres
+# can total each partition on its own instead of hashing every row together.
+def project_list_sql(method, direction):
+    return f"""
+        SELECT
+            p.pnumber AS project_number, 
+            p.pname AS project_name, 
+            d.dname AS owning_department, 
+            COALESCE(w.headcount, 0) AS headcount,
+            COALESCE(w.total_hours, 0) AS total_hours  
+        FROM project p
+        JOIN department d ON p.dnum = d.dnumber
+        LEFT JOIN (
+            SELECT pno, COUNT(*) AS headcount, SUM(hours) AS total_hours
+            FROM works_on
+            GROUP BY pno
+        ) w ON p.pnumber = w.pno
+        ORDER BY {method} {direction}
+        """
+
+
+# One prepared statement per whitelisted ordering
+for list_method in whitelisted_methods:
+    for list_direction in whitelisted_directions:
+        statements.register(f"projects.list:{list_method}:{list_direction}",
+                            project_list_sql(list_method, list_direction))
+
+# The same list from parallel slices (app/aggregation.py): project names, then
+# headcount and hours per project from each Pnumber range or partition
+PROJECT_LIST_COLUMNS = ["project_number", "project_name", "owning_department", "headcount", "total_hours"]
+
+PROJECT_NAMES_SQL = """
+    SELECT p.pnumber, p.pname, d.dname
+    FROM project p
+    JOIN department d ON p.dnum = d.dnumber
+    ORDER BY p.pnumber
+"""
+
+PROJECT_TOTALS_RANGE_SQL = """
+    SELECT pno, COUNT(*), SUM(hours)
+    FROM works_on
+    WHERE pno >= %s AND pno < %s
+    GROUP BY pno
+"""
+
+WORKS_ON_PNO_SAMPLE_SQL = "SELECT pno FROM works_on TABLESAMPLE SYSTEM (%s) ORDER BY pno"
+
+PROJECT_TOTALS_PARTITION_SQL = sql.SQL("SELECT pno, COUNT(*), SUM(hours) FROM {} GROUP BY pno")
+
+
+def parallel_project_list(method, direction):
+    # Rows of project_list_sql(method, direction), or None to run that query
+    # instead (small data, AGGREGATION_MODE=single, or a slice failed)
+    conn = get_db_connection()
+    estimate = use_parallel(conn)
+    if estimate is None:
+        return None
+
+    cur = conn.cursor()
+    cur.execute(PROJECT_NAMES_SQL)
+    projects = cur.fetchall()
+    cur.close()
+    partitions = works_on_partitions(conn)
+    if partitions:
+        slices = [(PROJECT_TOTALS_PARTITION_SQL.format(sql.Identifier(name)), None) for name in partitions]
+    else:
+        sample = sample_keys(conn, WORKS_ON_PNO_SAMPLE_SQL, estimate)
+        slices = [(PROJECT_TOTALS_RANGE_SQL, bounds) for bounds in key_ranges(sample, AGGREGATION_CONFIG["slices"])]
+
+    try:
+        totals = parallel_totals(slices)
+    except Exception as e:
+        print(f"\033[1;91mParallel project totals failed, running the single query: {str(e)}\033[0m")
+        return None
+
+    rows = [(pnumber, pname, dname, *totals.get(pnumber, (0, Decimal(0)))) for pnumber, pname, dname in projects]
+    rows.sort(key=itemgetter(PROJECT_LIST_COLUMNS.index(method)), reverse=direction == "DESC")
+    return rows
+
 # A3 -- All Projects
 @projects_bp.route("/all", methods=["GET", "POST"])
+@read_only
+@conditional_page("project", "department", "works_on")  # GET only, POST sorts
 def sort_projects():
-    if "user_id" not in session:
-        return redirect(url_for("auth.login"))
-    
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    whitelisted_methods = ["headcount", "total_hours", "project_number"]
-    whitelisted_directions = ["ASC", "DESC"]
-    
     method = "project_number"
     direction = "ASC"
     if request.method == "POST":  # On sorting options applied 
@@ -29,177 +159,202 @@ def sort_projects():
         if direction not in whitelisted_directions:
             direction = "ASC"
 
-    cur.execute(
-        f"""
-        SELECT
-            p.pnumber AS project_number, 
-            p.pname AS project_name, 
-            d.dname AS owning_department, 
-            COUNT(w.essn) AS headcount,
-            COALESCE(SUM(w.hours), 0) AS total_hours  
-        FROM project p
-        JOIN department d ON p.dnum = d.dnumber
-        LEFT JOIN works_on w ON p.pnumber = w.pno
-        GROUP BY p.pnumber, d.dnumber
-        ORDER BY {method} {direction};
-        """
-    )
-    project_list = cur.fetchall()
-    cur.close()
-    conn.close()
+    # Same aggregate for every viewer, cached until a project, department or assignment changes
+    project_list = cached_query(project_list_sql(method, direction), tags=PROJECT_LIST_TAGS,
+                                compute=lambda: parallel_project_list(method, direction))
     return render_template("projects.html", projects=project_list,
                            selected_method=method, selected_direction=direction)
 
 # A4 -- Project Details    
 @projects_bp.route("/<pnumber>", methods=["GET", "POST"])
+# RBAC: only admins can modify hours
+@admin_required("You do not have permission to modify project hours.", fallback="projects.project_detail", methods=["POST"])
 def project_detail(pnumber):
-    if "user_id" not in session:
-        return redirect(url_for("auth.login"))
-    
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        # Select all employees on the project and their hours
-        cur.execute(
-            """
-            SELECT 
-                e.fname as first_name, 
-                e.minit as middle_initial,
-                e.lname as last_name, 
-                w.hours as hours
-            FROM employee e
-            JOIN works_on w ON e.ssn = w.essn
-            WHERE w.pno = %s
-            ORDER BY e.fname;
-            """,
-            (pnumber,)
-        )
-        project_details = cur.fetchall()
-        
-        # Select all employees in the database
-        cur.execute(
-            """
-            SELECT 
-                ROW_NUMBER() OVER (ORDER BY e.fname) AS rownum,
-                e.fname AS first_name, 
-                e.minit AS middle_initial,
-                e.lname AS last_name
-            FROM employee e;
-            """
-        )
-        all_employees = cur.fetchall()
-    except Exception as e:
-        flash("An error occurred while fetching project details.", "error")
-        print(f"\033[1;91mError fetching project details: {str(e)}\033[0m")
-
-        cur.close()
-        conn.close()
-        return render_template("project_detail.html",
-                           details=project_details,
-                           pnumber=pnumber,
-                           employees=all_employees)
-    
     # A4 Part 2: Employee Upsert Form submission (admin only)
+    # Handled before any page queries: a POST only needs the upsert itself
     if request.method == "POST":
-        # RBAC: only admins can modify hours
-        if session.get("role") != "admin":
-            flash("You do not have permission to modify project hours.", "error")
-            cur.close()
-            conn.close()
-            return redirect(url_for("projects.project_detail", pnumber=pnumber))
-
-        employee_n = int(request.form.get("employee", ""))  # using index in case two employees have the same full name
+        target_ssn = request.form.get("employee", "")  # keyed by ssn in case two employees have the same full name
         hours = request.form.get("hours", "")
+        conn = get_db_connection()
+        cur = conn.cursor()
         try:
-            cur.execute(
-                """
-                SELECT ssn
-                FROM employee
-                ORDER BY fname
-                """
-            )
-            employee_ssns = cur.fetchall()
-            target_ssn = employee_ssns[employee_n - 1][0]  # get the ssn of the employee we want
             # add the employee to works_on for that pnumber, or update their hours 
-        
-            cur.execute(
-                """
-                INSERT INTO works_on (essn, pno, hours)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (essn, pno)
-                DO UPDATE SET hours = works_on.hours + EXCLUDED.hours;
-                """,
-                (target_ssn, pnumber, hours)
-            )
+            statements.execute(cur, UPSERT_HOURS_SQL, (target_ssn, pnumber, hours))
             conn.commit()
+            mark_write()
+            invalidate("works_on")
         except errors.NumericValueOutOfRange:
             conn.rollback()
             print("\033[1;91mError: Cannot add more hours to employee (max hours is 999.9)\033[0m")
             flash("Cannot add more hours to employee (max hours is 999.9 per employee)", "error")
+        except errors.ForeignKeyViolation:
+            conn.rollback()
+            flash("Employee or project not found", "error")
         except Exception as e:
             conn.rollback()
             print(f"\033[1;91mError adding/updating employee hours: {str(e)}\033[0m")
             flash(f"Error adding/updating employee hours", "error")
         cur.close()
-        conn.close()
         return redirect(url_for("projects.project_detail", pnumber=pnumber))
-    
-    cur.close()
-    conn.close()
+
+    project_details = []
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        # Select all employees on the project and their hours
+        cur.execute(PROJECT_DETAILS_SQL, (pnumber,))
+        project_details = cur.fetchall()
+        cur.close()
+    except Exception as e:
+        flash("An error occurred while fetching project details.", "error")
+        print(f"\033[1;91mError fetching project details: {str(e)}\033[0m")
+
+    # The employee picker loads its options from employee_options() as the admin types
     return render_template("project_detail.html",
                            details=project_details,
                            pnumber=pnumber,
-                           employees=all_employees)
+                           picker_limit=PICKER_LIMIT_DEFAULT)
+
+
+# Employee picker for the upsert form: JSON page of employees whose full name
+# starts with q, in name order. "after" is the cursor returned with the previous page.
+# Names are matched and ordered lowercased, byte by byte, which is what the
+# idx_employee_search_name_prefix index (migration 0005) holds: every page is
+# one range scan of it, however many names share the prefix.
+@projects_bp.route("/employees")
+@login_required(api=True)
+def employee_options():
+    q = request.args.get("q", "").strip()
+    try:
+        limit = int(request.args.get("limit", PICKER_LIMIT_DEFAULT))
+    except ValueError:
+        limit = PICKER_LIMIT_DEFAULT
+    limit = max(1, min(limit, PICKER_LIMIT_MAX))
+    after = decode_cursor(request.args.get("after", ""))
+
+    conditions = ["lower(e.search_name) COLLATE \"C\" LIKE lower(%s) ESCAPE '\\'"]
+    params = [f"{escape_like(q)}%"]
+    if after:
+        conditions.append("(lower(e.search_name) COLLATE \"C\", e.ssn) > (%s, %s)")
+        params.extend(after)
+    params.append(limit + 1)
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        f"""
+        SELECT e.ssn, lower(e.search_name), e.fname || ' ' || e.minit || '. ' || e.lname
+        FROM employee e
+        WHERE {" AND ".join(conditions)}
+        ORDER BY lower(e.search_name) COLLATE "C", e.ssn
+        LIMIT %s
+        """,
+        params,
+    )
+    rows = cur.fetchall()
+    cur.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+
+    return jsonify({
+        "results": [{"ssn": ssn, "name": full_name} for ssn, _, full_name in rows],
+        "next": next_cursor,
+    })
+
+# A4 Part 2: Batch hours upsert (admin only, JSON)
+# Body: [{"essn": "123456789", "hours": 2.5}, ...] (or {"assignments": [...]}).
+# Hours are added to existing assignments like the upsert form; the whole batch
+# is applied in one statement, an employee listed twice gets both amounts.
+@projects_bp.route("/<int:pnumber>/hours", methods=["POST"])
+@admin_required("You do not have permission to modify project hours.", api=True)
+def upsert_project_hours(pnumber):
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get("assignments")
+    if not isinstance(payload, list) or not payload:
+        return jsonify({"error": "Expected a non-empty list of {essn, hours} objects"}), 400
+
+    hours_by_ssn = {}
+    for i, item in enumerate(payload):
+        if not isinstance(item, dict):
+            return jsonify({"error": f"Item {i}: expected an object"}), 400
+        try:
+            essn = parse_value("ssn", "Employee SSN", item.get("essn"), {"required": True})
+            hours = parse_value("hours", "Hours", item.get("hours"), {"required": True})
+        except ValueError as e:
+            return jsonify({"error": f"Item {i}: {e}"}), 400
+        hours_by_ssn[essn] = hours_by_ssn.get(essn, 0) + hours
+
+    # ON CONFLICT cannot update the same assignment twice in one statement
+    essns = sorted(hours_by_ssn)
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        statements.execute(cur, UPSERT_HOURS_BATCH_SQL, (pnumber, essns, [hours_by_ssn[e] for e in essns]))
+        conn.commit()
+        mark_write()
+        invalidate("works_on")
+    except errors.NumericValueOutOfRange:
+        conn.rollback()
+        return jsonify({"error": "Cannot add more hours to employee (max hours is 999.9 per employee)"}), 400
+    except errors.ForeignKeyViolation as e:
+        conn.rollback()
+        return jsonify({"error": f"Employee or project not found: {e.diag.message_detail}"}), 400
+    finally:
+        cur.close()
+
+    return jsonify({"project": pnumber, "applied": len(payload)})
+
 
 @projects_bp.route("/download/<method>/<direction>", methods=["POST"])
+# RBAC: treat export as an admin-only feature
+@admin_required("You do not have permission to download project data.", fallback="projects.sort_projects")
 def download_projects(method, direction): 
-    if "user_id" not in session:
-        return redirect(url_for("auth.login"))
-    
-    # RBAC: treat export as an admin-only feature
-    if session.get("role") != "admin":
-        flash("You do not have permission to download project data.", "error")
-        return redirect(url_for("projects.sort_projects"))
-    
-    whitelisted_methods = ["headcount", "total_hours", "project_number"]
-    whitelisted_directions = ["ASC", "DESC"]
-    
     # Validate inputs against whitelisted options before querying  
     if method not in whitelisted_methods:
         method = "headcount"
     if direction not in whitelisted_directions:
         direction = "ASC"
     
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        f"""
-        SELECT
-            p.pnumber AS project_number, 
-            p.pname AS project_name, 
-            d.dname AS owning_department, 
-            COUNT(w.essn) AS headcount,
-            COALESCE(SUM(w.hours), 0) AS total_hours  
-        FROM project p
-        JOIN department d ON p.dnum = d.dnumber
-        LEFT JOIN works_on w ON p.pnumber = w.pno
-        GROUP BY p.pnumber, d.dnumber
-        ORDER BY {method} {direction};
+    # Written to a file by a background job (app/jobs.py), downloaded from
+    # the job's status page when it is done
+    job_id = new_job_id()
+    create_job(job_id, "project_export", {"method": method, "direction": direction})
+    return job_accepted(job_id)
+
+
+def project_export_job(job_id, params, progress):
+    # The job stores the ordering only; it is checked again here since the
+    # row could have been written by anything with access to the jobs table
+    method, direction = params.get("method"), params.get("direction")
+    if method not in whitelisted_methods or direction not in whitelisted_directions:
+        raise ValueError(f"Invalid project export ordering: {method} {direction}")
+    return export_csv(job_id, progress, project_list_sql(method, direction), None,
+                      ["Project_Number", "Project_Name", "Owning_Department", "Headcount", "Total_Hours"],
+                      "projects.csv")
+
+
+register_job_kind("project_export", project_export_job)
+
+
+# A4 -- Project Details CSV download
+@projects_bp.route("/<int:pnumber>/download")
+@read_only
+# RBAC: treat export as an admin-only feature
+@admin_required("You do not have permission to download project data.", fallback="projects.project_detail")
+def download_project_detail(pnumber):
+    return csv_response(
         """
-    )
-    project_list = cur.fetchall()
-    cur.close()
-    conn.close()
-    
-    # Generate CSV
-    si = StringIO()
-    cw = csv.writer(si)
-    cw.writerow(["Project_Number", "Project_Name", "Owning_Department", "Headcount", "Total_Hours"])
-    cw.writerows(project_list)
-    output = si.getvalue()
-
-    return Response(
-        output,
-        mimetype="text/csv",
-        headers={"Content-Disposition": "attachment;filename=projects.csv"}
+        SELECT e.fname, e.minit, e.lname, w.hours
+        FROM employee e
+        JOIN works_on w ON e.ssn = w.essn
+        WHERE w.pno = %s
+        ORDER BY e.fname
+        """,
+        (pnumber,),
+        ["First_Name", "Middle_Initial", "Last_Name", "Hours"],
+        f"project_{pnumber}.csv",
     )
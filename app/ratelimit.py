@@ -0,0 +1,160 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from flask import current_app
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+try:
+    import redis
+except ImportError:  # only needed for LOGIN_LIMIT_BACKEND=redis
+    redis = None
+
+# Token buckets for login attempts, one per username and one per client IP.
+# Every attempt takes a token from both buckets and tokens come back at a
+# steady rate, so a client can retry a few times in a row but not sustain
+# more than the refill rate. A throttled attempt is refused before any
+# database lookup or password hash. Limits are "<attempts>/<seconds>".
+#
+# Behind a load balancer or reverse proxy every request comes from the proxy's
+# address, so all clients would share one IP bucket. LOGIN_LIMIT_PROXY_HOPS
+# is the number of proxies in front of the app: the client IP is then taken
+# from that many entries from the right of X-Forwarded-For, which those
+# proxies append to. Entries further left are set by the client and ignored.
+# Leave it at 0 when clients reach the app directly, or they could pick any
+# IP they like.
+LIMIT_CONFIG = {
+    "backend": os.getenv("LOGIN_LIMIT_BACKEND", "memory"),  # memory, redis or none
+    "url": os.getenv("LOGIN_LIMIT_URL", os.getenv("CACHE_URL", "redis://localhost:6379/0")),
+    "prefix": os.getenv("LOGIN_LIMIT_PREFIX", "company_portal:login:"),
+    "per_username": os.getenv("LOGIN_LIMIT_PER_USERNAME", "5/60"),
+    "per_ip": os.getenv("LOGIN_LIMIT_PER_IP", "20/60"),
+    "max_keys": int(os.getenv("LOGIN_LIMIT_MAX_KEYS", "100000")),
+    "proxy_hops": int(os.getenv("LOGIN_LIMIT_PROXY_HOPS", "0")),
+}
+
+
+def parse_limit(value):
+    # "5/60" -> (capacity 5, refill 5 tokens per 60 seconds)
+    attempts, seconds = value.split("/")
+    capacity = float(attempts)
+    return capacity, capacity / float(seconds)
+
+
+class MemoryLimiter:
+    # Buckets live in this process only; behind a load balancer every worker
+    # gets its own allowance. Idle buckets are dropped least recently used first.
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        # Returns 0 when a token was taken, otherwise the seconds until one is available
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated_at = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+            return wait
+
+    def reset(self, key):
+        with self.lock:
+            self.buckets.pop(key, None)
+
+
+# KEYS[1] bucket; ARGV capacity, rate, now. Returns the wait in milliseconds.
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return math.ceil(wait * 1000)
+"""
+
+
+class RedisLimiter:
+    # Shared by every worker and node. The bucket update runs as one Lua
+    # script, so concurrent attempts cannot both take the last token. Redis
+    # errors let the attempt through rather than locking everyone out.
+
+    def __init__(self, url, prefix):
+        if redis is None:
+            raise RuntimeError("LOGIN_LIMIT_BACKEND=redis requires the redis package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.script = self.client.register_script(TAKE_SCRIPT)
+
+    def take(self, key, capacity, rate):
+        try:
+            wait_ms = self.script(keys=[self.prefix + key], args=[capacity, rate, time.time()])
+        except redis.RedisError as e:
+            print(f"\033[1;91mLogin limiter failed: {e}\033[0m")
+            return 0
+        return int(wait_ms) / 1000
+
+    def reset(self, key):
+        try:
+            self.client.delete(self.prefix + key)
+        except redis.RedisError as e:
+            print(f"\033[1;91mLogin limiter failed: {e}\033[0m")
+
+
+def init_limiter(app):
+    if LIMIT_CONFIG["proxy_hops"] > 0:
+        # request.remote_addr becomes the client's address
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=LIMIT_CONFIG["proxy_hops"])
+
+    backend = LIMIT_CONFIG["backend"]
+    if backend == "redis":
+        limiter = RedisLimiter(LIMIT_CONFIG["url"], LIMIT_CONFIG["prefix"])
+    elif backend == "memory":
+        limiter = MemoryLimiter(LIMIT_CONFIG["max_keys"])
+    else:
+        limiter = None  # no throttling
+
+    app.extensions["login_limiter"] = limiter
+    return limiter
+
+
+def login_bucket_keys(username, ip):
+    return [("user:" + username.lower(), parse_limit(LIMIT_CONFIG["per_username"])),
+            ("ip:" + (ip or "unknown"), parse_limit(LIMIT_CONFIG["per_ip"]))]
+
+
+def throttle_login(username, ip):
+    # Takes a token for the username and for the IP; returns the seconds the
+    # client has to wait, or 0 when the attempt may go ahead
+    limiter = current_app.extensions.get("login_limiter")
+    if limiter is None:
+        return 0
+    waits = [limiter.take(key, capacity, rate) for key, (capacity, rate) in login_bucket_keys(username, ip)]
+    return max(waits)
+
+
+def login_succeeded(username):
+    # A successful login refills the username's bucket, so earlier typos
+    # (or someone else guessing) do not count against the next session
+    limiter = current_app.extensions.get("login_limiter")
+    if limiter is not None:
+        limiter.reset("user:" + username.lower())
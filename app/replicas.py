@@ -0,0 +1,247 @@
+import os
+import time
+import atexit
+import threading
+import psycopg
+from flask import current_app, g, has_request_context, request, session
+from psycopg.conninfo import conninfo_to_dict
+from psycopg_pool import ConnectionPool, PoolTimeout
+from app.db import DATABASE_CONFIG, POOL_CONFIG
+from app.metrics import InstrumentedCursor
+from app.statements import configure_connection
+
+# Read replicas for the read-only pages and exports. Views marked with
+# @read_only get a replica connection, picked round-robin among the
+# replicas that are currently healthy; everything else, and every request
+# from a session that wrote something in the last READ_YOUR_WRITES_SECONDS,
+# uses the primary. A replica that cannot hand out a connection quickly, or
+# that lags too far behind, is skipped for REPLICA_RETRY_SECONDS. With no
+# healthy replica the primary serves the reads.
+#
+#   REPLICA_DSNS="host=10.0.0.2 port=5432,host=10.0.0.3 port=5432"
+#
+# Each DSN only needs what differs from the primary (DB_* settings).
+REPLICA_CONFIG = {
+    "dsns": [dsn.strip() for dsn in os.getenv("REPLICA_DSNS", "").split(",") if dsn.strip()],
+    "read_your_writes": float(os.getenv("READ_YOUR_WRITES_SECONDS", "5")),
+    "retry_after": float(os.getenv("REPLICA_RETRY_SECONDS", "30")),
+    "max_lag": float(os.getenv("REPLICA_MAX_LAG_SECONDS", "10")),
+    "checkout_timeout": float(os.getenv("REPLICA_CHECKOUT_TIMEOUT", "1")),
+}
+
+# Seconds the replica is behind the primary; 0 when it is streaming from the
+# primary and has replayed all the WAL it received, or when it is not a
+# standby at all. A standby that is not streaming (disconnected, or still
+# connecting) may be missing any amount of WAL, so it is behind by at least
+# the time since it replayed its last transaction, and NULL (unknown) when it
+# has not replayed one. Without pg_read_all_stats the WAL receiver's status
+# reads as NULL; a running receiver then counts as streaming.
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() IS NULL
+            OR NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE COALESCE(status, 'streaming') = 'streaming')
+            THEN EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        WHEN pg_last_wal_receive_lsn() <= pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+def replica_conninfo(dsn):
+    # The primary's settings (database, user, password) unless the DSN overrides them
+    settings = {key: value for key, value in DATABASE_CONFIG.items() if value is not None}
+    settings.update(conninfo_to_dict(dsn))
+    return settings
+
+
+def replica_settings():
+    # (name, connection settings) for every configured replica
+    replicas = []
+    for dsn in REPLICA_CONFIG["dsns"]:
+        settings = replica_conninfo(dsn)
+        replicas.append((f"{settings.get('host')}:{settings.get('port') or 5432}", settings))
+    return replicas
+
+
+def replica_lag(value):
+    # REPLICA_LAG_SQL's result in seconds; an unknown lag is never acceptable
+    return float("inf") if value is None else float(value)
+
+
+def check_replica(conn):
+    # Pool health check: the connection is alive, and how far behind is it?
+    # A plain cursor keeps this out of the per-route query metrics.
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        cur = psycopg.Cursor(conn)
+        cur.execute(REPLICA_LAG_SQL)
+        conn.replica_lag = replica_lag(cur.fetchone()[0])
+        cur.close()
+    finally:
+        conn.autocommit = autocommit
+
+
+async def check_replica_async(conn):
+    # check_replica for the async pools (app/aio.py)
+    autocommit = conn.autocommit
+    await conn.set_autocommit(True)
+    try:
+        cur = psycopg.AsyncCursor(conn)
+        await cur.execute(REPLICA_LAG_SQL)
+        conn.replica_lag = replica_lag((await cur.fetchone())[0])
+        await cur.close()
+    finally:
+        await conn.set_autocommit(autocommit)
+
+
+class Replica:
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.down_until = 0.0
+        self.checkouts = 0
+        self.failures = 0
+        self.last_error = None
+        self.lag = None
+
+    def mark_down(self, error):
+        self.down_until = time.monotonic() + REPLICA_CONFIG["retry_after"]
+        self.failures += 1
+        self.last_error = error
+        print(f"\033[1;91mReplica {self.name} skipped for {REPLICA_CONFIG['retry_after']:g}s: {error}\033[0m")
+
+    def stats(self):
+        stats = self.pool.get_stats()
+        return {
+            "name": self.name,
+            "healthy": self.down_until <= time.monotonic(),
+            "lag_seconds": None if self.lag == float("inf") else self.lag,  # None: not known
+            "checkouts": self.checkouts,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "pool_size": stats.get("pool_size", 0),
+            "pool_available": stats.get("pool_available", 0),
+        }
+
+
+class ReplicaSet:
+    def __init__(self, replicas):
+        self.replicas = replicas
+        self.next = 0
+        self.lock = threading.Lock()
+
+    def candidates(self):
+        # Healthy replicas, starting one further along on every call
+        now = time.monotonic()
+        with self.lock:
+            start = self.next
+            self.next = (self.next + 1) % len(self.replicas)
+        ordered = self.replicas[start:] + self.replicas[:start]
+        return [replica for replica in ordered if replica.down_until <= now]
+
+    def accept(self, replica, conn):
+        # False (and the replica is skipped for a while) when it lags too far behind
+        replica.lag = getattr(conn, "replica_lag", None)
+        if replica.lag is not None and replica.lag > REPLICA_CONFIG["max_lag"]:
+            if replica.lag == float("inf"):
+                replica.mark_down("not streaming from the primary")
+            else:
+                replica.mark_down(f"{replica.lag:.1f}s behind the primary")
+            return False
+        replica.checkouts += 1
+        return True
+
+    def request_connection(self):
+        # The replica connection for the current request, or (None, None)
+        # when it should use the primary
+        if not has_request_context() or request.endpoint is None:
+            return None, None  # e.g. the session lookup, before routing
+        view = current_app.view_functions.get(request.endpoint)
+        if not getattr(view, "db_read_only", False) or reading_own_writes(session):
+            return None, None
+        return self.getconn()
+
+    def getconn(self):
+        # Returns (connection, replica), or (None, None) when no replica can serve
+        for replica in self.candidates():
+            try:
+                conn = replica.pool.getconn(timeout=REPLICA_CONFIG["checkout_timeout"])
+            except (PoolTimeout, psycopg.Error) as e:
+                replica.mark_down(str(e) or type(e).__name__)
+                continue
+            if self.accept(replica, conn):
+                return conn, replica
+            replica.pool.putconn(conn)
+        return None, None
+
+    async def getconn_async(self):
+        # getconn for a set of async pools
+        for replica in self.candidates():
+            try:
+                conn = await replica.pool.getconn(timeout=REPLICA_CONFIG["checkout_timeout"])
+            except (PoolTimeout, psycopg.Error) as e:
+                replica.mark_down(str(e) or type(e).__name__)
+                continue
+            if self.accept(replica, conn):
+                return conn, replica
+            await replica.pool.putconn(conn)
+        return None, None
+
+    def stats(self):
+        return [replica.stats() for replica in self.replicas]
+
+
+def replica_stats():
+    replicas = current_app.extensions.get("db_replicas")
+    return replicas.stats() if replicas is not None else []
+
+
+def read_only(view):
+    # The view only reads, so a replica may serve it
+    view.db_read_only = True
+    return view
+
+
+def reading_own_writes(current_session):
+    return current_session.get("read_primary_until", 0) > time.time()
+
+
+def mark_write():
+    # Call after a view commits a change on the primary: the session then
+    # reads from the primary for a while (remember_writes). Requests that
+    # only read, whatever their method, leave the session on the replicas.
+    g.db_wrote = True
+
+
+def remember_writes(response):
+    # after_request hook: a session that just changed data on the primary
+    # reads from the primary for a while, so it sees its own changes before
+    # they have reached the replicas
+    if g.pop("db_wrote", False):
+        session["read_primary_until"] = time.time() + REPLICA_CONFIG["read_your_writes"]
+    return response
+
+
+def init_replicas(app):
+    if not REPLICA_CONFIG["dsns"]:
+        app.extensions["db_replicas"] = None
+        return None
+
+    replicas = []
+    for number, (name, settings) in enumerate(replica_settings()):
+        pool = ConnectionPool(
+            kwargs={**settings, "cursor_factory": InstrumentedCursor},
+            check=check_replica,
+            configure=configure_connection,
+            name=f"company_portal_replica_{number}",
+            open=True,
+            **POOL_CONFIG,
+        )
+        atexit.register(pool.close)
+        replicas.append(Replica(name, pool))
+
+    replica_set = ReplicaSet(replicas)
+    app.extensions["db_replicas"] = replica_set
+    app.after_request(remember_writes)
+    return replica_set
@@ -0,0 +1,303 @@
+import os
+import copy
+import time
+import secrets
+import threading
+from collections import OrderedDict
+from flask.sessions import SecureCookieSession, SessionInterface, session_json_serializer
+from itsdangerous import BadSignature, Signer
+from app import statements
+from app.db import get_db_connection, release_db_connection
+
+try:
+    import redis
+except ImportError:  # only needed for SESSION_BACKEND=redis
+    redis = None
+
+# Server-side sessions: the cookie only holds a signed random session id and
+# the session data (user, role, flashed messages) lives in a store, so a
+# session can be revoked and role changes in app_user reach it. The role is
+# re-read from app_user at most once per SESSION_ROLE_TTL per session; other
+# requests only read the session record from the store.
+#
+# Revoking a user's sessions moves their revocation epoch forward. Each
+# session records the epoch it was created in, and one from an earlier epoch
+# is dropped when it is loaded or saved. So a request that loaded a session
+# just before the revoke cannot bring it back by writing it to the store.
+SESSION_CONFIG = {
+    "backend": os.getenv("SESSION_BACKEND", "memory"),  # memory, redis or cookie
+    "url": os.getenv("SESSION_URL", os.getenv("CACHE_URL", "redis://localhost:6379/0")),
+    "prefix": os.getenv("SESSION_PREFIX", "company_portal:session:"),
+    "ttl": float(os.getenv("SESSION_TTL", "43200")),  # idle seconds before a session expires
+    "role_ttl": float(os.getenv("SESSION_ROLE_TTL", "60")),
+    "max_entries": int(os.getenv("SESSION_MAX_ENTRIES", "100000")),
+}
+
+USER_ROLE_SQL = statements.register("sessions.user_role", """
+    SELECT username, role FROM app_user WHERE id = %s
+""")
+
+
+class MemorySessionStore:
+    # One process only (the dev server, or a single ASGI worker); sessions
+    # are lost on restart. Least recently used sessions are dropped first.
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires_at, record)
+        self.indexes = {}  # user key -> session keys
+        self.epochs = {}  # user key -> revocation epoch
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, record = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return copy.deepcopy(record)
+
+    def set(self, key, record, ttl):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, copy.deepcopy(record))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def index_add(self, index, key, ttl):
+        with self.lock:
+            members = self.indexes.setdefault(index, set())
+            # forget expired and evicted sessions; members are sids, entries
+            # are keyed by session_key(sid)
+            members.intersection_update({sid for sid in members if session_key(sid) in self.entries})
+            members.add(key)
+
+    def index_pop(self, index):
+        with self.lock:
+            return list(self.indexes.pop(index, ()))
+
+    def epoch(self, index):
+        with self.lock:
+            return self.epochs.get(index, 0)
+
+    def bump_epoch(self, index):
+        with self.lock:
+            self.epochs[index] = self.epochs.get(index, 0) + 1
+            return self.epochs[index]
+
+
+class RedisSessionStore:
+    # Shared by every worker and node, so any instance behind the load
+    # balancer can serve any session. Redis expires idle sessions.
+
+    def __init__(self, url, prefix):
+        if redis is None:
+            raise RuntimeError("SESSION_BACKEND=redis requires the redis package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key)
+        return session_json_serializer.loads(data) if data is not None else None
+
+    def set(self, key, record, ttl):
+        self.client.set(self.prefix + key, session_json_serializer.dumps(record), ex=max(1, int(ttl)))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def index_add(self, index, key, ttl):
+        with self.client.pipeline() as pipe:
+            pipe.sadd(self.prefix + index, key)
+            pipe.expire(self.prefix + index, max(1, int(ttl)))
+            pipe.execute()
+
+    def index_pop(self, index):
+        with self.client.pipeline() as pipe:
+            pipe.smembers(self.prefix + index)
+            pipe.delete(self.prefix + index)
+            members, _ = pipe.execute()
+        return [member.decode() for member in members]
+
+    # Epoch keys do not expire: a session written back by a request racing the
+    # revoke has to meet the new epoch however long it stays in the store
+    def epoch(self, index):
+        value = self.client.get(self.prefix + "epoch:" + index)
+        return int(value) if value is not None else 0
+
+    def bump_epoch(self, index):
+        return self.client.incr(self.prefix + "epoch:" + index)
+
+
+class ServerSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None, checked_at=0.0, touched_at=0.0, epoch=0):
+        super().__init__(initial)
+        self.sid = sid
+        self.checked_at = checked_at  # when the role was last read from app_user
+        self.touched_at = touched_at  # when the store entry's expiry was last extended
+        self.epoch = epoch  # the user's revocation epoch when the session was created
+        self.regenerate = False
+
+
+def regenerate_session(session):
+    # Call on login: the session moves to a new id, so an id planted before
+    # the login (session fixation) is worthless afterwards
+    if isinstance(session, ServerSession):
+        session.regenerate = True
+        session.checked_at = 0.0  # the login has just read the role
+
+
+def session_key(sid):
+    return "session:" + sid
+
+
+def user_index(user_id):
+    return f"user:{user_id}"
+
+
+def new_sid():
+    return secrets.token_urlsafe(32)
+
+
+def load_session(store, sid):
+    # Returns the ServerSession stored under sid (a new empty one when it has
+    # expired or been revoked), with the role refreshed when it is stale
+    record = store.get(session_key(sid)) if sid else None
+    if record is None:
+        return ServerSession()
+
+    session = ServerSession(record["data"], sid, record["checked_at"], record["touched_at"], record.get("epoch", 0))
+    user_id = session.get("user_id")
+    if user_id is not None and session.epoch < store.epoch(user_index(user_id)):
+        store.delete(session_key(sid))  # revoked
+        return ServerSession()
+    if user_id is not None and time.time() - session.checked_at > SESSION_CONFIG["role_ttl"]:
+        cur = get_db_connection().cursor()
+        statements.execute(cur, USER_ROLE_SQL, (user_id,))
+        row = cur.fetchone()
+        cur.close()
+        # The session is loaded before the request is routed; hand the
+        # connection back so the view can get the one its route needs
+        # (a replica for @read_only views)
+        release_db_connection(read_only=True)
+        if row is None:
+            session.clear()  # account removed: log the session out
+        else:
+            session["username"], session["role"] = row
+        session.checked_at = time.time()
+        session.modified = True
+    return session
+
+
+def store_session(store, session):
+    # Writes the session back when it changed (or is due an expiry refresh);
+    # returns True when the browser needs a new cookie
+    now = time.time()
+    ttl = SESSION_CONFIG["ttl"]
+    if not session:
+        if session.sid:
+            store.delete(session_key(session.sid))
+        return False
+
+    new_cookie = session.sid is None or session.regenerate
+    if new_cookie:
+        if session.sid:
+            store.delete(session_key(session.sid))
+        session.sid = new_sid()
+        if "user_id" in session:
+            session.epoch = store.epoch(user_index(session["user_id"]))
+    elif not session.modified and now - session.touched_at < min(60, ttl / 2):
+        return False
+    elif "user_id" in session and session.epoch < store.epoch(user_index(session["user_id"])):
+        # revoked while this request ran: do not write it back
+        store.delete(session_key(session.sid))
+        session.clear()
+        return False
+
+    if "user_id" in session and session.checked_at == 0:
+        session.checked_at = now  # the role was just set by the login
+    session.touched_at = now
+    record = {"data": dict(session), "checked_at": session.checked_at, "touched_at": now, "epoch": session.epoch}
+    store.set(session_key(session.sid), record, ttl)
+    if "user_id" in session:
+        store.index_add(user_index(session["user_id"]), session.sid, ttl)
+    return new_cookie
+
+
+def revoke_user_sessions(store, user_id):
+    # Logs the user out everywhere; returns the number of sessions removed.
+    # The epoch moves first, so a session saved after this point is stale.
+    store.bump_epoch(user_index(user_id))
+    sids = store.index_pop(user_index(user_id))
+    store.delete(*[session_key(sid) for sid in sids])
+    return len(sids)
+
+
+def session_signer(secret_key):
+    return Signer(secret_key, salt="company-portal-session")
+
+
+def read_session_cookie(secret_key, cookie):
+    if not cookie:
+        return None
+    try:
+        return session_signer(secret_key).unsign(cookie).decode()
+    except BadSignature:
+        return None
+
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = read_session_cookie(app.secret_key, request.cookies.get(self.get_cookie_name(app)))
+        return load_session(self.store, sid)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        had_sid = session.sid is not None
+        if store_session(self.store, session):
+            cookie = session_signer(app.secret_key).sign(session.sid).decode()
+            response.set_cookie(name, cookie, expires=self.get_expiration_time(app, session),
+                                httponly=httponly, domain=domain, path=path,
+                                secure=secure, samesite=samesite)
+            response.vary.add("Cookie")
+        elif not session and had_sid:
+            response.delete_cookie(name, domain=domain, path=path,
+                                   secure=secure, samesite=samesite, httponly=httponly)
+            response.vary.add("Cookie")
+
+
+def init_sessions(app):
+    backend = SESSION_CONFIG["backend"]
+    if backend == "redis":
+        store = RedisSessionStore(SESSION_CONFIG["url"], SESSION_CONFIG["prefix"])
+    elif backend == "memory":
+        store = MemorySessionStore(SESSION_CONFIG["max_entries"])
+    else:
+        store = None  # Flask's signed cookie sessions, nothing to revoke
+
+    app.extensions["session_store"] = store
+    if store is not None:
+        app.session_interface = ServerSessionInterface(store)
+    return store
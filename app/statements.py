@@ -0,0 +1,91 @@
+import re
+import threading
+from flask import current_app
+
+# Named statements for the hot queries. Each one is executed with
+# prepare=True, so Postgres parses and plans it once per pooled connection and
+# later executions on that connection reuse the plan. Statements that vary
+# (ORDER BY, optional filters) are registered once per variant, and variants
+# are only ever built from whitelisted values, so the set stays small.
+#
+# The registry counts executions per statement across all connections.
+# Whether a statement is still prepared on a connection is up to psycopg,
+# which evicts the least recently used past PREPARED_MAX, so plan reuse is
+# read from Postgres (pg_prepared_statements) for the connection asking.
+
+STATEMENTS = {}  # name -> SQL
+NAMES = {}  # SQL -> name
+STATS = {}  # name -> executions
+stats_lock = threading.Lock()
+
+# psycopg keeps at most this many prepared statements per connection (LRU)
+PREPARED_MAX = 256
+
+
+def register(name, sql):
+    existing = STATEMENTS.get(name)
+    if existing is None:
+        with stats_lock:
+            STATEMENTS[name] = sql
+            NAMES[sql] = name
+            STATS[name] = 0
+    elif existing != sql:
+        raise ValueError(f"Statement {name} is already registered with different SQL")
+    return sql
+
+
+def configure_connection(conn):
+    # ConnectionPool configure hook, runs once for every new pooled connection
+    conn.prepared_max = PREPARED_MAX
+
+
+def execute(cur, sql, params=None):
+    # Runs sql on cur, prepared if it is a registered statement
+    name = NAMES.get(sql)
+    if name is None:
+        return cur.execute(sql, params)
+
+    with stats_lock:
+        STATS[name] += 1
+    return cur.execute(sql, params, prepare=True)
+
+
+def placeholders_to_markers(sql, pattern):
+    return re.sub(pattern, "?", sql).replace("%%", "%").strip()
+
+
+def connection_statements(conn):
+    # {name: (executions, generic plans)} for the registered statements that
+    # are prepared on conn, and the number of other (automatically prepared)
+    # statements there. psycopg sends "$1"-style placeholders.
+    names = {placeholders_to_markers(sql, r"%\(\w+\)s|%s"): name for sql, name in NAMES.items()}
+    cur = conn.cursor()
+    cur.execute("SELECT statement, generic_plans, custom_plans FROM pg_prepared_statements")
+    prepared, others = {}, 0
+    for statement, generic_plans, custom_plans in cur.fetchall():
+        name = names.get(placeholders_to_markers(statement, r"\$\d+"))
+        if name is None:
+            others += 1
+        else:
+            prepared[name] = (generic_plans + custom_plans, generic_plans)
+    cur.close()
+    return prepared, others
+
+
+def statement_stats(conn):
+    # Executions over every connection; preparation and plan reuse on conn,
+    # the pooled connection serving the request, as a sample of the pool
+    prepared, others = connection_statements(conn)
+    with stats_lock:
+        statements = {}
+        for name, executions in sorted(STATS.items()):
+            here, generic_plans = prepared.get(name, (0, 0))
+            statements[name] = {
+                "executions": executions,
+                "prepared_here": name in prepared,
+                "executions_here": here,
+                "generic_plans_here": generic_plans,
+            }
+    pool = current_app.extensions["db_pool"]
+    return {"prepared_max": PREPARED_MAX, "pool_size": pool.get_stats().get("pool_size", 0),
+            "prepared_here": len(prepared) + others, "statements": statements}
@@ -0,0 +1,101 @@
+import click
+from flask.cli import AppGroup
+from app.db import get_db_connection
+
+stats_cli = AppGroup("stats", help="Maintain the trigger-maintained summary tables.")
+
+# Summary table -> view that recomputes it from scratch, its columns (key
+# first) and the tables whose writers must be blocked during a rebuild
+SUMMARY_TABLES = {
+    "employee_stats": {
+        "source": "employee_stats_source",
+        "columns": ["Ssn", "dependent_count", "project_count", "total_hours"],
+        "lock": "Works_On, Dependent",
+    },
+    "department_stats": {
+        "source": "department_stats_source",
+        "columns": ["Dnumber", "employee_count", "assignment_count", "total_hours"],
+        "lock": "Employee, Works_On",
+    },
+    "department_project_hours": {
+        "source": "department_project_hours_source",
+        "columns": ["Dnumber", "Pno", "assignment_count", "total_hours"],
+        "lock": "Employee, Works_On",
+    },
+}
+
+
+def rebuild_summary(conn, table):
+    summary = SUMMARY_TABLES[table]
+    columns = ", ".join(summary["columns"])
+    cur = conn.cursor()
+    # Block writers so no trigger delta lands between the truncate and the reload
+    cur.execute(f"LOCK TABLE {summary['lock']} IN SHARE MODE")
+    cur.execute(f"TRUNCATE {table}")
+    cur.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {summary['source']}")
+    count = cur.rowcount
+    conn.commit()
+    cur.close()
+    return count
+
+
+def verify_summary(conn, table):
+    # Rows that differ between the summary and a fresh aggregation
+    summary = SUMMARY_TABLES[table]
+    columns = ", ".join(summary["columns"])
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT 'missing' AS problem, * FROM (
+            SELECT {columns} FROM {summary['source']}
+            EXCEPT
+            SELECT {columns} FROM {table}
+        ) AS missing
+        UNION ALL
+        SELECT 'stale' AS problem, * FROM (
+            SELECT {columns} FROM {table}
+            EXCEPT
+            SELECT {columns} FROM {summary['source']}
+        ) AS stale
+        ORDER BY 2, 1
+    """)
+    mismatches = cur.fetchall()
+    cur.close()
+    conn.rollback()
+    return mismatches
+
+
+def selected_tables(table):
+    return [table] if table else list(SUMMARY_TABLES)
+
+
+table_argument = click.argument("table", required=False, type=click.Choice(list(SUMMARY_TABLES)))
+
+
+@stats_cli.command("rebuild")
+@table_argument
+def rebuild_command(table):
+    conn = get_db_connection()
+    for name in selected_tables(table):
+        count = rebuild_summary(conn, name)
+        click.echo(f"{name} rebuilt: {count} rows")
+
+
+@stats_cli.command("verify")
+@table_argument
+def verify_command(table):
+    conn = get_db_connection()
+    failed = 0
+    for name in selected_tables(table):
+        mismatches = verify_summary(conn, name)
+        if not mismatches:
+            click.echo(f"{name} is consistent")
+            continue
+
+        failed += len(mismatches)
+        columns = SUMMARY_TABLES[name]["columns"]
+        for problem, *values in mismatches:
+            fields = " ".join(f"{column}={value}" for column, value in zip(columns, values))
+            click.echo(f"{problem}: {name} {fields}")
+
+    if failed:
+        raise click.ClickException(f"{failed} mismatched rows, run 'flask --app app stats rebuild'")
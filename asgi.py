@@ -0,0 +1,9 @@
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from app import create_app
+from app.aio import AsyncDispatcher, NonEmptyBody, create_async_app
+
+# ASGI entry point: the read-only dashboards run on the async app, every
+# other route on the regular Flask app.
+#   hypercorn asgi:app --bind 127.0.0.1:5000
+flask_app = create_app()
+app = AsyncDispatcher(create_async_app(flask_app), AsyncioWSGIMiddleware(NonEmptyBody(flask_app)))
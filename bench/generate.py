@@ -0,0 +1,193 @@
+import argparse
+import random
+import time
+from datetime import date, timedelta
+from itertools import accumulate
+import psycopg
+from app.db import DATABASE_CONFIG
+from app.stats import SUMMARY_TABLES, rebuild_summary
+
+# Synthetic company data for benchmarking, appended to whatever is already in
+# the database (new keys start after the current maximums). Sizes and skew:
+#   * department sizes follow a Zipf distribution, a few departments are huge
+#   * project popularity is Zipf too, so a few projects have most assignments
+#   * each employee works on 0-6 projects, hours are long-tailed up to 40
+#   * common first/last names repeat a lot, like real name data
+#
+#   python -m bench.generate --employees 100000
+#   python -m bench.generate --employees 10000000 --seed 7
+
+FIRST_NAMES = [
+    "James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+    "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen",
+    "Christopher", "Lisa", "Daniel", "Nancy", "Matthew", "Betty", "Anthony", "Sandra", "Mark", "Margaret",
+    "Donald", "Ashley", "Steven", "Kimberly", "Andrew", "Emily", "Paul", "Donna", "Joshua", "Michelle",
+    "Kenneth", "Carol", "Kevin", "Amanda", "Brian", "Melissa", "George", "Deborah", "Timothy", "Stephanie",
+    "Aaron", "Alicia", "Franklin", "Joyce", "Ramesh", "Ahmad", "Jennifer", "Alex", "Andrea", "Josiah",
+]
+LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+    "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson",
+    "Walker", "Young", "Allen", "King", "Wright", "Scott", "Torres", "Nguyen", "Hill", "Flores",
+    "Green", "Adams", "Nelson", "Baker", "Hall", "Rivera", "Campbell", "Mitchell", "Carter", "Roberts",
+    "Wong", "Zelaya", "Wallace", "Borg", "Narayan", "English", "Jabbar", "Austin", "Ayers", "Timmins",
+]
+LOCATIONS = ["Houston", "Bellaire", "Sugarland", "Stafford", "Redmond", "Guelph", "Toronto", "HQ"]
+DEPARTMENT_WORDS = ["Research", "Marketing", "Administration", "Software", "Hardware", "Sales",
+                    "Finance", "Legal", "Support", "Operations", "Logistics", "Security"]
+PROJECT_WORDS = ["Product", "Computerization", "Reorganization", "Newbenefits", "Migration",
+                 "Platform", "Analytics", "Compliance", "Innovation", "Outreach", "Pipeline", "Audit"]
+RELATIONSHIPS = ["Spouse", "Son", "Daughter"]
+ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+LOADED_TABLES = ["Dependent", "Works_On", "Project", "Employee", "Department"]
+
+
+def zipf_weights(n, s=1.1):
+    return list(accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+
+def random_date(rng, start_year, end_year):
+    start = date(start_year, 1, 1)
+    return start + timedelta(days=rng.randrange((date(end_year, 12, 31) - start).days))
+
+
+def current_maximums(cur):
+    cur.execute("""
+        SELECT
+            (SELECT COALESCE(MAX(Dnumber), 0) FROM Department),
+            (SELECT COALESCE(MAX(Pnumber), 0) FROM Project),
+            (SELECT COALESCE(MAX(Ssn::BIGINT), 100000000) FROM Employee)
+    """)
+    return cur.fetchone()
+
+
+def generate(conn, employees, departments, projects, seed, chunk):
+    rng = random.Random(seed)
+    cur = conn.cursor()
+    max_dno, max_pno, max_ssn = current_maximums(cur)
+    if max_ssn + employees > 999999999:
+        raise SystemExit("Not enough 9-digit SSNs left for that many employees")
+
+    dnumbers = list(range(max_dno + 1, max_dno + departments + 1))
+    pnumbers = list(range(max_pno + 1, max_pno + projects + 1))
+    dept_weights = zipf_weights(departments)
+    project_weights = zipf_weights(projects)
+    first_weights = zipf_weights(len(FIRST_NAMES), 0.8)
+    last_weights = zipf_weights(len(LAST_NAMES), 0.8)
+
+    def ssn(i):
+        return str(max_ssn + 1 + i)
+
+    # Managers are set once the employees exist (Mgr_ssn is a deferred FK anyway)
+    with cur.copy("COPY Department (Dname, Dnumber, Mgr_ssn) FROM STDIN") as copy:
+        for dno in dnumbers:
+            copy.write_row((f"{rng.choice(DEPARTMENT_WORDS)} {dno}", dno, None))
+
+    with cur.copy("COPY Project (Pname, Pnumber, Plocation, Dnum) FROM STDIN") as copy:
+        for pno in pnumbers:
+            dno = rng.choices(dnumbers, cum_weights=dept_weights)[0]
+            copy.write_row((f"{rng.choice(PROJECT_WORDS)} {pno}", pno, rng.choice(LOCATIONS), dno))
+
+    # The first employee placed in each department becomes its manager and the
+    # supervisor of everyone after them
+    managers = {}
+    started = time.perf_counter()
+    for offset in range(0, employees, chunk):
+        with cur.copy("""
+            COPY Employee (Fname, Minit, Lname, Ssn, Address, Sex, Salary, Super_ssn, Dno, BDate, EmpDate)
+            FROM STDIN
+        """) as copy:
+            for i in range(offset, min(offset + chunk, employees)):
+                dno = rng.choices(dnumbers, cum_weights=dept_weights)[0]
+                supervisor = managers.setdefault(dno, ssn(i))
+                copy.write_row((
+                    rng.choices(FIRST_NAMES, cum_weights=first_weights)[0],
+                    rng.choice(ALPHABET),
+                    rng.choices(LAST_NAMES, cum_weights=last_weights)[0],
+                    ssn(i),
+                    f"{rng.randrange(1, 9999)} {rng.choice(LAST_NAMES)} St, {rng.choice(LOCATIONS)}",
+                    rng.choice("MF"),
+                    int(rng.lognormvariate(10.8, 0.4)),
+                    None if supervisor == ssn(i) else supervisor,
+                    dno,
+                    random_date(rng, 1955, 2003),
+                    random_date(rng, 1990, 2025),
+                ))
+
+        with cur.copy("COPY Works_On (Essn, Pno, Hours) FROM STDIN") as copy:
+            for i in range(offset, min(offset + chunk, employees)):
+                count = min(int(rng.expovariate(0.6)), 6)
+                for pno in set(rng.choices(pnumbers, cum_weights=project_weights, k=count)):
+                    copy.write_row((ssn(i), pno, round(min(rng.lognormvariate(2.2, 0.7), 40.0), 1)))
+
+        with cur.copy("COPY Dependent (Essn, Dependent_name, Sex, Bdate, Relationship) FROM STDIN") as copy:
+            for i in range(offset, min(offset + chunk, employees)):
+                count = min(int(rng.expovariate(0.9)), 4)
+                for n in range(count):
+                    relationship = "Spouse" if n == 0 and rng.random() < 0.6 else rng.choice(RELATIONSHIPS[1:])
+                    name = f"{rng.choices(FIRST_NAMES, cum_weights=first_weights)[0]}{n}"
+                    copy.write_row((ssn(i), name, rng.choice("MF"), random_date(rng, 1950, 2024), relationship))
+
+        conn.commit()
+        done = min(offset + chunk, employees)
+        rate = done / (time.perf_counter() - started)
+        print(f"  {done:,}/{employees:,} employees ({rate:,.0f}/s)", flush=True)
+
+    cur.executemany(
+        "UPDATE Department SET Mgr_ssn = %s WHERE Dnumber = %s",
+        [(mgr, dno) for dno, mgr in managers.items()],
+    )
+    conn.commit()
+    cur.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load synthetic benchmark data into company_portal_db.")
+    parser.add_argument("--employees", type=int, default=10000)
+    parser.add_argument("--departments", type=int, help="default: one per 500 employees, at least 5")
+    parser.add_argument("--projects", type=int, help="default: one per 50 employees, at least 10")
+    parser.add_argument("--seed", type=int, default=3530)
+    parser.add_argument("--chunk", type=int, default=50000, help="employees per COPY batch and commit")
+    parser.add_argument("--keep-triggers", action="store_true",
+                        help="maintain the summary tables row by row instead of rebuilding them afterwards")
+    args = parser.parse_args()
+
+    departments = args.departments or max(5, args.employees // 500)
+    projects = args.projects or max(10, args.employees // 50)
+
+    conn = psycopg.connect(**DATABASE_CONFIG)
+    cur = conn.cursor()
+    if not args.keep_triggers:
+        # Row-by-row summary triggers dominate the load time; the summaries
+        # are rebuilt from scratch once the data is in
+        for table in LOADED_TABLES:
+            cur.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+        conn.commit()
+
+    print(f"Generating {args.employees:,} employees, {departments:,} departments, {projects:,} projects")
+    started = time.perf_counter()
+    try:
+        generate(conn, args.employees, departments, projects, args.seed, args.chunk)
+    finally:
+        # Also runs after a failed load: earlier batches are already committed
+        conn.rollback()
+        if not args.keep_triggers:
+            for table in LOADED_TABLES:
+                cur.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+                # the change counters were switched off too (sql/data_versions.sql)
+                cur.execute("SELECT data_version_bump(%s)", (table.lower(),))
+            conn.commit()
+            for table in SUMMARY_TABLES:
+                print(f"  {table} rebuilt: {rebuild_summary(conn, table):,} rows")
+
+    conn.autocommit = True
+    cur.execute("ANALYZE")
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+    cur.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
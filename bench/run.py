@@ -0,0 +1,311 @@
+import argparse
+import json
+import os
+import sys
+import time
+import platform
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+from app import create_app
+from app.aggregation import AGGREGATION_CONFIG
+from app.db import get_db_connection
+from app.metrics import METRICS_CONFIG
+
+# Benchmark harness: drives each route through the Flask test client (default)
+# or over HTTP against a running server, and reports p50/p95/p99 latency,
+# throughput and the query plans behind each route.
+#
+#   python -m bench.run --save-baseline bench/baselines/local.json
+#   python -m bench.run --baseline bench/baselines/local.json
+#   python -m bench.run --http http://127.0.0.1:5000 --concurrency 8
+
+ADMIN_LOGIN = {"username": "admin", "password": "test123"}
+
+# name -> (method, path, form data); {ssn}, {pnumber}, {dnumber} and {name}
+# are filled from sample rows so the routes hit real data at any scale. JOB
+# routes POST to start a background job and are timed until the job finishes.
+ROUTES = {
+    "employees_overview": ("GET", "/", None),
+    "employees_overview_filtered": ("GET", "/?department={dnumber}&name={name}&sort=hours_desc", None),
+    "employees_overview_relevance": ("GET", "/?name={name}&sort=relevance", None),
+    "employee_search": ("GET", "/search?q={name}", None),
+    "employees_export": ("GET", "/export", None),
+    "employee_list": ("GET", "/employees/manage", None),
+    "employee_add_form": ("GET", "/employees/add", None),
+    "employee_edit_form": ("GET", "/employees/edit/{ssn}", None),
+    "projects_all": ("GET", "/projects/all", None),
+    "projects_sorted": ("POST", "/projects/all", {"method": "total_hours", "direction": "DESC"}),
+    "project_detail": ("GET", "/projects/{pnumber}", None),
+    "project_employee_picker": ("GET", "/projects/employees?q={prefix}", None),
+    "project_hours_upsert": ("POST", "/projects/{pnumber}", {"employee": "{ssn}", "hours": "0"}),
+    "project_download": ("JOB", "/projects/download/headcount/DESC", None),
+    "managers_overview": ("GET", "/managers/overview", None),
+    "department_projects": ("GET", "/managers/{dnumber}/projects", None),
+}
+
+
+JOB_POLL_SECONDS = 0.02
+JOB_TIMEOUT_SECONDS = 600
+
+
+def wait_for_job(fetch, path, data):
+    # fetch(method, path, data, headers) -> (status, body). Starts the job and
+    # polls its status URL; 200 when it succeeded, 500 when it failed
+    status, body = fetch("POST", path, data, {"Accept": "application/json"})
+    if status != 202:
+        return status
+    status_url = json.loads(body)["status"]
+    deadline = time.perf_counter() + JOB_TIMEOUT_SECONDS
+    while time.perf_counter() < deadline:
+        status, body = fetch("GET", status_url, None, {})
+        if status != 200:
+            return status
+        job = json.loads(body)
+        if job["finished"]:
+            return 200 if job["status"] == "succeeded" else 500
+        time.sleep(JOB_POLL_SECONDS)
+    return 504
+
+
+def sample_values(app):
+    # The busiest department and project and one of their employees
+    with app.app_context():
+        cur = get_db_connection().cursor()
+        cur.execute("""
+            SELECT w.Pno, e.Ssn, e.Dno, e.Fname
+            FROM Works_On w
+            JOIN Employee e ON e.Ssn = w.Essn
+            WHERE w.Pno = (SELECT Pno FROM Works_On GROUP BY Pno ORDER BY COUNT(*) DESC LIMIT 1)
+            LIMIT 1
+        """)
+        pnumber, ssn, dnumber, name = cur.fetchone()
+        cur.execute("SELECT COUNT(*) FROM Employee")
+        employees = cur.fetchone()[0]
+        cur.close()
+    return {"pnumber": pnumber, "ssn": ssn, "dnumber": dnumber, "name": name, "prefix": name[:2]}, employees
+
+
+def fill(template, values):
+    if template is None:
+        return None
+    if isinstance(template, dict):
+        return {key: fill(value, values) for key, value in template.items()}
+    return template.format(**values)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def summarize(timings, statuses, elapsed):
+    timings = sorted(timings)
+    ms = [t * 1000 for t in timings]
+    return {
+        "requests": len(timings),
+        "p50_ms": round(percentile(ms, 0.50), 2),
+        "p95_ms": round(percentile(ms, 0.95), 2),
+        "p99_ms": round(percentile(ms, 0.99), 2),
+        "mean_ms": round(sum(ms) / len(ms), 2),
+        "throughput_rps": round(len(timings) / elapsed, 1) if elapsed else None,
+        "statuses": {str(code): statuses.count(code) for code in sorted(set(statuses))},
+    }
+
+
+class ClientRunner:
+    # In-process: no network, one request at a time through the test client
+
+    def __init__(self, app):
+        self.app = app
+        self.client = app.test_client()
+        self.client.post("/auth/login", data=ADMIN_LOGIN)
+
+    def fetch(self, method, path, data, headers):
+        response = self.client.open(path, method=method, data=data, headers=headers)
+        return response.status_code, response.get_data()  # consume streamed bodies
+
+    def request(self, method, path, data):
+        start = time.perf_counter()
+        if method == "JOB":
+            status = wait_for_job(self.fetch, path, data)
+        else:
+            status, _ = self.fetch(method, path, data, {})
+        return time.perf_counter() - start, status
+
+    def run(self, method, path, data, count, concurrency):
+        timings, statuses = [], []
+        started = time.perf_counter()
+        for _ in range(count):
+            seconds, status = self.request(method, path, data)
+            timings.append(seconds)
+            statuses.append(status)
+        return timings, statuses, time.perf_counter() - started
+
+    def plans(self, method, path, data):
+        # Run the route once with every statement treated as slow, ANALYZE on,
+        # no EXPLAIN throttle and the result cache bypassed, so the metrics
+        # module captures an EXPLAIN (ANALYZE, BUFFERS) plan for each
+        # statement the route runs
+        registry = self.app.extensions["metrics"]
+        cache = self.app.extensions["result_cache"]
+        saved = {name: METRICS_CONFIG[name]
+                 for name in ("slow_query_ms", "slow_query_explain", "slow_query_explain_every", "slow_query_analyze")}
+        registry.slow_log.clear()
+        METRICS_CONFIG.update(slow_query_ms=0.000001, slow_query_explain=True,
+                              slow_query_explain_every=0, slow_query_analyze=True)
+        self.app.extensions["result_cache"] = None
+        try:
+            self.request(method, path, data)
+        finally:
+            METRICS_CONFIG.update(saved)
+            self.app.extensions["result_cache"] = cache
+        entries = list(registry.slow_log)
+        registry.slow_log.clear()
+        return [{"sql": entry["sql"], "ms": entry["ms"], "plan": entry["plan"], "seq_scans": entry["seq_scans"]}
+                for entry in entries]
+
+
+class HttpRunner:
+    # Against a running server, with a session cookie per worker thread
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.openers = {}
+
+    def opener(self):
+        key = threading.get_ident()
+        if key not in self.openers:
+            opener = build_opener(HTTPCookieProcessor(CookieJar()))
+            opener.open(self.base_url + "/auth/login", urlencode(ADMIN_LOGIN).encode())
+            self.openers[key] = opener
+        return self.openers[key]
+
+    def fetch(self, method, path, data, headers):
+        body = urlencode(data).encode() if data is not None else (b"" if method == "POST" else None)
+        request = Request(self.base_url + path, data=body, method=method, headers=headers)
+        try:
+            with self.opener().open(request) as response:
+                return response.status, response.read()
+        except HTTPError as e:
+            return e.code, e.read()
+
+    def request(self, method, path, data):
+        start = time.perf_counter()
+        if method == "JOB":
+            status = wait_for_job(self.fetch, path, data)
+        else:
+            status, _ = self.fetch(method, path, data, {})
+        return time.perf_counter() - start, status
+
+    def run(self, method, path, data, count, concurrency):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda _: self.request(method, path, data), range(count)))
+        elapsed = time.perf_counter() - started
+        return [seconds for seconds, _ in results], [status for _, status in results], elapsed
+
+    def plans(self, method, path, data):
+        return []  # plans are only captured in-process
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    # A route regresses when its median is both tolerance (relative) and
+    # min_delta_ms (absolute) slower than the baseline; the median is much
+    # less noisy than p95 at a few dozen requests per route
+    regressions = []
+    for name, current in results["routes"].items():
+        previous = baseline.get("routes", {}).get(name)
+        if previous is None:
+            continue
+        limit = previous["p50_ms"] * (1 + tolerance)
+        delta = current["p50_ms"] - previous["p50_ms"]
+        marker = ""
+        if current["p50_ms"] > limit and delta > min_delta_ms:
+            regressions.append(name)
+            marker = "  REGRESSION"
+        print(f"  {name:32} p50 {previous['p50_ms']:9.2f} -> {current['p50_ms']:9.2f} ms"
+              f"  p95 {previous['p95_ms']:9.2f} -> {current['p95_ms']:9.2f} ms{marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the company portal routes.")
+    parser.add_argument("--routes", nargs="*", choices=sorted(ROUTES), help="default: all routes")
+    parser.add_argument("--requests", type=int, default=50, help="timed requests per route")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed requests per route")
+    parser.add_argument("--http", metavar="URL", help="benchmark a running server instead of the test client")
+    parser.add_argument("--concurrency", type=int, default=1, help="parallel requests (--http only)")
+    parser.add_argument("--no-plans", action="store_true", help="skip capturing query plans")
+    parser.add_argument("--aggregation", choices=["auto", "single", "parallel"],
+                        help="AGGREGATION_MODE for the test client app (default: the environment's)")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="compare against a results file, exit 1 on regressions")
+    parser.add_argument("--save-baseline", help="write the results as a new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative p50 slowdown")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    if args.aggregation:
+        AGGREGATION_CONFIG["mode"] = args.aggregation
+    app = create_app()
+    values, employees = sample_values(app)
+    runner = HttpRunner(args.http) if args.http else ClientRunner(app)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "mode": "http" if args.http else "client",
+            "concurrency": args.concurrency if args.http else 1,
+            "requests_per_route": args.requests,
+            "aggregation": AGGREGATION_CONFIG["mode"] if not args.http else None,
+            "employees": employees,
+            "python": platform.python_version(),
+            "samples": values,
+        },
+        "routes": {},
+    }
+
+    print(f"Benchmarking {employees:,} employees ({results['meta']['mode']} mode, "
+          f"{results['meta']['aggregation'] or 'server'} aggregation)")
+    for name in args.routes or ROUTES:
+        method, path, data = ROUTES[name]
+        path, data = fill(path, values), fill(data, values)
+        for _ in range(args.warmup):
+            runner.request(method, path, data)
+        timings, statuses, elapsed = runner.run(method, path, data, args.requests, args.concurrency)
+        summary = summarize(timings, statuses, elapsed)
+        if not args.no_plans:
+            summary["plans"] = runner.plans(method, path, data)
+        results["routes"][name] = summary
+        print(f"  {name:32} p50 {summary['p50_ms']:8.2f}  p95 {summary['p95_ms']:8.2f}  "
+              f"p99 {summary['p99_ms']:8.2f} ms  {summary['throughput_rps']:8.1f} req/s  {summary['statuses']}")
+        for plan in summary.get("plans", ()):
+            for table, rows in plan["seq_scans"]:
+                print(f"    \033[1;91msequential scan of {table} reading {rows:,} rows\033[0m: {plan['sql'][:80]}")
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2, default=str)
+            print(f"Results written to {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.baseline} ({baseline['meta']['employees']:,} employees):")
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"{len(regressions)} route(s) regressed: {', '.join(regressions)}")
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from werkzeug.security import generate_password_hash
+from app.passwords import PASSWORD_CONFIG
 import psycopg
 import os
 from dotenv import load_dotenv
@@ -18,7 +19,7 @@ cur = conn.cursor()
 # --- ADMIN ACCOUNT ---
 admin_username = "admin"
 admin_password = "test123"
-admin_hash = generate_password_hash(admin_password)
+admin_hash = generate_password_hash(admin_password, PASSWORD_CONFIG["method"])
 
 cur.execute("""
     INSERT INTO app_user (username, password_hash, role)
@@ -29,7 +30,7 @@ cur.execute("""
 # --- VIEWER ACCOUNT ---
 viewer_username = "viewer"
 viewer_password = "viewer123"
-viewer_hash = generate_password_hash(viewer_password)
+viewer_hash = generate_password_hash(viewer_password, PASSWORD_CONFIG["method"])
 
 cur.execute("""
     INSERT INTO app_user (username, password_hash, role)
@@ -0,0 +1,9 @@
+-- migrate: no-transaction
+
+-- Project list and project detail read works_on by Pno for Essn and Hours
+-- (SUM(Hours), COUNT(DISTINCT Essn) per project). With both columns in the
+-- index those become index-only scans instead of a heap visit per row.
+-- It replaces the plain idx_workson_pno from sql/team_setup.sql.
+DROP INDEX CONCURRENTLY IF EXISTS idx_works_on_pno_covering;
+CREATE INDEX CONCURRENTLY idx_works_on_pno_covering ON works_on (Pno) INCLUDE (Essn, Hours);
+DROP INDEX CONCURRENTLY IF EXISTS idx_workson_pno;
@@ -0,0 +1,11 @@
+-- migrate: no-transaction
+
+-- Per-employee hour totals (employee overview, employee_stats triggers) read
+-- works_on by Essn. Carrying Hours in the primary key index answers them
+-- from the index alone. The new index is built without blocking writes and
+-- then swapped in as the primary key, which only needs a short lock.
+DROP INDEX CONCURRENTLY IF EXISTS works_on_pkey_covering;
+CREATE UNIQUE INDEX CONCURRENTLY works_on_pkey_covering ON works_on (Essn, Pno) INCLUDE (Hours);
+ALTER TABLE works_on
+    DROP CONSTRAINT works_on_pkey,
+    ADD CONSTRAINT works_on_pkey PRIMARY KEY USING INDEX works_on_pkey_covering;
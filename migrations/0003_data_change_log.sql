@@ -0,0 +1,55 @@
+-- Data version counters without a row lock per table: the statement
+-- triggers only append to data_change (see sql/data_versions.sql), so
+-- concurrent writers to a table no longer queue behind each other.
+
+CREATE TABLE IF NOT EXISTS data_version (
+    table_name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+);
+
+CREATE TABLE IF NOT EXISTS data_change (
+    id BIGSERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+);
+
+CREATE INDEX IF NOT EXISTS idx_data_change_table ON data_change (table_name);
+
+CREATE OR REPLACE FUNCTION data_version_compact()
+RETURNS void AS $$
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(353000020) THEN
+        RETURN;
+    END IF;
+    WITH moved AS (
+        DELETE FROM data_change RETURNING table_name, changed_at
+    )
+    INSERT INTO data_version AS v (table_name, version, changed_at)
+    SELECT table_name, COUNT(*), MAX(changed_at) FROM moved GROUP BY table_name
+    ON CONFLICT (table_name) DO UPDATE
+    SET version = v.version + EXCLUDED.version,
+        changed_at = GREATEST(v.changed_at, EXCLUDED.changed_at);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION data_version_bump(p_table TEXT)
+RETURNS void AS $$
+DECLARE
+    change_id BIGINT;
+BEGIN
+    INSERT INTO data_change (table_name) VALUES (p_table) RETURNING id INTO change_id;
+    IF change_id % 1000 = 0 THEN
+        PERFORM data_version_compact();
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION data_version_trg()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM data_version_bump(TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
@@ -0,0 +1,29 @@
+-- Department rollups: Works_On changes lock the employee row so they cannot
+-- race a department change (see sql/department_stats.sql).
+
+CREATE OR REPLACE FUNCTION department_stats_works_on_trg()
+RETURNS trigger AS $$
+DECLARE
+    old_dno INT;
+    new_dno INT;
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT Dno INTO new_dno FROM Employee WHERE Ssn = NEW.Essn FOR SHARE;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT Dno INTO old_dno FROM Employee WHERE Ssn = OLD.Essn FOR SHARE;
+        -- OLD.Essn is gone when an Ssn change cascades here: same employee
+        old_dno := COALESCE(old_dno, new_dno);
+    END IF;
+
+    IF old_dno IS NOT NULL THEN
+        PERFORM department_stats_apply(old_dno, 0, -1, -OLD.Hours);
+        PERFORM department_project_hours_apply(old_dno, OLD.Pno, -1, -OLD.Hours);
+    END IF;
+    IF new_dno IS NOT NULL THEN
+        PERFORM department_stats_apply(new_dno, 0, 1, NEW.Hours);
+        PERFORM department_project_hours_apply(new_dno, NEW.Pno, 1, NEW.Hours);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,8 @@
+-- migrate: no-transaction
+
+-- Employee picker (/projects/employees): name-prefix match and keyset order
+-- on the lowercased full name. The trigram index cannot return rows in name
+-- order, so each page sorted every employee matching the prefix. In the "C"
+-- collation a B-tree serves both the LIKE prefix and the ORDER BY.
+DROP INDEX CONCURRENTLY IF EXISTS idx_employee_search_name_prefix;
+CREATE INDEX CONCURRENTLY idx_employee_search_name_prefix ON employee ((lower(search_name) COLLATE "C"), ssn);
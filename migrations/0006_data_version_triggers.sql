@@ -0,0 +1,19 @@
+-- Migration 0003 created the data_change log and its functions but not the
+-- statement triggers or the data_version rows (see sql/data_versions.sql).
+-- A database built by the migration runner alone never moved its counters,
+-- so the pages' ETags never changed. Safe to run where the setup script
+-- already installed them.
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['department', 'employee', 'dept_location', 'project', 'works_on', 'dependent'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS data_version_changed ON %I', t);
+        EXECUTE format('CREATE TRIGGER data_version_changed
+                        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I
+                        FOR EACH STATEMENT EXECUTE FUNCTION data_version_trg()', t);
+        INSERT INTO data_version (table_name) VALUES (t) ON CONFLICT DO NOTHING;
+    END LOOP;
+END;
+$$;
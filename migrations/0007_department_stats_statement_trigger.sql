@@ -0,0 +1,134 @@
+-- Department rollups: Works_On changes are applied once per statement, one
+-- delta per department in Dnumber order, and a department change locks both
+-- department rows in that order first. Batches over several departments no
+-- longer lock the rollup rows in input order (see sql/department_stats.sql).
+
+-- BEFORE trigger: the employee's Works_On rows are still under the old Ssn at
+-- this point, and any cascaded Works_On update that follows finds the employee
+-- already in the new department, so it does not move the hours a second time.
+CREATE OR REPLACE FUNCTION department_stats_employee_trg()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM department_stats_apply(NEW.Dno, 1, 0, 0);
+        RETURN NEW;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        PERFORM department_stats_apply_assignments(OLD.Ssn, OLD.Dno, -1);
+        PERFORM department_stats_apply(OLD.Dno, -1, 0, 0);
+        RETURN OLD;
+    END IF;
+
+    IF OLD.Dno <> NEW.Dno THEN
+        -- Both departments' rows first, in Dnumber order like the Works_On trigger
+        PERFORM 1 FROM department_stats
+        WHERE Dnumber IN (OLD.Dno, NEW.Dno)
+        ORDER BY Dnumber
+        FOR UPDATE;
+        PERFORM department_stats_apply_assignments(OLD.Ssn, OLD.Dno, -1);
+        PERFORM department_stats_apply(OLD.Dno, -1, 0, 0);
+        PERFORM department_stats_apply(NEW.Dno, 1, 0, 0);
+        PERFORM department_stats_apply_assignments(OLD.Ssn, NEW.Dno, 1);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Per-row deltas of one Works_On statement, by the department the employee is
+-- in: -1 assignment for each old row, +1 for each new one.
+CREATE OR REPLACE FUNCTION department_stats_works_on_deltas(p_old Works_On[], p_new Works_On[])
+RETURNS TABLE (dno INT, pno INT, assignments INT, hours DECIMAL) AS $$
+    SELECT COALESCE(e.Dno, moved.Dno), o.Pno, -1, -o.Hours
+    FROM unnest(p_old) o
+    LEFT JOIN Employee e ON e.Ssn = o.Essn
+    -- o.Essn is gone when an Ssn change cascades here: same employee, whose
+    -- new row is the one on the same project
+    LEFT JOIN LATERAL (
+        SELECT ne.Dno
+        FROM unnest(p_new) n
+        JOIN Employee ne ON ne.Ssn = n.Essn
+        WHERE e.Ssn IS NULL AND n.Pno = o.Pno
+        LIMIT 1
+    ) moved ON true
+    UNION ALL
+    SELECT e.Dno, n.Pno, 1, n.Hours
+    FROM unnest(p_new) n
+    JOIN Employee e ON e.Ssn = n.Essn
+$$ LANGUAGE sql STABLE;
+
+-- Statement trigger, from the statement's transition tables: one delta per
+-- department (and per department and project), applied in Dnumber order.
+-- Applied row by row, a batch over several departments (a bulk import, the
+-- batch hours upsert) locked the hot department rows in input order, so two
+-- such batches could deadlock.
+--
+-- FOR SHARE waits for a department change in progress on the employees (the
+-- foreign key check's KEY SHARE lock does not): otherwise an assignment
+-- written while the employee moves is added to the old department after the
+-- move has already carried the employee's other hours across. Once the locks
+-- are held the Dno cannot change until this transaction ends, and a move that
+-- starts later sees these assignments. They are taken in Ssn order too.
+CREATE OR REPLACE FUNCTION department_stats_works_on_trg()
+RETURNS trigger AS $$
+DECLARE
+    old_rows Works_On[] := '{}';
+    new_rows Works_On[] := '{}';
+    d RECORD;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT COALESCE(array_agg(o), '{}') INTO old_rows FROM old_works_on o;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT COALESCE(array_agg(n), '{}') INTO new_rows FROM new_works_on n;
+    END IF;
+
+    PERFORM 1 FROM Employee
+    WHERE Ssn IN (SELECT Essn FROM unnest(old_rows) UNION SELECT Essn FROM unnest(new_rows))
+    ORDER BY Ssn
+    FOR SHARE;
+
+    FOR d IN
+        SELECT dno, SUM(assignments)::INT AS assignments, SUM(hours) AS hours
+        FROM department_stats_works_on_deltas(old_rows, new_rows)
+        WHERE dno IS NOT NULL
+        GROUP BY dno
+        HAVING SUM(assignments) <> 0 OR SUM(hours) <> 0
+        ORDER BY dno
+    LOOP
+        PERFORM department_stats_apply(d.dno, 0, d.assignments, d.hours);
+    END LOOP;
+
+    FOR d IN
+        SELECT dno, pno, SUM(assignments)::INT AS assignments, SUM(hours) AS hours
+        FROM department_stats_works_on_deltas(old_rows, new_rows)
+        WHERE dno IS NOT NULL
+        GROUP BY dno, pno
+        HAVING SUM(assignments) <> 0 OR SUM(hours) <> 0
+        ORDER BY dno, pno
+    LOOP
+        PERFORM department_project_hours_apply(d.dno, d.pno, d.assignments, d.hours);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A trigger with transition tables can only fire on one kind of statement
+DROP TRIGGER IF EXISTS department_stats_works_on ON Works_On;
+DROP TRIGGER IF EXISTS department_stats_works_on_insert ON Works_On;
+CREATE TRIGGER department_stats_works_on_insert
+AFTER INSERT ON Works_On
+REFERENCING NEW TABLE AS new_works_on
+FOR EACH STATEMENT EXECUTE FUNCTION department_stats_works_on_trg();
+
+DROP TRIGGER IF EXISTS department_stats_works_on_update ON Works_On;
+CREATE TRIGGER department_stats_works_on_update
+AFTER UPDATE ON Works_On
+REFERENCING OLD TABLE AS old_works_on NEW TABLE AS new_works_on
+FOR EACH STATEMENT EXECUTE FUNCTION department_stats_works_on_trg();
+
+DROP TRIGGER IF EXISTS department_stats_works_on_delete ON Works_On;
+CREATE TRIGGER department_stats_works_on_delete
+AFTER DELETE ON Works_On
+REFERENCING OLD TABLE AS old_works_on
+FOR EACH STATEMENT EXECUTE FUNCTION department_stats_works_on_trg();
@@ -0,0 +1,274 @@
+BEGIN;
+
+-- Per-department rollups read by the Managers Overview (A6). Kept current by the
+-- triggers below so the page no longer joins every employee's assignments.
+DROP TABLE IF EXISTS department_stats CASCADE;
+DROP TABLE IF EXISTS department_project_hours CASCADE;
+
+CREATE TABLE department_stats (
+    Dnumber INT NOT NULL,
+    employee_count INT NOT NULL DEFAULT 0,
+    assignment_count INT NOT NULL DEFAULT 0,
+    total_hours DECIMAL NOT NULL DEFAULT 0,
+    PRIMARY KEY(Dnumber)
+);
+
+-- Hours worked on each project by the employees of a department (drill-down)
+CREATE TABLE department_project_hours (
+    Dnumber INT NOT NULL,
+    Pno INT NOT NULL,
+    assignment_count INT NOT NULL DEFAULT 0,
+    total_hours DECIMAL NOT NULL DEFAULT 0,
+    PRIMARY KEY(Dnumber, Pno)
+);
+
+-- Department lookups for the employee foreign key and the rollup rebuild
+CREATE INDEX IF NOT EXISTS idx_employee_dno ON Employee(Dno);
+
+-- Same numbers the overview used to compute by joining Employee and Works_On.
+-- Used to rebuild and verify the rollups.
+CREATE OR REPLACE VIEW department_stats_source AS
+WITH emp_counts AS (
+    SELECT Dno, COUNT(*) AS employee_count
+    FROM Employee
+    GROUP BY Dno
+),
+hour_stats AS (
+    SELECT e.Dno, COUNT(*) AS assignment_count, SUM(w.Hours) AS total_hours
+    FROM Works_On w
+    JOIN Employee e ON e.Ssn = w.Essn
+    GROUP BY e.Dno
+)
+SELECT ec.Dno AS Dnumber,
+       ec.employee_count::INT AS employee_count,
+       COALESCE(hs.assignment_count, 0)::INT AS assignment_count,
+       COALESCE(hs.total_hours, 0) AS total_hours
+FROM emp_counts ec
+LEFT JOIN hour_stats hs ON hs.Dno = ec.Dno;
+
+CREATE OR REPLACE VIEW department_project_hours_source AS
+SELECT e.Dno AS Dnumber,
+       w.Pno,
+       COUNT(*)::INT AS assignment_count,
+       SUM(w.Hours) AS total_hours
+FROM Works_On w
+JOIN Employee e ON e.Ssn = w.Essn
+GROUP BY e.Dno, w.Pno;
+
+-- Apply a delta to one department's rollup. Rows that drop back to zero are
+-- removed, the overview treats a missing row as all zeros.
+CREATE OR REPLACE FUNCTION department_stats_apply(p_dno INT, p_employees INT, p_assignments INT, p_hours DECIMAL)
+RETURNS void AS $$
+BEGIN
+    INSERT INTO department_stats AS s (Dnumber, employee_count, assignment_count, total_hours)
+    VALUES (p_dno, p_employees, p_assignments, p_hours)
+    ON CONFLICT (Dnumber) DO UPDATE
+    SET employee_count = s.employee_count + EXCLUDED.employee_count,
+        assignment_count = s.assignment_count + EXCLUDED.assignment_count,
+        total_hours = CASE
+            WHEN s.assignment_count + EXCLUDED.assignment_count = 0 THEN 0
+            ELSE s.total_hours + EXCLUDED.total_hours
+        END;
+
+    DELETE FROM department_stats
+    WHERE Dnumber = p_dno AND employee_count = 0 AND assignment_count = 0;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION department_project_hours_apply(p_dno INT, p_pno INT, p_assignments INT, p_hours DECIMAL)
+RETURNS void AS $$
+BEGIN
+    INSERT INTO department_project_hours AS s (Dnumber, Pno, assignment_count, total_hours)
+    VALUES (p_dno, p_pno, p_assignments, p_hours)
+    ON CONFLICT (Dnumber, Pno) DO UPDATE
+    SET assignment_count = s.assignment_count + EXCLUDED.assignment_count,
+        total_hours = s.total_hours + EXCLUDED.total_hours;
+
+    DELETE FROM department_project_hours
+    WHERE Dnumber = p_dno AND Pno = p_pno AND assignment_count = 0;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Move (sign = 1 adds, -1 removes) one employee's assignments into a department
+CREATE OR REPLACE FUNCTION department_stats_apply_assignments(p_ssn CHAR(9), p_dno INT, p_sign INT)
+RETURNS void AS $$
+DECLARE
+    a RECORD;
+BEGIN
+    FOR a IN SELECT Pno, Hours FROM Works_On WHERE Essn = p_ssn LOOP
+        PERFORM department_stats_apply(p_dno, 0, p_sign, p_sign * a.Hours);
+        PERFORM department_project_hours_apply(p_dno, a.Pno, p_sign, p_sign * a.Hours);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- BEFORE trigger: the employee's Works_On rows are still under the old Ssn at
+-- this point, and any cascaded Works_On update that follows finds the employee
+-- already in the new department, so it does not move the hours a second time.
+CREATE OR REPLACE FUNCTION department_stats_employee_trg()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM department_stats_apply(NEW.Dno, 1, 0, 0);
+        RETURN NEW;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        PERFORM department_stats_apply_assignments(OLD.Ssn, OLD.Dno, -1);
+        PERFORM department_stats_apply(OLD.Dno, -1, 0, 0);
+        RETURN OLD;
+    END IF;
+
+    IF OLD.Dno <> NEW.Dno THEN
+        -- Both departments' rows first, in Dnumber order like the Works_On trigger
+        PERFORM 1 FROM department_stats
+        WHERE Dnumber IN (OLD.Dno, NEW.Dno)
+        ORDER BY Dnumber
+        FOR UPDATE;
+        PERFORM department_stats_apply_assignments(OLD.Ssn, OLD.Dno, -1);
+        PERFORM department_stats_apply(OLD.Dno, -1, 0, 0);
+        PERFORM department_stats_apply(NEW.Dno, 1, 0, 0);
+        PERFORM department_stats_apply_assignments(OLD.Ssn, NEW.Dno, 1);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Per-row deltas of one Works_On statement, by the department the employee is
+-- in: -1 assignment for each old row, +1 for each new one.
+CREATE OR REPLACE FUNCTION department_stats_works_on_deltas(p_old Works_On[], p_new Works_On[])
+RETURNS TABLE (dno INT, pno INT, assignments INT, hours DECIMAL) AS $$
+    SELECT COALESCE(e.Dno, moved.Dno), o.Pno, -1, -o.Hours
+    FROM unnest(p_old) o
+    LEFT JOIN Employee e ON e.Ssn = o.Essn
+    -- o.Essn is gone when an Ssn change cascades here: same employee, whose
+    -- new row is the one on the same project
+    LEFT JOIN LATERAL (
+        SELECT ne.Dno
+        FROM unnest(p_new) n
+        JOIN Employee ne ON ne.Ssn = n.Essn
+        WHERE e.Ssn IS NULL AND n.Pno = o.Pno
+        LIMIT 1
+    ) moved ON true
+    UNION ALL
+    SELECT e.Dno, n.Pno, 1, n.Hours
+    FROM unnest(p_new) n
+    JOIN Employee e ON e.Ssn = n.Essn
+$$ LANGUAGE sql STABLE;
+
+-- Statement trigger, from the statement's transition tables: one delta per
+-- department (and per department and project), applied in Dnumber order.
+-- Applied row by row, a batch over several departments (a bulk import, the
+-- batch hours upsert) locked the hot department rows in input order, so two
+-- such batches could deadlock.
+--
+-- FOR SHARE waits for a department change in progress on the employees (the
+-- foreign key check's KEY SHARE lock does not): otherwise an assignment
+-- written while the employee moves is added to the old department after the
+-- move has already carried the employee's other hours across. Once the locks
+-- are held the Dno cannot change until this transaction ends, and a move that
+-- starts later sees these assignments. They are taken in Ssn order too.
+CREATE OR REPLACE FUNCTION department_stats_works_on_trg()
+RETURNS trigger AS $$
+DECLARE
+    old_rows Works_On[] := '{}';
+    new_rows Works_On[] := '{}';
+    d RECORD;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT COALESCE(array_agg(o), '{}') INTO old_rows FROM old_works_on o;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT COALESCE(array_agg(n), '{}') INTO new_rows FROM new_works_on n;
+    END IF;
+
+    PERFORM 1 FROM Employee
+    WHERE Ssn IN (SELECT Essn FROM unnest(old_rows) UNION SELECT Essn FROM unnest(new_rows))
+    ORDER BY Ssn
+    FOR SHARE;
+
+    FOR d IN
+        SELECT dno, SUM(assignments)::INT AS assignments, SUM(hours) AS hours
+        FROM department_stats_works_on_deltas(old_rows, new_rows)
+        WHERE dno IS NOT NULL
+        GROUP BY dno
+        HAVING SUM(assignments) <> 0 OR SUM(hours) <> 0
+        ORDER BY dno
+    LOOP
+        PERFORM department_stats_apply(d.dno, 0, d.assignments, d.hours);
+    END LOOP;
+
+    FOR d IN
+        SELECT dno, pno, SUM(assignments)::INT AS assignments, SUM(hours) AS hours
+        FROM department_stats_works_on_deltas(old_rows, new_rows)
+        WHERE dno IS NOT NULL
+        GROUP BY dno, pno
+        HAVING SUM(assignments) <> 0 OR SUM(hours) <> 0
+        ORDER BY dno, pno
+    LOOP
+        PERFORM department_project_hours_apply(d.dno, d.pno, d.assignments, d.hours);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- TRUNCATE skips row triggers, so reset the affected rollups explicitly
+CREATE OR REPLACE FUNCTION department_stats_truncate_trg()
+RETURNS trigger AS $$
+BEGIN
+    DELETE FROM department_project_hours;
+    IF TG_TABLE_NAME = 'works_on' THEN
+        UPDATE department_stats SET assignment_count = 0, total_hours = 0;
+    ELSE
+        UPDATE department_stats SET employee_count = 0, assignment_count = 0, total_hours = 0;
+    END IF;
+    DELETE FROM department_stats WHERE employee_count = 0 AND assignment_count = 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS department_stats_employee ON Employee;
+CREATE TRIGGER department_stats_employee
+BEFORE INSERT OR UPDATE OF Dno OR DELETE ON Employee
+FOR EACH ROW EXECUTE FUNCTION department_stats_employee_trg();
+
+DROP TRIGGER IF EXISTS department_stats_employee_truncate ON Employee;
+CREATE TRIGGER department_stats_employee_truncate
+AFTER TRUNCATE ON Employee
+FOR EACH STATEMENT EXECUTE FUNCTION department_stats_truncate_trg();
+
+-- A trigger with transition tables can only fire on one kind of statement
+DROP TRIGGER IF EXISTS department_stats_works_on ON Works_On;
+DROP TRIGGER IF EXISTS department_stats_works_on_insert ON Works_On;
+CREATE TRIGGER department_stats_works_on_insert
+AFTER INSERT ON Works_On
+REFERENCING NEW TABLE AS new_works_on
+FOR EACH STATEMENT EXECUTE FUNCTION department_stats_works_on_trg();
+
+DROP TRIGGER IF EXISTS department_stats_works_on_update ON Works_On;
+CREATE TRIGGER department_stats_works_on_update
+AFTER UPDATE ON Works_On
+REFERENCING OLD TABLE AS old_works_on NEW TABLE AS new_works_on
+FOR EACH STATEMENT EXECUTE FUNCTION department_stats_works_on_trg();
+
+DROP TRIGGER IF EXISTS department_stats_works_on_delete ON Works_On;
+CREATE TRIGGER department_stats_works_on_delete
+AFTER DELETE ON Works_On
+REFERENCING OLD TABLE AS old_works_on
+FOR EACH STATEMENT EXECUTE FUNCTION department_stats_works_on_trg();
+
+DROP TRIGGER IF EXISTS department_stats_works_on_truncate ON Works_On;
+CREATE TRIGGER department_stats_works_on_truncate
+AFTER TRUNCATE ON Works_On
+FOR EACH STATEMENT EXECUTE FUNCTION department_stats_truncate_trg();
+
+-- Initial load
+INSERT INTO department_stats (Dnumber, employee_count, assignment_count, total_hours)
+SELECT Dnumber, employee_count, assignment_count, total_hours
+FROM department_stats_source;
+
+INSERT INTO department_project_hours (Dnumber, Pno, assignment_count, total_hours)
+SELECT Dnumber, Pno, assignment_count, total_hours
+FROM department_project_hours_source;
+
+COMMIT;
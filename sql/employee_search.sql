@@ -0,0 +1,16 @@
+BEGIN;
+
+-- Trigram search for the employee name filter and the typeahead endpoint.
+-- A leading-wildcard ILIKE on Fname || ' ' || Minit || ' ' || Lname cannot use the
+-- idx_employee_name B-tree, so the full name is stored in a generated column and
+-- indexed with a pg_trgm GIN index, which supports ILIKE '%x%' and similarity (%).
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE Employee
+  ADD COLUMN IF NOT EXISTS search_name TEXT
+  GENERATED ALWAYS AS (Fname || ' ' || Minit || ' ' || Lname) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_employee_search_name_trgm
+  ON Employee USING GIN (search_name gin_trgm_ops);
+
+COMMIT;
@@ -0,0 +1,133 @@
+BEGIN;
+
+-- Per-employee summary read by the Employees Overview (A2). Kept current by the
+-- triggers below so the page no longer aggregates all of Dependent and Works_On.
+DROP TABLE IF EXISTS employee_stats CASCADE;
+
+CREATE TABLE employee_stats (
+    Ssn CHAR(9) NOT NULL,
+    dependent_count INT NOT NULL DEFAULT 0,
+    project_count INT NOT NULL DEFAULT 0,
+    total_hours DECIMAL NOT NULL DEFAULT 0,
+    PRIMARY KEY(Ssn)
+);
+
+-- Same numbers the overview used to compute with its dep_counts/proj_stats CTEs.
+-- Used to rebuild and verify employee_stats.
+CREATE OR REPLACE VIEW employee_stats_source AS
+WITH dep_counts AS (
+    SELECT Essn, COUNT(*) AS dependent_count
+    FROM Dependent
+    GROUP BY Essn
+),
+proj_stats AS (
+    SELECT Essn,
+           COUNT(DISTINCT Pno) AS project_count,
+           SUM(Hours) AS total_hours
+    FROM Works_On
+    GROUP BY Essn
+)
+SELECT COALESCE(dc.Essn, ps.Essn) AS Ssn,
+       COALESCE(dc.dependent_count, 0)::INT AS dependent_count,
+       COALESCE(ps.project_count, 0)::INT AS project_count,
+       COALESCE(ps.total_hours, 0) AS total_hours
+FROM dep_counts dc
+FULL JOIN proj_stats ps ON ps.Essn = dc.Essn;
+
+-- Apply a delta to one employee's summary row. Rows that drop back to zero are
+-- removed, the overview treats a missing row as all zeros.
+CREATE OR REPLACE FUNCTION employee_stats_apply(p_ssn CHAR(9), p_dependents INT, p_projects INT, p_hours DECIMAL)
+RETURNS void AS $$
+BEGIN
+    INSERT INTO employee_stats AS s (Ssn, dependent_count, project_count, total_hours)
+    VALUES (p_ssn, p_dependents, p_projects, p_hours)
+    ON CONFLICT (Ssn) DO UPDATE
+    SET dependent_count = s.dependent_count + EXCLUDED.dependent_count,
+        project_count = s.project_count + EXCLUDED.project_count,
+        total_hours = CASE
+            WHEN s.project_count + EXCLUDED.project_count = 0 THEN 0
+            ELSE s.total_hours + EXCLUDED.total_hours
+        END;
+
+    DELETE FROM employee_stats
+    WHERE Ssn = p_ssn AND dependent_count = 0 AND project_count = 0;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION employee_stats_works_on_trg()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.Essn = NEW.Essn THEN
+        IF OLD.Hours <> NEW.Hours THEN
+            PERFORM employee_stats_apply(NEW.Essn, 0, 0, NEW.Hours - OLD.Hours);
+        END IF;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM employee_stats_apply(OLD.Essn, 0, -1, -OLD.Hours);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM employee_stats_apply(NEW.Essn, 0, 1, NEW.Hours);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION employee_stats_dependent_trg()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.Essn = NEW.Essn THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM employee_stats_apply(OLD.Essn, -1, 0, 0);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM employee_stats_apply(NEW.Essn, 1, 0, 0);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- TRUNCATE skips row triggers, so reset the affected counters explicitly
+CREATE OR REPLACE FUNCTION employee_stats_truncate_trg()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'works_on' THEN
+        UPDATE employee_stats SET project_count = 0, total_hours = 0;
+    ELSE
+        UPDATE employee_stats SET dependent_count = 0;
+    END IF;
+    DELETE FROM employee_stats WHERE dependent_count = 0 AND project_count = 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS employee_stats_works_on ON Works_On;
+CREATE TRIGGER employee_stats_works_on
+AFTER INSERT OR UPDATE OR DELETE ON Works_On
+FOR EACH ROW EXECUTE FUNCTION employee_stats_works_on_trg();
+
+DROP TRIGGER IF EXISTS employee_stats_works_on_truncate ON Works_On;
+CREATE TRIGGER employee_stats_works_on_truncate
+AFTER TRUNCATE ON Works_On
+FOR EACH STATEMENT EXECUTE FUNCTION employee_stats_truncate_trg();
+
+DROP TRIGGER IF EXISTS employee_stats_dependent ON Dependent;
+CREATE TRIGGER employee_stats_dependent
+AFTER INSERT OR UPDATE OR DELETE ON Dependent
+FOR EACH ROW EXECUTE FUNCTION employee_stats_dependent_trg();
+
+DROP TRIGGER IF EXISTS employee_stats_dependent_truncate ON Dependent;
+CREATE TRIGGER employee_stats_dependent_truncate
+AFTER TRUNCATE ON Dependent
+FOR EACH STATEMENT EXECUTE FUNCTION employee_stats_truncate_trg();
+
+-- Initial load
+INSERT INTO employee_stats (Ssn, dependent_count, project_count, total_hours)
+SELECT Ssn, dependent_count, project_count, total_hours
+FROM employee_stats_source;
+
+COMMIT;
@@ -0,0 +1,27 @@
+BEGIN;
+
+-- Background jobs (app/jobs.py): long imports and exports run in a worker
+-- process while the browser polls this row for progress. Result holds the
+-- job's counts and per-row errors; file is the finished export, if any.
+CREATE TABLE IF NOT EXISTS jobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'succeeded', 'failed')),
+    params JSONB NOT NULL DEFAULT '{}',
+    created_by TEXT,
+    rows_done INT NOT NULL DEFAULT 0,
+    rows_total INT,
+    result JSONB,
+    error TEXT,
+    file_path TEXT,
+    file_name TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    started_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at TIMESTAMPTZ
+);
+
+-- Old jobs are purged by age
+CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs (created_at);
+
+COMMIT;
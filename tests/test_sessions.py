@@ -0,0 +1,52 @@
+from app.sessions import (
+    MemorySessionStore, ServerSession, load_session, revoke_user_sessions, session_key, store_session, user_index,
+)
+
+# Server-side session store (app/sessions.py), memory backend. No database:
+# a new session is saved with its role marked as just checked, so loading them does not
+# read app_user.
+
+
+def login(store, user_id):
+    session = ServerSession({"user_id": user_id, "username": f"user{user_id}", "role": "viewer"})
+    store_session(store, session)  # records the role as just checked
+    return session.sid
+
+
+def test_index_keeps_every_session_of_a_user():
+    store = MemorySessionStore(100)
+    sids = {login(store, 7) for _ in range(3)}
+    assert set(store.indexes[user_index(7)]) == sids
+
+
+def test_revoke_logs_out_every_session_of_the_user():
+    store = MemorySessionStore(100)
+    sids = [login(store, 7) for _ in range(3)]
+    other = login(store, 8)
+
+    assert revoke_user_sessions(store, 7) == 3
+    for sid in sids:
+        assert store.get(session_key(sid)) is None
+        assert "user_id" not in load_session(store, sid)
+    assert load_session(store, other)["user_id"] == 8
+
+
+def test_session_saved_after_revoke_is_not_restored():
+    store = MemorySessionStore(100)
+    sid = login(store, 7)
+    session = load_session(store, sid)  # a request in flight
+
+    revoke_user_sessions(store, 7)
+    session["_flashes"] = [("message", "saved")]
+    store_session(store, session)
+
+    assert store.get(session_key(sid)) is None
+    assert "user_id" not in load_session(store, sid)
+
+
+def test_index_forgets_evicted_sessions():
+    store = MemorySessionStore(2)
+    first = login(store, 7)
+    login(store, 7)
+    login(store, 7)  # evicts the first
+    assert first not in store.indexes[user_index(7)]